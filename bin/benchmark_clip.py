@@ -0,0 +1,173 @@
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+
+
+DESCRIPTION = '''Clip and mask a synthetic DEM (a tiled GeoTIFF of the given
+size) to a polygon covering part of it, reporting the wall time and the
+peak memory of the process. The clip is written to a GeoTIFF, so its
+memory use should not grow with the size of the raster. With --full,
+the raster is then also masked the old way, reading whole bands into
+memory, for comparison. Does not require django settings.'''
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        '-s',
+        '--size',
+        type=int,
+        default=20000,
+        help='Width and height of the raster in cells. Default is 20000.',
+        dest='size',
+    )
+    parser.add_argument(
+        '-b',
+        '--block-size',
+        type=int,
+        default=256,
+        help='Tile size of the raster. Default is 256.',
+        dest='block_size',
+    )
+    parser.add_argument(
+        '-c',
+        '--cache',
+        type=int,
+        default=64,
+        help='GDAL cache size in MB. Default is 64.',
+        dest='cache',
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Also mask the raster reading whole bands, as before.',
+        dest='full',
+    )
+    return vars(parser.parse_args(argv))
+
+
+def peak_memory():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def make_dem(path, size, block_size):
+    import numpy
+    from django.contrib.gis.gdal import GDALRaster
+
+    dem = GDALRaster({
+        'driver': 'GTiff',
+        'name': path,
+        'srid': 4326,
+        'width': size,
+        'height': size,
+        'origin': (-120.0, 45.0),
+        'scale': (0.001, -0.001),
+        'nr_of_bands': 1,
+        'datatype': 3,
+        'papsz_options': {
+            'tiled': 'yes',
+            'blockxsize': block_size,
+            'blockysize': block_size,
+        },
+    })
+    band = dem.bands[0]
+    band.nodata_value = -9999
+
+    # a sloping surface, written a row of blocks at a time
+    cols = numpy.arange(size, dtype=numpy.int16) % 3000
+    for row in xrange(0, size, block_size):
+        height = min(block_size, size - row)
+        rows = numpy.arange(row, row + height, dtype=numpy.int16)
+        data = (rows[:, numpy.newaxis] % 1000) + cols
+        band.data(data=data, offset=(0, row), size=(size, height))
+    dem._flush()
+    return dem
+
+
+def make_polygon(dem):
+    from django.contrib.gis.gdal import OGRGeometry
+
+    # a circle over the middle half of the raster
+    xmin, ymin, xmax, ymax = dem.extent
+    center = OGRGeometry('POINT ({} {})'.format(
+        (xmin + xmax) / 2, (ymin + ymax) / 2,
+    ))
+    polygon = center.geos.buffer((xmax - xmin) / 4, quadsegs=64).ogr
+    polygon.srs = dem.srs
+    return polygon
+
+
+def full_mask(dem, polygon):
+    """the old mask: whole bands and a full-size mask in memory"""
+    from django.contrib.gis.gdal import GDALRaster
+    from ebagis.utils.gis.raster.clip import burn
+
+    masked = GDALRaster({
+        'srid': dem.srid,
+        'width': dem.width,
+        'height': dem.height,
+        'origin': dem.origin,
+        'scale': dem.scale,
+        'skew': dem.skew,
+        'nr_of_bands': 1,
+        'datatype': 5,
+    })
+    burn(masked, polygon)
+    mask = masked.bands[0].data() == 0
+    for band in dem.bands:
+        data = band.data()
+        data[mask] = band.nodata_value
+    return data
+
+
+def main(size, block_size, cache, full):
+    # must be set before GDAL is loaded
+    os.environ['GDAL_CACHEMAX'] = str(cache)
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    from ebagis.utils.gis.raster.clip import extend_raster
+
+    tmp = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        dem = extend_raster(
+            make_dem(os.path.join(tmp, 'dem.tif'), size, block_size)
+        )
+        polygon = make_polygon(dem)
+        print('{0}x{0} cells ({1:.0f} MB), made in {2:.1f} s\n'.format(
+            size, size * size * 2 / 2.0**20, time.time() - start,
+        ))
+        print('{:<24}{:>10}{:>16}'.format(
+            'operation', 'wall (s)', 'peak mem (MB)',
+        ))
+
+        operations = [
+            ('clip', lambda: dem.clip(
+                polygon, name=os.path.join(tmp, 'clip.tif'))),
+            ('clip and mask', lambda: dem.clip(
+                polygon, mask=True, name=os.path.join(tmp, 'mask.tif'))),
+        ]
+        if full:
+            operations.append(('full mask (old)',
+                               lambda: full_mask(dem, polygon)))
+
+        for name, operation in operations:
+            start = time.time()
+            operation()
+            print('{:<24}{:>10.2f}{:>16.1f}'.format(
+                name, time.time() - start, peak_memory(),
+            ))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    sys.exit(main(**parse_args(sys.argv[1:])))
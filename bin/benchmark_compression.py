@@ -0,0 +1,112 @@
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+
+DESCRIPTION = '''Zip a directory (e.g., an extracted AOI download) with
+each of a set of compression policies, reporting the CPU time, wall
+time, and size of the archive for each. The policies are given the
+default export settings explicitly, so the benchmark does not depend on
+the instance's settings, and does not use the database.'''
+
+
+# the defaults of the EBAGIS_EXPORT_STORED_EXTENSIONS and
+# EBAGIS_EXPORT_MIN_COMPRESSION_SAVINGS settings, as without django
+# the policies would not store any files by extension or sample
+STORED_EXTENSIONS = (
+    ".zip", ".gz", ".bz2", ".7z", ".xz",
+    ".jpg", ".jpeg", ".png", ".jp2", ".j2k", ".sid", ".ecw",
+)
+MIN_SAVINGS = 0.05
+
+
+def directory(path):
+    if not os.path.isdir(path):
+        raise argparse.ArgumentTypeError(
+            "Path is not a directory: {}".format(path)
+        )
+    return path
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        'directory',
+        type=directory,
+        help='Path to the directory to zip',
+    )
+    parser.add_argument(
+        '-t',
+        '--zstd-threads',
+        type=int,
+        default=-1,
+        help='Number of threads for the multi-threaded zstd policy. '
+             'Default is -1, one per CPU.',
+        dest='zstd_threads',
+    )
+    return vars(parser.parse_args(argv))
+
+
+def policies(zstd_threads):
+    from ebagis.utils.compression import CompressionPolicy, zstandard
+
+    # the old behavior: deflate everything at the default level
+    yield 'deflate-6 (all)', CompressionPolicy(stored_extensions=(),
+                                               sample_size=0)
+    yield 'store', CompressionPolicy('store')
+
+    def policy(method, level, **kwargs):
+        return CompressionPolicy(method, level,
+                                 stored_extensions=STORED_EXTENSIONS,
+                                 min_savings=MIN_SAVINGS, **kwargs)
+
+    for level in (1, 6, 9):
+        yield 'deflate-{}'.format(level), policy('deflate', level)
+
+    if zstandard is None:
+        print('zstandard is not installed; skipping zstd policies\n')
+        return
+
+    for level in (1, 3, 9):
+        yield 'zstd-{}'.format(level), policy('zstd', level)
+    yield 'zstd-3 (mt)', policy('zstd', 3, threads=zstd_threads)
+
+
+def main(directory, zstd_threads):
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    from ebagis.utils.zipfile import zip_directory
+
+    total = sum(os.path.getsize(os.path.join(root, f))
+                for root, dirs, files in os.walk(directory)
+                for f in files)
+    print('{}: {:.1f} MB\n'.format(directory, total / 2.0**20))
+    print('{:<18}{:>10}{:>10}{:>12}{:>8}'.format(
+        'policy', 'cpu (s)', 'wall (s)', 'size (MB)', 'ratio',
+    ))
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for name, policy in policies(zstd_threads):
+            zip_path = os.path.join(tmp, 'benchmark.zip')
+            cpu, wall = sum(os.times()[:2]), time.time()
+            # one thread, so only the policies are compared
+            zip_directory(directory, zip_path, policy, workers=1)
+            cpu, wall = sum(os.times()[:2]) - cpu, time.time() - wall
+            size = os.path.getsize(zip_path)
+            os.remove(zip_path)
+            print('{:<18}{:>10.2f}{:>10.2f}{:>12.1f}{:>8.3f}'.format(
+                name, cpu, wall, size / 2.0**20, float(size) / total,
+            ))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    sys.exit(main(**parse_args(sys.argv[1:])))
@@ -0,0 +1,154 @@
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+
+
+DESCRIPTION = '''Time ID allocation with generate_uuid as the FileData table
+grows, against the old approach of scanning all the IDs in the table.
+Rows are bulk inserted in a transaction that is rolled back, so no
+records are left behind, and their directory is made in a temp
+directory that is removed afterwards. The scan is skipped above
+--scan-limit rows as it quickly gets too slow to be worth waiting for.'''
+
+
+class Rollback(Exception):
+    pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        '-s',
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=[0, 10000, 100000, 1000000],
+        help='Table sizes at which to time allocation. '
+             'Default is 0 10000 100000 1000000.',
+        dest='sizes',
+    )
+    parser.add_argument(
+        '-n',
+        '--iterations',
+        type=int,
+        default=100,
+        help='Number of IDs to allocate at each size. Default is 100.',
+        dest='iterations',
+    )
+    parser.add_argument(
+        '--scan-limit',
+        type=int,
+        default=100000,
+        help='Largest table size at which to time the '
+             'table scan approach. Default is 100000.',
+        dest='scan_limit',
+    )
+    return vars(parser.parse_args(argv))
+
+
+def setup_django():
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ebagis.settings")
+    import django
+    django.setup()
+
+
+def generate_uuid_scan(model_class):
+    """the original implementation, for comparison"""
+    existing_ids = model_class.objects.values_list('id', flat=True)
+    while True:
+        id = uuid.uuid4()
+        if id not in existing_ids:
+            break
+    return id
+
+
+def make_parent_file(parent_directory):
+    from django.contrib.gis.geos import Point, Polygon, MultiPolygon
+    from ebagis.data.models import AOI, PourPoint, Directory, File
+
+    pourpoint = PourPoint(name='benchmark',
+                          location=Point(0, 0),
+                          source=PourPoint.SOURCE_REFERENCE)
+    pourpoint.save()
+    aoi = AOI(name='benchmark',
+              shortname='benchmark',
+              boundary=MultiPolygon(
+                  Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0)))
+              ),
+              pourpoint=pourpoint)
+    aoi.save()
+    directory = Directory(aoi=aoi,
+                          name='benchmark',
+                          _parent_directory=parent_directory)
+    directory.save()
+    _file = File(aoi=aoi, name='benchmark', _parent_object=directory)
+    _file.save()
+    return _file
+
+
+def grow_table(parent, count, batch_size=10000):
+    from ebagis.data.models import FileData
+
+    while count > 0:
+        batch = min(count, batch_size)
+        FileData._base_manager.bulk_create([
+            FileData(id=uuid.uuid4(),
+                     aoi=parent.aoi,
+                     _parent_object=parent,
+                     classname='FileData',
+                     sha256='0' * 64)
+            for _ in xrange(batch)
+        ])
+        count -= batch
+
+
+def time_allocation(funct, model_class, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        funct(model_class)
+    return (time.time() - start) / iterations * 1000
+
+
+def main(sizes, iterations, scan_limit):
+    setup_django()
+
+    from django.db import transaction
+    from ebagis.data.models import FileData
+    from ebagis.utils.validation import generate_uuid
+
+    print('{:>10}{:>16}{:>16}'.format('rows', 'lookup (ms)', 'scan (ms)'))
+    tempdir = tempfile.mkdtemp()
+    try:
+        with transaction.atomic():
+            parent = make_parent_file(tempdir)
+            rows = 0
+            for size in sorted(sizes):
+                grow_table(parent, size - rows)
+                rows = size
+
+                lookup = time_allocation(generate_uuid, FileData, iterations)
+                if rows <= scan_limit:
+                    scan = '{:.3f}'.format(time_allocation(
+                        generate_uuid_scan, FileData, iterations
+                    ))
+                else:
+                    scan = '-'
+                print('{:>10}{:>16.3f}{:>16}'.format(rows, lookup, scan))
+            raise Rollback()
+    except Rollback:
+        pass
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main(**parse_args(sys.argv[1:])))
@@ -0,0 +1,160 @@
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+
+DESCRIPTION = '''Compare the number of queries and wall time of creating
+the records for an import one save() at a time against staging
+them in an import session and inserting them in bulk. Everything
+is done in a transaction that is rolled back, so no records are
+left behind, and the files are written to a temp directory.'''
+
+
+class Rollback(Exception):
+    pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        '-n',
+        '--files',
+        type=int,
+        default=500,
+        help='Number of files to import. Default is 500.',
+        dest='files',
+    )
+    parser.add_argument(
+        '-d',
+        '--directories',
+        type=int,
+        default=10,
+        help='Number of directories across which to '
+             'split the files. Default is 10.',
+        dest='directories',
+    )
+    parser.add_argument(
+        '-s',
+        '--size',
+        type=int,
+        default=4096,
+        help='Size of each file in bytes. Default is 4096.',
+        dest='size',
+    )
+    return vars(parser.parse_args(argv))
+
+
+def setup_django():
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ebagis.settings")
+    import django
+    django.setup()
+
+
+def make_source_files(root, count, size):
+    paths = []
+    for i in xrange(count):
+        path = os.path.join(root, "file_{}.dat".format(i))
+        with open(path, 'wb') as f:
+            # distinct content so the blob store cannot dedup
+            f.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def make_aoi(name):
+    from django.contrib.gis.geos import Point, Polygon, MultiPolygon
+    from ebagis.data.models import AOI, PourPoint
+
+    pourpoint = PourPoint(name=name,
+                          location=Point(0, 0),
+                          source=PourPoint.SOURCE_REFERENCE)
+    pourpoint.save()
+    aoi = AOI(name=name,
+              shortname=name[:25],
+              boundary=MultiPolygon(
+                  Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0)))
+              ),
+              pourpoint=pourpoint)
+    aoi.save()
+    return aoi
+
+
+def import_files(aoi, root, sources, directories):
+    from ebagis.data.models import Directory, File
+    from ebagis.data.models.importer import persist
+
+    per_dir = len(sources) // directories + 1
+    for i in xrange(directories):
+        directory = Directory(aoi=aoi,
+                              name="dir_{}".format(i),
+                              _parent_directory=root)
+        directory.prepare()
+        os.mkdir(directory.path)
+        persist(directory)
+
+        for src in sources[i*per_dir:(i+1)*per_dir]:
+            File.create(src, directory, None)
+
+
+def run(label, funct, root):
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+
+    os.mkdir(root)
+    start = time.time()
+    try:
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                funct()
+            elapsed = time.time() - start
+            raise Rollback()
+    except Rollback:
+        pass
+
+    print('{:<12}{:>10}{:>12.3f}'.format(label, len(queries), elapsed))
+
+
+def main(files, directories, size):
+    setup_django()
+
+    from django.conf import settings
+    from ebagis.data.models.importer import import_session
+
+    tmp = tempfile.mkdtemp()
+    settings.AOI_BLOB_DIRECTORY = os.path.join(tmp, 'blobs')
+
+    try:
+        source_dir = os.path.join(tmp, 'src')
+        os.mkdir(source_dir)
+        sources = make_source_files(source_dir, files, size)
+
+        def per_object():
+            aoi = make_aoi('benchmark_per_object')
+            import_files(aoi, os.path.join(tmp, 'per_object'),
+                         sources, directories)
+
+        def bulk():
+            aoi = make_aoi('benchmark_bulk')
+            with import_session() as session:
+                import_files(aoi, os.path.join(tmp, 'bulk'),
+                             sources, directories)
+            session.flush()
+
+        print('{} files in {} directories'.format(files, directories))
+        print('{:<12}{:>10}{:>12}'.format('method', 'queries', 'seconds'))
+        run('per-object', per_object, os.path.join(tmp, 'per_object'))
+        run('bulk', bulk, os.path.join(tmp, 'bulk'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    sys.exit(main(**parse_args(sys.argv[1:])))
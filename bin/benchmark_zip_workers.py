@@ -0,0 +1,107 @@
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+
+
+DESCRIPTION = '''Zip a directory (e.g., an extracted AOI download) with
+different numbers of compression worker threads, reporting the wall time,
+CPU time, and size of the archive for each. Each archive is checked
+with testzip. Does not require django.'''
+
+
+def directory(path):
+    if not os.path.isdir(path):
+        raise argparse.ArgumentTypeError(
+            "Path is not a directory: {}".format(path)
+        )
+    return path
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        'directory',
+        type=directory,
+        help='Path to the directory to zip',
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        nargs='+',
+        default=[1, 2, 4, 8],
+        help='Numbers of workers to test. Default is 1 2 4 8.',
+        dest='workers',
+    )
+    parser.add_argument(
+        '-c',
+        '--chunk-size',
+        type=int,
+        default=2**20,
+        help='Size in bytes of the chunks compressed by the workers. '
+             'Default is 1 MiB.',
+        dest='chunk_size',
+    )
+    parser.add_argument(
+        '-l',
+        '--level',
+        type=int,
+        default=6,
+        help='Deflate compression level. Default is 6.',
+        dest='level',
+    )
+    return vars(parser.parse_args(argv))
+
+
+def main(directory, workers, chunk_size, level):
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    from ebagis.utils.compression import CompressionPolicy, PolicyZipFile
+    from ebagis.utils.filesystem import walk_files
+
+    entries = list(walk_files(directory))
+    total = sum(os.path.getsize(path) for arcname, path in entries)
+    print('{}: {} files, {:.1f} MB\n'.format(
+        directory, len(entries), total / 2.0**20,
+    ))
+    print('{:<10}{:>10}{:>10}{:>10}{:>12}'.format(
+        'workers', 'wall (s)', 'cpu (s)', 'speedup', 'size (MB)',
+    ))
+
+    tmp = tempfile.mkdtemp()
+    baseline = None
+    try:
+        for count in workers:
+            zip_path = os.path.join(tmp, 'benchmark.zip')
+            cpu, wall = sum(os.times()[:2]), time.time()
+            with PolicyZipFile(zip_path, 'w',
+                               policy=CompressionPolicy(level=level),
+                               workers=count,
+                               chunk_size=chunk_size) as zipf:
+                zipf.write_entries(entries)
+            cpu, wall = sum(os.times()[:2]) - cpu, time.time() - wall
+            baseline = baseline or wall
+
+            with zipfile.ZipFile(zip_path) as zipf:
+                bad = zipf.testzip()
+            if bad:
+                print('{:<10}archive is corrupt at {}'.format(count, bad))
+
+            print('{:<10}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.1f}'.format(
+                count, wall, cpu, baseline / wall,
+                os.path.getsize(zip_path) / 2.0**20,
+            ))
+            os.remove(zip_path)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    sys.exit(main(**parse_args(sys.argv[1:])))
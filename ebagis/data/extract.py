@@ -0,0 +1,194 @@
+"""Clipped extracts of the stored rasters.
+
+Rather than exporting whole geodatabases, clients can get just the
+part of one or more rasters covering a bbox or geometry as GeoTIFFs,
+optionally reprojected and/or resampled. Extracts are clipped (and
+masked) with windowed reads, see utils.gis.raster.clip, so only the
+cells in the geometry's window are ever read, and only those are
+warped if a CRS or resolution is asked for.
+
+Extracts are written to the EBAGIS_EXTRACTS_DIRECTORY, named with a
+hash of the request. The hash includes the sha256 of each raster
+version, so a cached extract never goes stale, and repeated requests
+are served straight from disk (by stream_file, so with range requests
+and offloading). Old extracts are removed with the expired downloads,
+see delete_expired.
+
+As extracts are built within the request, those that would read or
+write more than EBAGIS_EXTRACT_MAX_CELLS cells of a raster are refused
+before anything is read, see check_size."""
+from __future__ import absolute_import
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from math import ceil
+
+from django.conf import settings
+from django.contrib.gis.gdal import GDALRaster
+
+from ebagis.utils.filesystem import tempdirectory
+from ebagis.utils.gis.raster.clip import extend_raster, pixel_window
+from ebagis.utils.zipfile import zip_entries
+
+
+logger = logging.getLogger(__name__)
+
+RASTER_EXT = ".tif"
+ARCHIVE_EXT = ".zip"
+
+
+def request_hash(versions, geometry, mask=True, srid=None, resolution=None):
+    sha1 = hashlib.sha1()
+    for version in versions:
+        sha1.update(version.sha256)
+    sha1.update(bytes(geometry.ewkb))
+    sha1.update(json.dumps([mask, srid, resolution]))
+    return sha1.hexdigest()
+
+
+def check_size(raster, geometry, srid=None, resolution=None,
+                max_cells=None):
+    """Raises ValueError if the extract of the raster would read more
+    than max_cells cells, i.e., the geometry's window of the raster is
+    too big, or write more, i.e., the geometry's extent in the output
+    CRS is too big for the resolution"""
+    if max_cells is None:
+        return
+
+    ogr_geom = geometry.ogr
+    ogr_geom.transform(raster.srs)
+    col, row, width, height = pixel_window(raster, ogr_geom.extent)
+    if width * height > max_cells:
+        raise ValueError(
+            "The area covers {} cells of the raster; the limit is {}."
+            .format(width * height, max_cells)
+        )
+
+    if resolution is not None:
+        if srid is not None:
+            ogr_geom = geometry.ogr
+            ogr_geom.transform(srid)
+        xmin, ymin, xmax, ymax = ogr_geom.extent
+        cells = int(ceil((xmax - xmin) / resolution)) * \
+            int(ceil((ymax - ymin) / resolution))
+        if cells > max_cells:
+            raise ValueError(
+                "The extract would have {} cells at that resolution; "
+                "the limit is {}.".format(cells, max_cells)
+            )
+
+
+def extract_raster(path, geometry, output, mask=True,
+                   srid=None, resolution=None, tempdir=None):
+    """Writes the part of the raster at path in the geometry's extent
+    (and only the cells in the geometry if mask) to a GeoTIFF at
+    output, transformed to the srid and resampled to the resolution
+    (in the units of the output CRS) if given"""
+    raster = extend_raster(GDALRaster(path))
+    if srid is None and resolution is None:
+        raster.clip(geometry.ogr, mask=mask, name=output)
+        return output
+
+    # only the clipped window is warped
+    clipped = raster.clip(geometry.ogr, mask=mask,
+                          name=os.path.join(tempdir, "clip" + RASTER_EXT))
+
+    if srid is not None and srid != clipped.srid:
+        name = output if resolution is None else \
+            os.path.join(tempdir, "transform" + RASTER_EXT)
+        clipped = clipped.transform(srid, driver='GTiff', name=name)
+
+    if resolution is not None:
+        scale_x, scale_y = clipped.scale
+        clipped.warp({
+            'driver': 'GTiff',
+            'name': output,
+            'width': int(ceil(clipped.width * abs(scale_x) / resolution)),
+            'height': int(ceil(clipped.height * abs(scale_y) / resolution)),
+            'scale': (resolution if scale_x > 0 else -resolution,
+                      resolution if scale_y > 0 else -resolution),
+        })
+    return output
+
+
+def get_extract(rasters, geometry, mask=True, srid=None, resolution=None):
+    """Returns the path of the extract of the (name, version) rasters,
+    building it if it is not in the EBAGIS_EXTRACTS_DIRECTORY already.
+    The extract of one raster is a GeoTIFF, otherwise it is a zip of
+    a GeoTIFF per raster, named with the raster names. Raises
+    ValueError if the area does not overlap a raster, or the extract
+    of one would be too big (see check_size)."""
+    directory = settings.EBAGIS_EXTRACTS_DIRECTORY
+    ext = RASTER_EXT if len(rasters) == 1 else ARCHIVE_EXT
+    path = os.path.join(directory, request_hash(
+        [version for name, version in rasters],
+        geometry, mask, srid, resolution,
+    ) + ext)
+    if os.path.exists(path):
+        # so extracts in use don't expire
+        os.utime(path, None)
+        return path
+
+    for name, version in rasters:
+        check_size(GDALRaster(version.path), geometry, srid, resolution,
+                   max_cells=settings.EBAGIS_EXTRACT_MAX_CELLS)
+
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # someone else may have just made it
+            if not os.path.isdir(directory):
+                raise
+
+    # built in a temp directory beside the cache, and moved into place
+    # at once, so a concurrent request never serves a partial extract
+    with tempdirectory(dir=directory) as tempdir:
+        entries = []
+        for index, (name, version) in enumerate(rasters):
+            # for the intermediate files of this raster
+            work = os.path.join(tempdir, str(index))
+            os.mkdir(work)
+            output = os.path.join(tempdir, name + RASTER_EXT)
+            extract_raster(version.path, geometry, output,
+                           mask=mask, srid=srid, resolution=resolution,
+                           tempdir=work)
+            entries.append((name + RASTER_EXT, output))
+
+        if ext == ARCHIVE_EXT:
+            built = zip_entries(entries,
+                                os.path.join(tempdir, "extract" + ext),
+                                workers=settings.EBAGIS_EXPORT_WORKERS)
+        else:
+            built = entries[0][1]
+        os.rename(built, path)
+    return path
+
+
+def delete_expired():
+    """Removes the extracts older than the EXPIRATION_DELTA,
+    returning the number removed"""
+    directory = settings.EBAGIS_EXTRACTS_DIRECTORY
+    if not os.path.isdir(directory):
+        return 0
+
+    cutoff = time.time() - settings.EXPIRATION_DELTA.total_seconds()
+    count = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if os.path.isdir(path):
+                # left by a failed build
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            logger.exception("Failed to remove extract {}".format(path))
+        else:
+            count += 1
+    return count
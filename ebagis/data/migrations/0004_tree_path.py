@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# builds the materialized path of every existing directory by walking
+# down from the root directories, then gives each file the path of
+# its directory; directory IDs are uuids, so we drop the dashes
+# to match the hex format used by the model
+BACKFILL_TREE_PATHS = """
+WITH RECURSIVE tree(id, path) AS (
+    SELECT id, replace(id::text, '-', '') || '/'
+    FROM ebagis_data_directory
+    WHERE _parent_object_id IS NULL
+  UNION ALL
+    SELECT d.id, tree.path || replace(d.id::text, '-', '') || '/'
+    FROM ebagis_data_directory d
+    JOIN tree ON d._parent_object_id = tree.id
+)
+UPDATE ebagis_data_directory d
+SET _tree_path = tree.path
+FROM tree
+WHERE d.id = tree.id;
+
+UPDATE ebagis_data_file f
+SET _tree_path = d._tree_path
+FROM ebagis_data_directory d
+WHERE f._parent_object_id = d.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebagis_data', '0003_auto_20171120_2215'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directory',
+            name='_tree_path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='_tree_path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=1000),
+        ),
+        migrations.RunSQL(BACKFILL_TREE_PATHS, migrations.RunSQL.noop),
+    ]
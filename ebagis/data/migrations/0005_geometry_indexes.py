@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# the geography columns are already indexed, but the vector tiles
+# filter on the geometry of the columns, which needs its own index
+INDEXES = (
+    ("ebagis_data_pourpoint", "location"),
+    ("ebagis_data_pourpoint", "boundary"),
+    ("ebagis_data_pourpoint", "boundary_simple"),
+    ("ebagis_data_aoi", "boundary"),
+)
+
+CREATE_INDEXES = "\n".join(
+    "CREATE INDEX {0}_{1}_geometry_id ON {0} USING GIST (({1}::geometry));"
+    .format(table, column) for table, column in INDEXES
+)
+
+DROP_INDEXES = "\n".join(
+    "DROP INDEX IF EXISTS {0}_{1}_geometry_id;".format(table, column)
+    for table, column in INDEXES
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebagis_data', '0004_tree_path'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEXES, DROP_INDEXES),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebagis_data', '0005_geometry_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AOIBoundaryLevel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tolerance', models.FloatField()),
+                ('boundary', django.contrib.gis.db.models.fields.MultiPolygonField(geography=True, srid=4326)),
+                ('aoi', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='boundary_levels', to='ebagis_data.AOI')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PourPointBoundaryLevel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tolerance', models.FloatField()),
+                ('boundary', django.contrib.gis.db.models.fields.MultiPolygonField(geography=True, srid=4326)),
+                ('pourpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='boundary_levels', to='ebagis_data.PourPoint')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pourpointboundarylevel',
+            unique_together=set([('pourpoint', 'tolerance')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='aoiboundarylevel',
+            unique_together=set([('aoi', 'tolerance')]),
+        ),
+    ]
@@ -3,6 +3,8 @@ from __future__ import absolute_import
 # Need to import every declared model for Django to recognize it
 from .aoi import AOI
 from .aoi_directory import AOIDirectory
+from .awdb import AWDBStation
+from .boundary import PourPointBoundaryLevel, AOIBoundaryLevel
 from .directory import Directory, Maps, PrismDir
 from .file import File, Layer, Vector, Raster, Table
 from .file_data import (
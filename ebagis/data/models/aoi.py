@@ -15,15 +15,22 @@ from ebagis.models.mixins import CreatedByMixin, NameMixin
 
 from ebagis.utils.validation import validate_aoi, generate_uuid
 from ebagis.utils.misc import make_short_name
-from ebagis.utils import gis, transaction
+from ebagis.utils import transaction
+from ebagis.utils.gis.geom import extract
 
 from .base import ABC
 from .aoi_directory import AOIDirectory
+from .directory import Directory
+from .file import File
+from .file_data import FileData
 from .pourpoint import PourPoint
+from .boundary import BoundaryLevelsMixin, AOIBoundaryLevel
 from .mixins import SDDateMixin
+from .prefetch import prefetch_tree
+from ..snapshot import invalidate
 
 
-class AOI(CreatedByMixin, SDDateMixin, NameMixin, ABC):
+class AOI(BoundaryLevelsMixin, CreatedByMixin, SDDateMixin, NameMixin, ABC):
     shortname = models.CharField(max_length=25)
     boundary = models.MultiPolygonField(geography=True, srid=settings.GEO_WKID)
     pourpoint = models.ForeignKey(PourPoint,
@@ -51,11 +58,49 @@ class AOI(CreatedByMixin, SDDateMixin, NameMixin, ABC):
         # we only want "current" (not removed and/or inactive) records
         return self.directory.current().get(classname='AOIDirectory')
 
+    _snapshot_aoi_field = 'pk'
+    # the AOI boundaries are drawn in the vector tiles
+    _tiled = True
+
+    def save(self, *args, **kwargs):
+        """Overrides save to invalidate the snapshots showing this AOI:
+        its own, its parent's, which lists it among the child AOIs,
+        and its children's, which show it as their parent. The vector
+        tiles are invalidated too, as they carry the AOI's boundary,
+        name, and shortname."""
+        from ..tiles import invalidate as invalidate_tiles
+        saved = super(AOI, self).save(*args, **kwargs)
+        invalidate_tiles()
+        invalidate(self.pk)
+        invalidate(self.parent_aoi_id)
+        for child_id in AOI._base_manager.filter(
+                parent_aoi_id=self.pk,
+        ).values_list('pk', flat=True):
+            invalidate(child_id)
+        return saved
+
+    def prefetch_contents(self):
+        """Returns the contents with the entire tree under them
+        loaded in memory (see prefetch_tree), loading it only once"""
+        contents = getattr(self, '_prefetched_contents', None)
+        if contents is None:
+            contents = self._prefetched_contents = \
+                prefetch_tree(self.contents)
+        return contents
+
     @property
     def _children(self):
         # we need to get all related records--inactive or otherwise
         return [self.directory.get(classname='AOIDirectory')]
 
+    @classmethod
+    def _subtree_querysets(cls, pks):
+        # everything under an AOI references it directly
+        return [(AOI, AOI._base_manager.filter(pk__in=pks))] + [
+            (model, model._base_manager.filter(aoi__in=pks))
+            for model in (Directory, File, FileData)
+        ]
+
     @classmethod
     def create_from_upload(cls, upload, temp_aoi_path):
         aoi_name = os.path.splitext(upload.filename)[0]
@@ -87,15 +132,15 @@ class AOI(CreatedByMixin, SDDateMixin, NameMixin, ABC):
                 errormsg += "\n\t{}".format(error)
             raise AOIError(errormsg)
 
-        # get multipolygon WKT from AOI Boundary Layer
-        boundary = gis.get_multipart_wkt_geometry_and_reproject(
+        # get multipolygon from AOI Boundary Layer
+        boundary = extract.get_multipolygon(
             os.path.join(temp_aoi_path, constants.AOI_GDB),
             settings.GEO_WKID,
             layername=constants.AOI_BOUNDARY_LAYER
         )
 
-        # get pour point WKT from AOI Pourpoint layer
-        pourpoint = gis.get_wkt_geometry_and_reproject(
+        # get pour point from AOI Pourpoint layer
+        pourpoint = extract.get_point(
             os.path.join(temp_aoi_path, constants.AOI_GDB),
             settings.GEO_WKID,
             layername=constants.AOI_POURPOINT_LAYER
@@ -118,6 +163,7 @@ class AOI(CreatedByMixin, SDDateMixin, NameMixin, ABC):
             pourpoint=closest_pourpoint,
         )
         aoi.save()
+        AOIBoundaryLevel.build(ids=[aoi.pk])
 
         # make the AOIDirectory model, which will import
         # all the AOI files to the filesystem
@@ -152,6 +198,12 @@ class AOI(CreatedByMixin, SDDateMixin, NameMixin, ABC):
                                     querydate=querydate,
                                     create_heirarchy=create_heirarchy)
 
+    def export_entries(self, querydate, tempdir=None):
+        return self.contents.export_entries(querydate, tempdir)
+
+    def export_versions(self, querydate):
+        return self.contents.export_versions(querydate)
+
     def get_url(self, request):
         view = self._classname + "-base:detail"
         kwargs = {"pk": str(self.pk)}
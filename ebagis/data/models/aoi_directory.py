@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 import os
 
+from functools import partial
+
 from django.conf import settings
 from django.utils import timezone
 
@@ -12,6 +14,7 @@ from ebagis.utils.itertools import chain
 from .directory import Directory
 from .geodatabase import Surfaces, Layers, AOIdb, Analysis
 from .directory import PrismDir, Maps
+from .importer import run_parallel
 from .zones import Zones
 
 
@@ -125,23 +128,23 @@ class AOIDirectory(Directory):
     # the _all versions don't filter inactive/removed records
     @property
     def surfaces_all(self):
-        return self._subdirectories.get(classname='Surfaces')
+        return self._related('_subdirectories').get(classname='Surfaces')
 
     @property
     def layers_all(self):
-        return self._subdirectories.get(classname='Layers')
+        return self._related('_subdirectories').get(classname='Layers')
 
     @property
     def aoidb_all(self):
-        return self._subdirectories.get(classname='AOIdb')
+        return self._related('_subdirectories').get(classname='AOIdb')
 
     @property
     def analysis_all(self):
-        return self._subdirectories.get(classname='Analysis')
+        return self._related('_subdirectories').get(classname='Analysis')
 
     @property
     def _prism_all(self):
-        return self._subdirectories.get(classname='PrismDir')
+        return self._related('_subdirectories').get(classname='PrismDir')
 
     @property
     def prism_all(self):
@@ -149,11 +152,11 @@ class AOIDirectory(Directory):
 
     @property
     def maps_all(self):
-        return self._subdirectories.get(classname='Maps')
+        return self._related('_subdirectories').get(classname='Maps')
 
     @property
     def _zones_all(self):
-        return self._subdirectories.get(classname='Zones')
+        return self._related('_subdirectories').get(classname='Zones')
 
     @property
     def zones_all(self):
@@ -176,53 +179,22 @@ class AOIDirectory(Directory):
         return self.items_all
 
     def import_content(self, temp_aoi_path):
+        # each of these is independent of the others, so
+        # we can import them concurrently; the records are
+        # all saved once the files are in place
+        imports = [
             # import aoi.gdb
-            AOIdb.create(
-                os.path.join(temp_aoi_path,
-                             constants.AOI_GDB),
-                self,
-                self.created_by,
-            )
-
+            (AOIdb, constants.AOI_GDB),
             # import surfaces.gdb
-            Surfaces.create(
-                os.path.join(temp_aoi_path,
-                             constants.SURFACES_GDB),
-                self,
-                self.created_by,
-            )
-
+            (Surfaces, constants.SURFACES_GDB),
             # import layers.gdb
-            Layers.create(
-                os.path.join(temp_aoi_path,
-                             constants.LAYERS_GDB),
-                self,
-                self.created_by,
-            )
-
+            (Layers, constants.LAYERS_GDB),
             # import HRU Zones
-            Zones.create(
-                os.path.join(temp_aoi_path,
-                             constants.ZONES_DIR_NAME),
-                self,
-                self.created_by,
-            )
-
+            (Zones, constants.ZONES_DIR_NAME),
             # import analysis.gdb
-            Analysis.create(
-                os.path.join(temp_aoi_path,
-                             constants.ANALYSIS_GDB),
-                self,
-                self.created_by,
-            )
-
+            (Analysis, constants.ANALYSIS_GDB),
             # import prism.gdb
-            PrismDir.create(
-                os.path.join(temp_aoi_path,
-                             constants.PRISM_GDB),
-                self,
-                self.created_by,
-            )
+            (PrismDir, constants.PRISM_GDB),
 
             # import param.gdb
 
@@ -231,12 +203,16 @@ class AOIDirectory(Directory):
             # import param/paramdata.gdb
 
             # import map docs in maps directory
-            Maps.create(
-                os.path.join(temp_aoi_path,
-                             constants.MAPS_DIR),
-                self,
-                self.created_by,
-            )
+            (Maps, constants.MAPS_DIR),
+        ]
+
+        run_parallel([
+            partial(cls.create,
+                    os.path.join(temp_aoi_path, name),
+                    self,
+                    self.created_by)
+            for cls, name in imports
+        ])
 
     @transaction.atomic
     def update(self):
@@ -251,5 +227,17 @@ class AOIDirectory(Directory):
         self.maps.export(output_dir, querydate=querydate)
         self._zones.export(output_dir, querydate=querydate)
 
+    def export_content_entries(self, querydate, tempdir, prefix):
+        for item in [self.surfaces, self.layers, self.aoidb, self.analysis,
+                     self._prism, self.maps, self._zones]:
+            for entry in item.export_entries(querydate, tempdir, prefix):
+                yield entry
+
+    def export_content_versions(self, querydate):
+        for item in [self.surfaces, self.layers, self.aoidb, self.analysis,
+                     self._prism, self.maps, self._zones]:
+            for version in item.export_versions(querydate):
+                yield version
+
     def get_url(self, request):
         return self.aoi.get_url(request)
@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from django.db import transaction
+from django.contrib.gis.db import models
+from django.contrib.gis.db.models.functions import Distance as DistanceTo
+from django.contrib.gis.geos import Point
+
+from ebagis.exceptions import AWDBError
+from ebagis.utils.gis import Distance
+from ebagis.utils.webservices import iter_AWDB_features
+
+
+class AWDBStation(models.Model):
+    """A local mirror of the AWDB USGS stations, so pourpoints can be
+    matched to stations with an indexed query instead of querying the
+    AWDB service during imports. The mirror is replaced in bulk by sync,
+    see the syncawdb command, which should be run periodically."""
+    stationtriplet = models.CharField(max_length=50, unique=True)
+    name = models.CharField(max_length=255)
+    location = models.PointField(geography=True, srid=settings.GEO_WKID)
+    synced_at = models.DateTimeField(default=timezone.now)
+
+    def __unicode__(self):
+        return self.stationtriplet
+
+    @classmethod
+    def nearest(cls, point, distance=None):
+        """Returns the station nearest the GEOS point within the
+        distance (default the AWDB_SEARCH_BUFFER), or None"""
+        distance = Distance(distance or settings.AWDB_SEARCH_BUFFER)
+        return cls.objects.filter(
+            location__dwithin=(point, distance),
+        ).annotate(
+            distance=DistanceTo('location', point),
+        ).order_by('distance').first()
+
+    @staticmethod
+    def from_feature(feature, synced_at=None):
+        """Makes a station from an AWDB feature in the GEO_WKID"""
+        return AWDBStation(
+            stationtriplet=feature['attributes']['stationtriplet'],
+            name=feature['attributes']['name'],
+            location=Point(feature['geometry']['x'],
+                           feature['geometry']['y'],
+                           srid=settings.GEO_WKID),
+            synced_at=synced_at or timezone.now(),
+        )
+
+    @classmethod
+    def fetch_features(cls, path=None):
+        """Yields the AWDB features from the service or, if a path is
+        given, from a file of a saved query response in ArcGIS JSON"""
+        if path is None:
+            return iter_AWDB_features(settings.AWDB_QUERY_URL,
+                                      settings.GEO_WKID,
+                                      settings.AWDB_SYNC_PAGE_SIZE)
+        with open(path) as f:
+            return iter(json.load(f)['features'])
+
+    @classmethod
+    @transaction.atomic
+    def sync(cls, features):
+        """Replaces the stations with the AWDB features, which must be
+        in the GEO_WKID, returning the number of stations. Readers see
+        the old stations until the new ones are committed. Raises
+        AWDBError, leaving the stations as they are, if there are no
+        features, as that means the query failed rather than that
+        every station is gone."""
+        now = timezone.now()
+        stations = {}
+        for feature in features:
+            station = cls.from_feature(feature, now)
+            stations[station.stationtriplet] = station
+
+        if not stations:
+            raise AWDBError(
+                "No AWDB stations were returned; "
+                "keeping the existing stations."
+            )
+
+        cls.objects.all().delete()
+        cls.objects.bulk_create(stations.values(), batch_size=1000)
+        return len(stations)
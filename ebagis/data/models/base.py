@@ -76,21 +76,27 @@ class ABC(models.Model):
 
         # if to_update then we need to update the XML metadata file
         if self._has_metadata and to_update:
-            dict_to_write = {}
-            # we'll get the values for the fields from the lists
-            # in the field dict, though we have to do some funny
-            # business to flatten the two lists together
-            for field in [x for y in self._archive_fields.values() for x in y]:
-                try:
-                    dict_to_write[field] = getattr(self, field)
-                except ObjectDoesNotExist:
-                    dict_to_write[field] = None
-            # and we'll use our metadata module to make the changes
-            write_metadata(self._metadata_path, dict_to_write)
+            self.write_metadata_file()
 
         # now let's return the output from the super'd save method
         return saved
 
+    def write_metadata_file(self):
+        """write the archive fields to the XML metadata file; this
+        is done by save, but records created in bulk bypass save
+        and so need to call this explicitly"""
+        dict_to_write = {}
+        # we'll get the values for the fields from the lists
+        # in the field dict, though we have to do some funny
+        # business to flatten the two lists together
+        for field in [x for y in self._archive_fields.values() for x in y]:
+            try:
+                dict_to_write[field] = getattr(self, field)
+            except ObjectDoesNotExist:
+                dict_to_write[field] = None
+        # and we'll use our metadata module to make the changes
+        write_metadata(self._metadata_path, dict_to_write)
+
     @classmethod
     def from_db(cls, db, field_names, values, *args, **kwargs):
         """django-approved method for getting a copy of a field
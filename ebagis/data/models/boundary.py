@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+
+from django.conf import settings
+from django.contrib.gis.db import models
+from django.db import connection
+
+
+def tolerances():
+    """the tolerances of the boundary levels, finest first"""
+    return sorted(settings.EBAGIS_BOUNDARY_TOLERANCES)
+
+
+def level_for_tolerance(tolerance):
+    """Returns the tolerance of the coarsest level that is still no
+    coarser than the given tolerance, or None if only the full boundary
+    is fine enough"""
+    levels = [level for level in tolerances() if level <= tolerance]
+    return levels[-1] if levels else None
+
+
+def level_for_zoom(zoom):
+    """Returns the tolerance of the level to draw at a web map zoom,
+    where a pixel is about 360 / (256 * 2^zoom) degrees across"""
+    return level_for_tolerance(360.0 / (256 * 2 ** zoom))
+
+
+class BoundaryLevel(models.Model):
+    """A boundary simplified with one of the EBAGIS_BOUNDARY_TOLERANCES
+    (in degrees, as features are stored as geography), so clients can
+    get boundaries at a resolution suiting their scale without the
+    server simplifying them per request. Levels are built in the
+    database in bulk by build, see the buildboundarylevels command."""
+    tolerance = models.FloatField()
+    boundary = models.MultiPolygonField(geography=True,
+                                        srid=settings.GEO_WKID)
+
+    # the name of the field relating the level to its feature
+    _parent_field = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def build(cls, ids=None, rebuild=False):
+        """Builds the missing levels of the features with the given
+        IDs (default all), replacing all their levels if rebuild is
+        True. Returns the number of levels built."""
+        field = cls._meta.get_field(cls._parent_field)
+        parent = field.related_model._meta
+
+        filter, params = "", [tolerances()]
+        if ids is not None:
+            if not ids:
+                return 0
+            filter = "AND p.{} IN %s".format(parent.pk.column)
+            params.append(tuple(str(id) for id in ids))
+
+        with connection.cursor() as cursor:
+            if rebuild:
+                levels = cls._base_manager.all()
+                if ids is not None:
+                    levels = levels.filter(**{cls._parent_field + "__in": ids})
+                levels.delete()
+
+            cursor.execute("""
+INSERT INTO {table} ({parent_column}, tolerance, boundary)
+SELECT p.{pk}, t.tolerance, ST_Multi(
+    ST_SimplifyPreserveTopology(p.boundary::geometry, t.tolerance)
+)::geography
+FROM {parent_table} p
+CROSS JOIN unnest(%s::double precision[]) AS t(tolerance)
+WHERE p.boundary IS NOT NULL {filter}
+AND NOT EXISTS (
+    SELECT 1 FROM {table} l
+    WHERE l.{parent_column} = p.{pk} AND l.tolerance = t.tolerance
+)""".format(
+                table=cls._meta.db_table,
+                parent_column=field.column,
+                pk=parent.pk.column,
+                parent_table=parent.db_table,
+                filter=filter,
+            ), params)
+            return cursor.rowcount
+
+
+class PourPointBoundaryLevel(BoundaryLevel):
+    pourpoint = models.ForeignKey('PourPoint',
+                                  related_name='boundary_levels',
+                                  on_delete=models.CASCADE)
+    _parent_field = 'pourpoint'
+
+    class Meta:
+        unique_together = ('pourpoint', 'tolerance')
+
+
+class AOIBoundaryLevel(BoundaryLevel):
+    aoi = models.ForeignKey('AOI',
+                            related_name='boundary_levels',
+                            on_delete=models.CASCADE)
+    _parent_field = 'aoi'
+
+    class Meta:
+        unique_together = ('aoi', 'tolerance')
+
+
+class BoundaryLevelsMixin(object):
+    """Gives a model with boundary levels the boundary at a level"""
+
+    @classmethod
+    def with_boundary_level(cls, queryset, tolerance):
+        """Prefetches the level with the tolerance for the queryset"""
+        if tolerance is None:
+            return queryset
+        return queryset.prefetch_related(models.Prefetch(
+            'boundary_levels',
+            queryset=cls._meta.get_field('boundary_levels')
+            .related_model.objects.filter(tolerance=tolerance),
+            to_attr='_boundary_level',
+        ))
+
+    def boundary_at(self, tolerance):
+        """Returns the boundary at the level with the tolerance, or
+        the full boundary if the tolerance is None or the levels have
+        not been built"""
+        if tolerance is None:
+            return self.boundary
+        levels = getattr(self, '_boundary_level', None)
+        if levels is None:
+            levels = list(self.boundary_levels.filter(tolerance=tolerance))
+        return levels[0].boundary if levels else self.boundary
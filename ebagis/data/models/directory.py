@@ -9,6 +9,7 @@ import logging
 from ebagis.utils.itertools import chain
 
 from django.contrib.gis.db import models
+from django.db.models import Q
 from django.utils import timezone
 
 from ebagis import constants
@@ -17,10 +18,14 @@ from ebagis.models.mixins import (
     NameMixin, AOIRelationMixin, CreatedByMixin
 )
 
-from ebagis.utils import transaction
+from ebagis.utils import transaction, blobstore
 
 from .base import ABC
 from .file import File
+from .file_data import FileData
+from .prefetch import prefetch_tree, tree_path
+from .importer import persist, savepoint, allocate_id
+from ..snapshot import invalidate
 from .mixins import SDDateProxyMixin
 
 
@@ -30,7 +35,7 @@ logger = logging.getLogger(__name__)
 class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
                 AOIRelationMixin, ABC):
     _CREATE_DIRECTORY_ON_EXPORT = True
-    _prefetch = []
+    _prefetch = ["_subdirectories", "_files"]
     _path_name = None
 
     _archive_fields = {"read_only": ["id", "created_at", "created_by"],
@@ -46,6 +51,15 @@ class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
                                        null=True,
                                        blank=True,
                                        on_delete=models.CASCADE)
+    # materialized path of the hierarchy: the IDs of the root
+    # directory down to this one, each followed by a slash; the
+    # subtree under a directory is everything with a path starting
+    # with its path, which is a single query on the (LIKE) index
+    _tree_path = models.CharField(max_length=1000,
+                                  blank=True,
+                                  db_index=True,
+                                  editable=False)
+    _tree_path_lookup = "_tree_path"
 
     class Meta:
         unique_together = ("_parent_object", "name", "_active")
@@ -62,17 +76,79 @@ class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
     def subdirectory_of(self):
         return self._parent_object.path
 
+    @classmethod
+    def _subtree_querysets(cls, pks):
+        roots = Directory._base_manager.filter(pk__in=pks)
+        paths = [path for path in roots.values_list('_tree_path', flat=True)
+                 if path]
+
+        if len(paths) == len(pks):
+            directories = Q()
+            for path in paths:
+                directories |= Q(_tree_path__startswith=path)
+            files, versions = directories, Q()
+            for path in paths:
+                versions |= Q(_parent_object___tree_path__startswith=path)
+        else:
+            # records created before the paths were maintained,
+            # so we fall back to walking down the levels
+            descendants = list(pks)
+            level = list(pks)
+            while level:
+                level = list(Directory._base_manager.filter(
+                    _parent_object__in=level,
+                ).values_list('pk', flat=True))
+                descendants.extend(level)
+            directories = Q(pk__in=descendants)
+            files = Q(_parent_object__in=descendants)
+            versions = Q(_parent_object___parent_object__in=descendants)
+
+        return [
+            (Directory, Directory._base_manager.filter(directories)),
+            (File, File._base_manager.filter(files)),
+            (FileData, FileData._base_manager.filter(versions)),
+        ]
+
+    def subtree(self):
+        """Returns a queryset of this directory and
+        all the directories under it, at any depth"""
+        return Directory.objects.filter(
+            _tree_path__startswith=self._tree_path,
+        )
+
+    def subtree_files(self):
+        """Returns a queryset of all the files under
+        this directory, at any depth"""
+        return File.objects.filter(
+            _tree_path__startswith=self._tree_path,
+        )
+
+    def subtree_versions(self):
+        """Returns a queryset of all the versions of all
+        the files under this directory, at any depth"""
+        return FileData.objects.filter(
+            _parent_object___tree_path__startswith=self._tree_path,
+        )
+
+    def prefetch(self):
+        """Loads the subtree under the directory into memory
+        (see prefetch_tree), if it was not already"""
+        if not hasattr(self, '_prefetched_tree'):
+            prefetch_tree(self)
+        return self
+
     @property
     def files(self):
-        return self._files.current()
+        return self._related('_files').current()
 
     @property
     def subdirectories(self):
-        return self._subdirectories.current()
+        return self._related('_subdirectories').current()
 
     @property
     def _children(self):
-        return list(chain(self._files.all(), self._subdirectories.all()))
+        return list(chain(self._related('_files').all(),
+                          self._related('_subdirectories').all()))
 
     @property
     def _metadata_path(self):
@@ -107,6 +183,20 @@ class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
               is created for this directory object within its
               enclosing file system folder
         """
+        self.prepare()
+        return super(Directory, self).save(*args, **kwargs)
+
+    def prepare(self):
+        """Creates the file system directory for a new
+        directory object without saving the record."""
+        # the record may not be saved before its children are
+        # created, so they need our ID up front to reference us
+        if self.id is None:
+            self.id = allocate_id(self.__class__)
+
+        if not self._tree_path:
+            self._tree_path = tree_path(self._parent_object, self.id)
+
         if not getattr(self, '_parent_directory', None):
             # while a default created_at datetime is set by the
             # date mixin, we have to explictly set the created_at
@@ -117,18 +207,18 @@ class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
             now = timezone.now()
             self.created_at = now
             self.path
-        return super(Directory, self).save(*args, **kwargs)
+
+    def cleanup_entries(self):
+        """Returns the (path, sha256) tuples to remove from disk
+        once the directory is gone. This is used after the directory
+        has been deactivated, so we can't use path."""
+        if self._storage_path is None:
+            return []
+        return [(self._storage_path, None)]
 
     def cleanup(self):
-        import shutil
-        try:
-            if self.path is not None:
-                shutil.rmtree(self.path)
-        except (IOError, OSError) as e:
-            # check to see if the error was
-            # that the dir is already gone
-            if e.errno != errno.ENOENT:
-                raise e
+        for path, sha256 in self.cleanup_entries():
+            blobstore.reap(path, sha256)
 
     @property
     def path(self):
@@ -156,6 +246,14 @@ class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
                 # set the value of the directory path field
                 self._parent_directory = self.subdirectory_of
 
+        return self._storage_path
+
+    @property
+    def _storage_path(self):
+        """The directory's location on disk, whether or not it is
+        active, or None if the directory has not been created."""
+        if not getattr(self, '_parent_directory', None):
+            return None
         return os.path.join(self._parent_directory, self._filesystem_name)
 
     @classmethod
@@ -180,14 +278,19 @@ class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
                       created_by=user,
                       comment=comment)
 
-        # save actually creates the dir on disk
-        dir_obj.save()
+        # prepare actually creates the dir on disk
+        dir_obj.prepare()
 
         try:
-            # now we can add the content
-            # override the import_content method on proxy classes
-            # to define what content is actually imported
-            dir_obj.import_content(import_dir)
+            with savepoint():
+                # the record is saved now or, if
+                # importing, staged for saving later
+                persist(dir_obj)
+
+                # now we can add the content
+                # override the import_content method on proxy classes
+                # to define what content is actually imported
+                dir_obj.import_content(import_dir)
 
         except:
             import sys
@@ -207,6 +310,7 @@ class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
 
             raise exc_info[0], exc_info[1], exc_info[2]
 
+        invalidate(dir_obj.aoi_id)
         return dir_obj
 
     def import_content(self, directory_to_import):
@@ -268,6 +372,39 @@ class Directory(SDDateProxyMixin, NameMixin, CreatedByMixin,
         for obj in chain(self.subdirectories.all(), self.files.all()):
             obj.export(output_dir, querydate)
 
+    def export_entries(self, querydate, tempdir=None, prefix=None):
+        """Yields the (archive name, path) tuples for the files that
+        export would write out, where possible reading them in place
+        rather than copying them. If no prefix is given, archive names
+        are given the hierarchy export uses with create_heirarchy.
+        Content that has to be written out to be exported is written
+        to the tempdir, one piece at a time."""
+        self._validate_querydate(querydate)
+        self.prefetch()
+
+        if prefix is None:
+            prefix = self.aoi_path
+        elif self._CREATE_DIRECTORY_ON_EXPORT:
+            prefix = os.path.join(prefix, self._export_name)
+
+        return self.export_content_entries(querydate, tempdir, prefix)
+
+    def export_content_entries(self, querydate, tempdir, prefix):
+        for obj in chain(self.subdirectories.all(), self.files.all()):
+            for entry in obj.export_entries(querydate, tempdir, prefix):
+                yield entry
+
+    def export_versions(self, querydate):
+        """Yields the FileData versions export would write out for
+        the querydate, without exporting anything."""
+        self.prefetch()
+        return self.export_content_versions(querydate)
+
+    def export_content_versions(self, querydate):
+        for obj in chain(self.subdirectories.all(), self.files.all()):
+            for version in obj.export_versions(querydate):
+                yield version
+
     @transaction.atomic
     def update(self):
         raise NotImplementedError
@@ -277,8 +414,6 @@ class Maps(Directory):
     class Meta:
         proxy = True
 
-    _prefetch = ["maps"]
-
     @property
     def mapdocs(self):
         return self.files.filter(name__endswith=constants.MAP_EXT)
@@ -312,7 +447,6 @@ class Maps(Directory):
 
 class PrismDir(Directory):
     _CREATE_DIRECTORY_ON_EXPORT = False
-    _prefetch = ["versions"]
     _singular = True
     _path_name = constants.PRISM_DIR_NAME
 
@@ -331,3 +465,13 @@ class PrismDir(Directory):
         filtered = self.versions.filter(created_at__lt=querydate)
         filtered.latest("created_at").export(output_dir,
                                              querydate=querydate)
+
+    def export_content_entries(self, querydate, tempdir, prefix):
+        filtered = self.versions.filter(created_at__lt=querydate)
+        return filtered.latest("created_at").export_entries(
+            querydate, tempdir, prefix,
+        )
+
+    def export_content_versions(self, querydate):
+        filtered = self.versions.filter(created_at__lt=querydate)
+        return filtered.latest("created_at").export_versions(querydate)
@@ -6,6 +6,7 @@ from django.utils import timezone
 from django.contrib.gis.db import models
 
 from ebagis.utils import transaction
+from ebagis.utils.filesystem import materialized_entries
 from ebagis.utils.validation import hash_file
 
 from .base import ABC
@@ -14,6 +15,8 @@ from ebagis.models.mixins import (
 )
 
 from .mixins import SDDateProxyMixin
+from .importer import persist, savepoint, allocate_id, arcpy_lock
+from ..snapshot import invalidate
 
 from .file_data import (
     FileData, LAYER_DATA_CLASSES
@@ -25,7 +28,13 @@ class File(SDDateProxyMixin, CreatedByMixin,
     _parent_object = models.ForeignKey('Directory',
                                        related_name='_files',
                                        on_delete=models.CASCADE)
-    _prefetch = ["versions"]
+    # the materialized path of the file's directory (see Directory)
+    _tree_path = models.CharField(max_length=1000,
+                                  blank=True,
+                                  db_index=True,
+                                  editable=False)
+    _tree_path_lookup = "_tree_path"
+    _prefetch = ["_versions"]
 
     _archive_fields = {"read_only": ["id", "created_at", "created_by"],
                        "writable": ["name", "comment"]}
@@ -43,11 +52,20 @@ class File(SDDateProxyMixin, CreatedByMixin,
 
     @property
     def versions(self):
-        return self._versions.current()
+        return self._related('_versions').current()
 
     @property
     def _children(self):
-        return self._versions.all()
+        return self._related('_versions').all()
+
+    @classmethod
+    def _subtree_querysets(cls, pks):
+        return [
+            (File, File._base_manager.filter(pk__in=pks)),
+            (FileData, FileData._base_manager.filter(
+                _parent_object__in=pks,
+            )),
+        ]
 
     @classmethod
     @transaction.atomic
@@ -56,12 +74,15 @@ class File(SDDateProxyMixin, CreatedByMixin,
         file_name = os.path.basename(input_file)
         file_obj = cls(aoi=parent_directory_object.aoi,
                        _parent_object=parent_directory_object,
+                       _tree_path=parent_directory_object._tree_path,
                        name=file_name,
                        created_by=user,
-                       id=id,
+                       id=id or allocate_id(cls),
                        comment=comment)
-        file_obj.save()
-        data_class.create(input_file, file_obj, user)
+        with savepoint():
+            persist(file_obj)
+            data_class.create(input_file, file_obj, user)
+        invalidate(file_obj.aoi_id)
         return file_obj
 
     @transaction.atomic
@@ -99,6 +120,25 @@ class File(SDDateProxyMixin, CreatedByMixin,
 
         return return_path
 
+    def export_entries(self, querydate, tempdir=None, prefix=None):
+        """Yields the (archive name, path) tuples for the files that
+        export would write out, without copying anything. If no
+        prefix is given, archive names are given the hierarchy that
+        export uses with create_heirarchy."""
+        self._validate_querydate(querydate)
+        query = self.versions.filter(created_at__lte=querydate)
+
+        if prefix is None:
+            prefix = os.path.dirname(self.aoi_path)
+
+        yield os.path.join(prefix, self.name), query.latest("created_at").path
+
+    def export_versions(self, querydate):
+        """Yields the FileData versions export would write out for
+        the querydate, without exporting anything."""
+        query = self.versions.filter(created_at__lte=querydate)
+        yield query.latest("created_at")
+
     def is_new_version(self, file_path):
         sha = hash_file(file_path)
         for version in self.versions:
@@ -114,17 +154,26 @@ class Layer(File):
     @classmethod
     @transaction.atomic
     def create(cls, arcpy_ext_layer, geodatabase, user,
-               id=None, comment=""):
+               id=None, comment="", name=None, layer_type=None):
+        # the name and type are read from arcpy unless given,
+        # e.g., by import_layers, which lists them up front
+        if name is None or layer_type is None:
+            with arcpy_lock:
+                name = arcpy_ext_layer.name
+                layer_type = arcpy_ext_layer.type
         file_obj = cls(aoi=geodatabase.aoi,
                        _parent_object=geodatabase,
-                       name=arcpy_ext_layer.name,
+                       _tree_path=geodatabase._tree_path,
+                       name=name,
                        created_by=user,
-                       id=id,
+                       id=id or allocate_id(cls),
                        comment=comment)
-        file_obj.save()
-        LAYER_DATA_CLASSES[arcpy_ext_layer.type].create(arcpy_ext_layer,
-                                                        file_obj,
-                                                        user)
+        with savepoint():
+            persist(file_obj)
+            LAYER_DATA_CLASSES[layer_type].create(arcpy_ext_layer,
+                                                  file_obj,
+                                                  user)
+        invalidate(file_obj.aoi_id)
         return file_obj
 
     def export(self, output_dir, querydate=timezone.now(),
@@ -142,6 +191,17 @@ class Layer(File):
 
         return return_path
 
+    def export_entries(self, querydate, tempdir=None, prefix=None):
+        # layers are stored as loose files, and arcpy has to write
+        # them into a geodatabase, so we have to export to disk
+        self._validate_querydate(querydate)
+        return materialized_entries(
+            lambda output_dir: self.export(output_dir,
+                                           querydate=querydate,
+                                           create_heirarchy=True),
+            dir=tempdir,
+        )
+
 
 class Vector(Layer):
     class Meta:
@@ -1,8 +1,8 @@
 from __future__ import absolute_import
 import os
+import glob
 import shutil
 import logging
-import errno
 
 from django.contrib.gis.db import models
 
@@ -12,11 +12,14 @@ from ebagis.models.mixins import (
     CreatedByMixin, AOIRelationMixin,
 )
 
-from ebagis.utils import transaction
-from ebagis.utils.validation import hash_file, generate_uuid, sanitize_uuid
+from ebagis.utils import transaction, blobstore
+from ebagis.utils.filesystem import tempdirectory
+from ebagis.utils.validation import hash_file, sanitize_uuid
 
 from .base import ABC
 from .mixins import SDDateProxyMixin
+from .importer import persist, allocate_id, arcpy_lock
+from ..snapshot import invalidate
 
 
 logger = logging.getLogger(__name__)
@@ -33,6 +36,9 @@ class FileData(SDDateProxyMixin, CreatedByMixin,
     # but sha256 has less collisions so is a little bit safer
     sha256 = models.CharField(max_length=64)
 
+    # versions are in the subtree of their file's directory
+    _tree_path_lookup = "_parent_object___tree_path"
+
     # lists of field names to be written to the XML metadata file
     # we only need those that cannot be recreated, though
     # the hash of the file is included as it might prove
@@ -51,10 +57,19 @@ class FileData(SDDateProxyMixin, CreatedByMixin,
     def ext(self):
         return "." + os.path.splitext(self.name)[1]
 
+    # what cleanup needs to find the file on disk
+    _cleanup_select_related = ('_parent_object___parent_object',)
+
     @property
     def directory(self):
         return self._parent_object.parent_directory
 
+    @property
+    def _storage_directory(self):
+        """the directory of the file on disk, whether or not
+        the version (and so its directory) is active"""
+        return self._parent_object._parent_object._storage_path
+
     @property
     def _path_name(self):
         return str(self.id) + self.ext
@@ -65,26 +80,34 @@ class FileData(SDDateProxyMixin, CreatedByMixin,
             return None
         return os.path.join(self.directory, self._path_name)
 
+    @property
+    def _storage_path(self):
+        return os.path.join(self._storage_directory, self._path_name)
+
     @property
     def name(self):
         return self._parent_object.name
 
+    def cleanup_entries(self):
+        """Returns the (path, sha256) tuples to remove from disk once
+        the version is gone. The file is a link into the blob store,
+        so with the hash it is released to drop the blob if no longer
+        used. This is used after the version has been deactivated,
+        so we can't use path."""
+        return [(self._storage_path, self.sha256 or None)]
+
     def cleanup(self):
-        try:
-            if self.path is not None:
-                os.remove(self.path)
-        except (IOError, OSError) as e:
-            # check to see if the error was
-            # that the file is already gone
-            if e.errno != errno.ENOENT:
-                raise e
+        for path, sha256 in self.cleanup_entries():
+            blobstore.reap(path, sha256)
 
     def save(self, src=None, *args, **kwargs):
         to_update = False
 
         if src:
-            self.id = kwargs.get('id', generate_uuid(self.__class__))
-            self._copy_file(src)
+            self.prepare(src)
+            # copying sets the hash, but a new record
+            # still needs its metadata file written
+            to_update = True
 
         if not self.sha256:
             # if the hash has never been calc'd, we know this is a
@@ -95,8 +118,17 @@ class FileData(SDDateProxyMixin, CreatedByMixin,
 
         return super(FileData, self).save(*args, to_update=to_update, **kwargs)
 
+    def prepare(self, src):
+        """Copies the source into place for a new
+        version without saving the record."""
+        self.id = allocate_id(self.__class__)
+        self._copy_file(src)
+
     def _copy_file(self, src):
-        shutil.copy(src, self.path)
+        # the content goes into the blob store keyed on its hash,
+        # and our path is simply a link to that blob; if the same
+        # file was imported before, nothing needs to be copied
+        self.sha256, path = blobstore.store_and_checkout(src, self.path)
 
     @classmethod
     @transaction.atomic
@@ -106,7 +138,9 @@ class FileData(SDDateProxyMixin, CreatedByMixin,
                        created_by=user,
                        id=id,
                        comment=comment)
-        data_obj.save(src=input_file)
+        data_obj.prepare(input_file)
+        persist(data_obj)
+        invalidate(data_obj.aoi_id)
         return data_obj
 
     def export(self, output_dir, name=None, copy_function=shutil.copy):
@@ -133,12 +167,42 @@ class LayerData(FileData):
                        created_by=user,
                        id=id,
                        comment=comment)
-        data_obj.save(src=arcpy_ext_layer)
+        data_obj.prepare(arcpy_ext_layer)
+        persist(data_obj)
+        invalidate(data_obj.aoi_id)
         return data_obj
 
+    @property
+    def _dataset_paths(self):
+        """all files making up the layer on disk, that is,
+        the primary file and any sidecar files with it"""
+        return glob.glob(os.path.join(
+            self._storage_directory, sanitize_uuid(str(self.id)) + ".*"
+        ))
+
+    def cleanup_entries(self):
+        # only the hash of the primary file is kept, so the blobs
+        # of the sidecar files are left to collect_garbage
+        return [(path, (self.sha256 or None)
+                 if path == self._storage_path else None)
+                for path in self._dataset_paths]
+
     def _copy_file(self, src):
-        src.copy_to_file(self.directory,
-                         outname=sanitize_uuid(str(self.id)))
+        name = sanitize_uuid(str(self.id))
+        # arcpy has to write the layer for us, and may touch the files
+        # while doing so (e.g., building statistics), so it writes them
+        # to a temp directory; only the finished files are put in the
+        # blob store, where they are shared (e.g., the PRISM and DEM
+        # layers of many AOIs) and never written again
+        with tempdirectory(dir=self.directory) as tempdir:
+            with arcpy_lock:
+                src.copy_to_file(tempdir, outname=name)
+            for path in glob.glob(os.path.join(tempdir, name + ".*")):
+                sha256, dst = blobstore.store_and_checkout(
+                    path, os.path.join(self.directory, os.path.basename(path))
+                )
+                if dst == self.path:
+                    self.sha256 = sha256
 
 
 class VectorData(LayerData):
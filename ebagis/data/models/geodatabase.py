@@ -1,40 +1,60 @@
 from __future__ import absolute_import
+import os
 
 from django.utils import timezone
 
 from arcpy_extensions.geodatabase import Geodatabase as arcpyGeodatabase
 
 from ebagis import constants
+from ebagis.utils.itertools import chain
+from ebagis.utils.filesystem import materialized_entries
 
 from .directory import Directory
 from .file import Raster, Vector, Table
+from .importer import arcpy_lock
 
 
-def import_rasters(geodatabase, geodatabase_obj, user, filter=None):
-    import_layers(geodatabase.rasters, Raster, geodatabase_obj, user, filter)
-
-
-def import_vectors(geodatabase, geodatabase_obj, user, filter=None):
-    import_layers(geodatabase.featureclasses,
-                  Vector, geodatabase_obj, user, filter)
-
-
-def import_tables(geodatabase, geodatabase_obj, user, filter=None):
-    import_layers(geodatabase.tables, Table, geodatabase_obj, user, filter)
+def list_layers(layers, filter=None):
+    """Returns (layer, name, type) tuples for the layers named in
+    the filter (default all of them). This calls arcpy, so it must
+    be called holding the arcpy_lock."""
+    listed = []
+    for layer in layers:
+        name = layer.name
+        if filter is None or name in filter:
+            listed.append((layer, name, layer.type))
+    return listed
+
+
+def open_geodatabase(path, rasters=None, vectors=None, tables=None):
+    """Opens the geodatabase at path and lists its rasters, vectors,
+    and tables (see list_layers) in one go holding the arcpy_lock, as
+    geodatabases are imported in parallel and arcpy is not thread safe.
+    Each filter is a list of the layer names to list, or None for all
+    of them, or False to skip that type of layer."""
+    with arcpy_lock:
+        gdb = arcpyGeodatabase.Open(path)
+        return (
+            list_layers(gdb.rasters, rasters)
+            if rasters is not False else [],
+            list_layers(gdb.featureclasses, vectors)
+            if vectors is not False else [],
+            list_layers(gdb.tables, tables)
+            if tables is not False else [],
+        )
 
 
-def import_layers(layers, layer_class, geodatabase_obj, user, filter=None):
-    for layer in layers:
-        if filter is None or layer.name in filter:
-            layer_class.create(layer, geodatabase_obj, user)
+def import_layers(layers, layer_class, geodatabase_obj, user):
+    """Creates the layers listed by list_layers"""
+    for layer, name, layer_type in layers:
+        layer_class.create(layer, geodatabase_obj, user,
+                           name=name, layer_type=layer_type)
 
 
 class Geodatabase(Directory):
     class Meta:
         proxy = True
 
-    _prefetch = ["rasters", "vectors", "tables"]
-
     @property
     def _export_name(self):
         return self.name + '_gdb'
@@ -53,16 +73,16 @@ class Geodatabase(Directory):
 
     def import_content(self, geodatabase_to_import):
         # get all geodatabase layers
-        gdb = arcpyGeodatabase.Open(geodatabase_to_import)
+        rasters, vectors, tables = open_geodatabase(geodatabase_to_import)
 
         # copy rasters and create raster and raster data objects
-        import_rasters(gdb, self, self.created_by)
+        import_layers(rasters, Raster, self, self.created_by)
 
         # copy vectors and create vector and vetor data objects
-        import_vectors(gdb, self, self.created_by)
+        import_layers(vectors, Vector, self, self.created_by)
 
         # copy tables and create table and table data objects
-        import_tables(gdb, self, self.created_by)
+        import_layers(tables, Table, self, self.created_by)
 
     def export(self, output_dir, querydate=timezone.now(),
                create_heirarchy=False):
@@ -87,6 +107,29 @@ class Geodatabase(Directory):
             table.export(outpath, querydate=querydate)
         return root if root else outpath
 
+    def export_entries(self, querydate, tempdir=None, prefix=None):
+        # arcpy has to build the geodatabase from the stored layers,
+        # so this we cannot stream; we export it to the tempdir and
+        # yield its files, which are removed once they are consumed
+        self._validate_querydate(querydate)
+        self.prefetch()
+
+        if prefix is None:
+            prefix = os.path.dirname(self.aoi_path)
+
+        return materialized_entries(
+            lambda output_dir: self.export(output_dir, querydate=querydate),
+            archive_root=os.path.join(prefix,
+                                      self.name + constants.GDB_EXT),
+            dir=tempdir,
+        )
+
+    def export_versions(self, querydate):
+        self.prefetch()
+        for layer in chain(self.rasters, self.vectors, self.tables):
+            for version in layer.export_versions(querydate):
+                yield version
+
     def layer_export_create_gdb(self, output_dir):
         import os
         from arcpy.management import CreateFileGDB
@@ -182,22 +225,20 @@ class HRUZonesGDB(Geodatabase_ReadOnly):
         proxy = True
 
     def import_content(self, geodatabase_to_import):
-        # get all geodatabase layers
-        gdb = arcpyGeodatabase.Open(geodatabase_to_import)
+        # get the required geodatabase layers; no tables
+        # are required from the HRU GDB
+        rasters, vectors, tables = open_geodatabase(
+            geodatabase_to_import,
+            rasters=constants.HRU_GDB_LAYERS_TO_SAVE[constants.RASTER_TYPECODE],
+            vectors=constants.HRU_GDB_LAYERS_TO_SAVE[constants.FC_TYPECODE],
+            tables=False,
+        )
 
         # copy required rasters and create raster and raster data objects
-        import_rasters(
-            gdb, self, self.created_by,
-            filter=constants.HRU_GDB_LAYERS_TO_SAVE[constants.RASTER_TYPECODE],
-        )
+        import_layers(rasters, Raster, self, self.created_by)
 
         # copy required vectors and create vector and vetor data objects
-        import_vectors(
-            gdb, self, self.created_by,
-            filter=constants.HRU_GDB_LAYERS_TO_SAVE[constants.FC_TYPECODE],
-        )
-
-        # no tables required from HRU GDB
+        import_layers(vectors, Vector, self, self.created_by)
 
 
 class ParamGDB(Geodatabase_ReadOnly):
@@ -207,9 +248,10 @@ class ParamGDB(Geodatabase_ReadOnly):
         proxy = True
 
     def import_content(self, geodatabase_to_import):
-        # get all geodatabase layers
-        gdb = arcpyGeodatabase.Open(geodatabase_to_import)
-
         # should only need the tables as nothing else should be in gdb
+        rasters, vectors, tables = open_geodatabase(
+            geodatabase_to_import, rasters=False, vectors=False,
+        )
+
         # copy tables and create table and table data objects
-        import_tables(gdb, self, self.created_by)
+        import_layers(tables, Table, self, self.created_by)
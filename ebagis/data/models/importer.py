@@ -0,0 +1,192 @@
+from __future__ import absolute_import
+import threading
+import logging
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from ebagis.utils.validation import generate_uuid
+
+from ..snapshot import invalidate
+
+
+logger = logging.getLogger(__name__)
+
+# arcpy is not thread safe, so any arcpy calls made
+# during a parallel import must hold this lock
+arcpy_lock = threading.RLock()
+
+_local = threading.local()
+
+
+class ImportSession(object):
+    """Collects the records created during an import so they can be
+    written to the database after the filesystem work is done, as a
+    single unit of work. Objects are staged in the order they are
+    created, which guarantees that a parent is staged before its
+    children."""
+    def __init__(self):
+        self.staged = []
+        # the AOIs whose snapshots must be invalidated on flush
+        self.touched = set()
+
+    def stage(self, obj):
+        self.staged.append(obj)
+
+    def touch(self, aoi_id):
+        self.touched.add(aoi_id)
+
+    def extend(self, session):
+        self.staged.extend(session.staged)
+        self.touched.update(session.touched)
+
+    @contextmanager
+    def savepoint(self):
+        """Discards anything staged within the context if it raises,
+        just as the atomic block around a create would roll back"""
+        mark = len(self.staged)
+        try:
+            yield
+        except:
+            del self.staged[mark:]
+            raise
+
+    def flush(self, batch_size=None):
+        """Inserts the staged records with a bulk insert per table,
+        instead of the INSERT per object we'd get from save. bulk_create
+        bypasses the save overrides, so we do their work here."""
+        if batch_size is None:
+            batch_size = settings.AOI_IMPORT_BATCH_SIZE
+
+        now = timezone.now()
+
+        # group the records by table; as parents are always staged
+        # before children, the order the tables are first seen in
+        # is also an order that satisfies the foreign keys
+        tables = OrderedDict()
+        for obj in self.staged:
+            _presave(obj, now)
+            tables.setdefault(obj._meta.concrete_model, []).append(obj)
+
+        for model, objs in tables.iteritems():
+            model._base_manager.bulk_create(objs, batch_size=batch_size)
+
+        for obj in self.staged:
+            # all staged records are new, so ABC.save
+            # would always write out the metadata
+            if obj._has_metadata:
+                obj.write_metadata_file()
+
+        for aoi_id in self.touched:
+            invalidate(aoi_id)
+
+        self.staged = []
+        self.touched = set()
+
+
+def _presave(obj, now):
+    """Does what the save overrides do for a new record. The filesystem
+    work that Directory and FileData do on save is already done by the
+    time a record is staged (see prepare)."""
+    # SDDateProxyMixin records the concrete class
+    if not obj.classname:
+        obj.classname = obj.__class__.__name__
+    # and DateMixin always sets the modified date
+    obj.modified_at = now
+
+
+def current_session():
+    return getattr(_local, 'session', None)
+
+
+def allocate_id(model_class):
+    """Returns a new primary key for a record. Staged records skip the
+    lookup for an existing key: they are inserted in bulk, where the
+    primary key constraint guards against the (practically impossible)
+    UUID collision, and a query per record would defeat the purpose."""
+    return generate_uuid(model_class, check=current_session() is None)
+
+
+@contextmanager
+def import_session():
+    """Defers the record saves of any objects created
+    in this thread within the context to the session"""
+    previous = current_session()
+    _local.session = session = ImportSession()
+    try:
+        yield session
+    finally:
+        _local.session = previous
+
+
+@contextmanager
+def savepoint():
+    session = current_session()
+    if session is None:
+        yield
+    else:
+        with session.savepoint():
+            yield
+
+
+def persist(obj):
+    """Saves a newly-created object, or stages
+    it if an import session is active"""
+    session = current_session()
+    if session is None:
+        return obj.save()
+    session.stage(obj)
+
+
+def _run_staged(funct):
+    with import_session() as session:
+        funct()
+    return session
+
+
+def _run_staged_in_thread(funct):
+    try:
+        return _run_staged(funct)
+    finally:
+        # each worker thread gets its own DB connection from django,
+        # which would otherwise be left open when the thread exits
+        connection.close()
+
+
+def run_parallel(imports, workers=None):
+    """Runs the given import callables concurrently, deferring all
+    database writes. When all imports have finished the staged records
+    are inserted in bulk from the calling thread, and thus within its
+    transaction, in the order the imports were given.
+
+    Imports must be independent of one another, i.e., none may create
+    objects inside a directory created by another."""
+    if workers is None:
+        workers = settings.AOI_IMPORT_WORKERS
+
+    if workers <= 1 or len(imports) <= 1:
+        sessions = [_run_staged(funct) for funct in imports]
+    else:
+        pool = ThreadPool(min(workers, len(imports)))
+        try:
+            results = [pool.apply_async(_run_staged_in_thread, (funct,))
+                       for funct in imports]
+            # we must let every import finish before raising an error
+            # so the caller does not clean up the directory from under
+            # an import that is still copying
+            for result in results:
+                result.wait()
+            sessions = [result.get() for result in results]
+        finally:
+            pool.close()
+            pool.join()
+
+    unit_of_work = ImportSession()
+    for session in sessions:
+        unit_of_work.extend(session)
+    unit_of_work.flush()
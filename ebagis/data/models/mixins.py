@@ -1,9 +1,11 @@
 from __future__ import absolute_import
 
+from collections import OrderedDict
 from functools import partial
 
 from django.utils import timezone
 from django.contrib.gis.db import models
+from django.db import transaction
 from django.db.models.query import QuerySet
 
 from ...utils.misc import get_subclasses
@@ -14,11 +16,128 @@ from .metaclass import InheritanceMetaclass
 
 from .fields import NullFalseBooleanField
 
+from ..snapshot import invalidate
+
+
+class SubtreeReport(object):
+    """What a set-based remove or deactivate did: the number of records
+    updated in each table, and the IDs of the records whose files were
+    queued for cleanup by model label"""
+    def __init__(self, action):
+        self.action = action
+        self.updated = OrderedDict()
+        self.cleanup = OrderedDict()
+
+    @property
+    def total(self):
+        return sum(self.updated.itervalues())
+
+    def __str__(self):
+        updated = ", ".join(
+            "{} {}".format(count, name)
+            for name, count in self.updated.iteritems()
+        )
+        cleanup = ", ".join(
+            "{} {}".format(len(ids), label)
+            for label, ids in self.cleanup.iteritems()
+        )
+        return "{} {}; cleanup queued for {}".format(
+            self.action, updated or "nothing", cleanup or "nothing",
+        )
+
+
+def _subtrees(queryset):
+    """Returns the (model, queryset) tuples for the subtrees
+    under the records in the queryset, and the roots' pks"""
+    pks = list(queryset.values_list('pk', flat=True))
+    if not pks:
+        return [], pks
+    return queryset.model._subtree_querysets(pks), pks
+
+
+def _invalidate_snapshots(model, pks):
+    from ..tiles import invalidate as invalidate_tiles
+
+    # every record in a subtree is in the same AOI as its root
+    field = model._snapshot_aoi_field
+    for aoi_id in model._base_manager.filter(
+            pk__in=pks,
+    ).values_list(field, flat=True).distinct():
+        invalidate(aoi_id)
+
+    if getattr(model, '_tiled', False):
+        invalidate_tiles()
+
+
+def remove_subtrees(queryset, datetime=None):
+    """Soft deletes the records in the queryset and everything under
+    them with an UPDATE per table, rather than saving each record.
+    Records that were already removed keep their removal date.
+    Returns a SubtreeReport."""
+    datetime = datetime or timezone.now()
+    report = SubtreeReport("removed")
+    with transaction.atomic():
+        subtrees, pks = _subtrees(queryset)
+        for model, subtree in subtrees:
+            report.updated[model.__name__] = subtree.filter(
+                removed_at__isnull=True,
+            ).update(removed_at=datetime, modified_at=timezone.now())
+        if pks:
+            _invalidate_snapshots(queryset.model, pks)
+    return report
+
+
+def deactivate_subtrees(queryset):
+    """Deactivates the records in the queryset and everything under
+    them with an UPDATE per table, rather than saving each record.
+    Everything must have been removed first (see can_deactiveate).
+
+    The files of the deactivated records are queued for removal in
+    the same transaction (see PendingCleanup) and removed by a background
+    task once it commits, instead of in the request. Returns a
+    SubtreeReport."""
+    from ebagis.models.cleanup import PendingCleanup
+    report = SubtreeReport("deactivated")
+    with transaction.atomic():
+        subtrees, pks = _subtrees(queryset)
+
+        for model, subtree in subtrees:
+            if issubclass(model, SDDateMixin) and \
+                    subtree.filter(removed_at__isnull=True).exists():
+                raise ValueError(
+                    "ERROR: deactivation validation fails; "
+                    "cannot deactivate"
+                )
+
+        now = timezone.now()
+        entries = []
+        for model, subtree in subtrees:
+            active = subtree.filter(_active=True)
+            if hasattr(model, 'cleanup_entries'):
+                objs = list(active.select_related(
+                    *getattr(model, '_cleanup_select_related', ())
+                ))
+                if objs:
+                    report.cleanup[model._meta.label] = \
+                        [str(obj.pk) for obj in objs]
+                    # files go before the directories holding them
+                    entries[:0] = [entry for obj in objs
+                                   for entry in obj.cleanup_entries()]
+            report.updated[model.__name__] = active.update(
+                _active=False, modified_at=now,
+            )
+
+        if pks:
+            _invalidate_snapshots(queryset.model, pks)
+
+        PendingCleanup.enqueue(entries)
+
+    return report
+
 
 class ActiveQuerySet(QuerySet):
     def deactivate(self):
-        for obj in self:
-            obj.deactivate()
+        return deactivate_subtrees(self)
 
     def active(self):
         return self.filter(_active=True)
@@ -31,6 +150,9 @@ class ActiveMixin(models.Model):
     _active = NullFalseBooleanField(default=True)
     objects = ActiveQuerySet.as_manager()
 
+    # the field holding the AOI whose snapshots include the record
+    _snapshot_aoi_field = 'aoi_id'
+
     class Meta:
         abstract = True
 
@@ -38,29 +160,37 @@ class ActiveMixin(models.Model):
     def active(self):
         return self._active
 
+    @property
+    def _snapshot_aoi_id(self):
+        """the AOI whose snapshots include this record, if any"""
+        return getattr(self, self._snapshot_aoi_field, None)
+
+    @classmethod
+    def _subtree_querysets(cls, pks):
+        """Returns (model, queryset) tuples for the tables holding the
+        records under the records with the given pks, roots included,
+        parents' tables before their children's. Override for models
+        with children."""
+        model = cls._meta.concrete_model
+        return [(model, model._base_manager.filter(pk__in=pks))]
+
     def can_deactiveate(self):
         return True
 
     def deactivate(self):
+        """Deactivates this record and everything under it (see
+        deactivate_subtrees), returning a SubtreeReport"""
         # check if we can deactivate, or raise an exception
         if not self.can_deactiveate():
             raise ValueError(
                 "ERROR: deactivation validation fails; cannot deactivate"
             )
 
-        # deactivate any children: we recurse through these first, in
-        # case any fail we shouldn't get to this object's deactivation
-        if hasattr(self, '_children') and self._children:
-            for child in self._children:
-                child.deactivate()
-
-        # call any clean up tasks if defined
-        if hasattr(self, 'cleanup'):
-            self.cleanup()
-
-        # set as inactive
+        report = deactivate_subtrees(
+            self.__class__._base_manager.filter(pk=self.pk)
+        )
         self._active = False
-        self.save()
+        return report
 
 
 # soft delete modified from
@@ -68,13 +198,10 @@ class ActiveMixin(models.Model):
 
 class SDDateQuerySet(ActiveQuerySet):
     def delete(self):
-        dt = timezone.now()
-        for obj in self:
-            obj.delete(datetime=dt)
+        return remove_subtrees(self)
 
     def hard_delete(self):
-        for obj in self:
-            obj.hard_delete()
+        return QuerySet.delete(self)
 
     def not_removed(self):
         return self.filter(removed_at__isnull=True)
@@ -105,12 +232,16 @@ class SDDateMixin(ActiveMixin, DateMixin):
     def current(self):
         return self.active and not self.removed
 
-    def delete(self, datetime=timezone.now()):
-        if hasattr(self, '_children') and self._children:
-            for child in self._children:
-                child.delete()
-        self.removed_at = datetime
-        self.save()
+    def delete(self, datetime=None):
+        """Removes this record and everything under it (see
+        remove_subtrees), returning a SubtreeReport"""
+        datetime = datetime or timezone.now()
+        report = remove_subtrees(
+            self.__class__._base_manager.filter(pk=self.pk), datetime,
+        )
+        if self.removed_at is None:
+            self.removed_at = datetime
+        return report
 
     def hard_delete(self):
         super(SDDateMixin, self).delete()
@@ -146,6 +277,7 @@ class SDDateProxyMixin(SDDateMixin, models.Model):
     such that the correct class types will not be returned."""
     __metaclass__ = InheritanceMetaclass
     classname = models.CharField(max_length=40)
+    # the reverse relations prefetch_tree loads into memory
     _prefetch = []
     objects = SDDateProxyManager.from_queryset(SDDateQuerySet)()
 
@@ -163,6 +295,14 @@ class SDDateProxyMixin(SDDateMixin, models.Model):
             self.classname = self.__class__.__name__
         return super(SDDateProxyMixin, self).save(*args, **kwargs)
 
+    def _related(self, name):
+        """Returns the in-memory set for the relation if it was loaded
+        by prefetch_tree, otherwise the related manager"""
+        try:
+            return self._prefetched_tree[name]
+        except (AttributeError, KeyError):
+            return getattr(self, name)
+
     @classmethod
     def get_subclasses(cls):
         """Finds all subclasses of the current object's class.
@@ -6,13 +6,13 @@ from django.contrib.gis.db import models
 from django.contrib.gis.db.models.functions import Distance as DistanceTo
 from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
 
-from arcpy import Geometry, SpatialReference, FromWKT
-
-from ebagis.utils.webservices import query_AWDB, gen_query_params_from_point
 from ebagis.utils.gis import Distance
 
 from ebagis.models.mixins import NameMixin
 
+from .awdb import AWDBStation
+from .boundary import BoundaryLevelsMixin, PourPointBoundaryLevel
+
 
 SIMPLIFY_TOLERANCE = 0.002  # degrees, as features are stored as geography
 
@@ -22,7 +22,7 @@ class PourPointManager(models.Manager):
         return self.get(awdb_id=awdb_id)
 
 
-class PourPoint(NameMixin):
+class PourPoint(BoundaryLevelsMixin, NameMixin):
     SOURCE_REFERENCE = 1
     SOURCE_AWDB = 2
     SOURCE_AOI = 3
@@ -78,9 +78,14 @@ class PourPoint(NameMixin):
         """Override save to generate simplified boundary from
         a full-resolution boundary if the former is set and the
         latter is not."""
+        from ..tiles import invalidate
         if self.boundary and not self.boundary_simple:
             self.update_boundary_simple(save=False)
-        return super(PourPoint, self).save(*args, **kwargs)
+        saved = super(PourPoint, self).save(*args, **kwargs)
+        # the boundary may have changed, so we replace its levels
+        PourPointBoundaryLevel.build(ids=[self.pk], rebuild=True)
+        invalidate()
+        return saved
 
     @staticmethod
     def _add_boundary_if_null(pourpoint, aoi_boundary):
@@ -92,10 +97,18 @@ class PourPoint(NameMixin):
     @classmethod
     def match(cls, point, aoi_boundary,
               aoi_name=None, awdb_id=None, sr=settings.GEO_WKID):
+        if isinstance(point, GEOSGeometry):
+            pnt = point
+        else:
+            pnt = GEOSGeometry(point, srid=sr)
+        location = pnt
+        if pnt.srid != settings.GEO_WKID:
+            location = pnt.transform(settings.GEO_WKID, clone=True)
+
         # first we try to match to existing points in the table
-        pnt = GEOSGeometry(point, srid=sr)
         existing_points = cls.objects.filter(
-            location__distance_lte=(pnt, Distance(settings.AWDB_SEARCH_BUFFER))
+            location__distance_lte=(location,
+                                    Distance(settings.AWDB_SEARCH_BUFFER))
         )
 
         # if we find only one we can just take it
@@ -107,67 +120,34 @@ class PourPoint(NameMixin):
             return cls._add_boundary_if_null(
                 existing_points.annotate(
                     distance=DistanceTo(
-                        'location', pnt)
+                        'location', location)
                     ).order_by('distance')[0],
                 aoi_boundary,
             )
 
         # if we didn't find one we want to look at the AWDB USGS
-        # stations; maybe it's a new station we don't yet have
-        # but first let's turn the point into an Arc geometry obejct,
-        # so we can work with it and/or reproject if needed
-        pointgeom = FromWKT(point, SpatialReference(sr))
-
-        # now we get any matches from the AWDB USGS stations
-        awdb_pourpoints = query_AWDB(
-            settings.AWDB_QUERY_URL,
-            gen_query_params_from_point(point,
-                                        sr,
-                                        dist=settings.AWDB_SEARCH_BUFFER)
-        )
-        pp_source = cls.SOURCE_AWDB
-
-        # we will take just the closes point, if any
-        if awdb_pourpoints['features']:
-            features = []
-            awdb_sr = SpatialReference(
-                        awdb_pourpoints['spatialReference']['wkid']
-                )
-            for feature in awdb_pourpoints['features']:
-                geom = Geometry(
-                    [feature['geometry']['x'], feature['geometry']['x']],
-                    awdb_sr
-                )
-                features.append((geom, feature['attributes']))
-
-            closest = features.pop()
-            if len(features) >= 1:
-                pointgeom = pointgeom.projectAs(awdb_sr)
-                distance = pointgeom.distanceTo(closest[0])
-
-                for feature in features:
-                    currdist = pointgeom.distanceTo(feature[0])
-                    if currdist < distance:
-                        distance = currdist
-                        closest = feature
-
+        # stations; maybe it's a new station we don't yet have.
+        # we use our local mirror of the stations (see AWDBStation),
+        # so there is no need to query the AWDB service here
+        station = AWDBStation.nearest(location)
+        if station is not None:
             # yay, we found a match, so we are going to
-            # create a pourpoint record from the feature
-            wkt = closest.projectAs(SpatialReference(settings.GEO_WKID)).WKT
-            name = closest[1]['name']
-            awdb_id = closest[1]['stationtriplet']
+            # create a pourpoint record from the station
+            location = station.location
+            name = station.name
+            awdb_id = station.stationtriplet
+            pp_source = cls.SOURCE_AWDB
 
         else:
             # if still haven't found a match, then we just take the AOI's
             # pourpoint and we add it with the name of the AOI
-            wkt = pointgeom.projectAs(SpatialReference(settings.GEO_WKID)).WKT
             name = aoi_name
             pp_source = cls.SOURCE_AOI
 
         # we create the actual pourpoint record using the values
         # set in one of the two cases above and and return it
         pourpoint = cls(
-            location=wkt,
+            location=location,
             name=name,
             awdb_id=awdb_id,
             boundary=aoi_boundary,
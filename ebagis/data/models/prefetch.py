@@ -0,0 +1,197 @@
+from __future__ import absolute_import
+
+import uuid
+
+from collections import defaultdict
+
+
+def tree_path(parent, id):
+    """Returns the materialized path of a directory
+    with the given parent directory (or None) and ID"""
+    prefix = parent._tree_path if parent is not None else ""
+    return "{}{}/".format(prefix, uuid.UUID(str(id)).hex)
+
+
+def _lookup(obj, key):
+    """Splits a queryset-style keyword like created_at__lte
+    into the value of the field on obj and the lookup type"""
+    field, _, lookup = key.partition("__")
+    return getattr(obj, field), lookup or "exact"
+
+
+LOOKUPS = {
+    "exact": lambda value, arg: value == arg,
+    "in": lambda value, arg: value in arg,
+    "lt": lambda value, arg: value is not None and value < arg,
+    "lte": lambda value, arg: value is not None and value <= arg,
+    "gt": lambda value, arg: value is not None and value > arg,
+    "gte": lambda value, arg: value is not None and value >= arg,
+    "isnull": lambda value, arg: (value is None) == arg,
+    "startswith": lambda value, arg: (value or "").startswith(arg),
+    "endswith": lambda value, arg: (value or "").endswith(arg),
+}
+
+
+def _matches(obj, kwargs):
+    for key, arg in kwargs.iteritems():
+        value, lookup = _lookup(obj, key)
+        if not LOOKUPS[lookup](value, arg):
+            return False
+    return True
+
+
+class PrefetchedSet(object):
+    """An in-memory stand-in for a related manager, holding records
+    loaded by prefetch_tree. Supports the subset of the queryset API
+    the data models use on their relations--current, filter, get,
+    latest, and so on--without issuing any queries."""
+    def __init__(self, model, objects):
+        self.model = model
+        self._objects = list(objects)
+
+    def _clone(self, objects):
+        return self.__class__(self.model, objects)
+
+    def __iter__(self):
+        return iter(self._objects)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __nonzero__(self):
+        return bool(self._objects)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._clone(self._objects[key])
+        return self._objects[key]
+
+    def all(self):
+        return self._clone(self._objects)
+
+    def filter(self, **kwargs):
+        return self._clone(obj for obj in self._objects
+                           if _matches(obj, kwargs))
+
+    def exclude(self, **kwargs):
+        return self._clone(obj for obj in self._objects
+                           if not _matches(obj, kwargs))
+
+    def active(self):
+        return self.filter(_active=True)
+
+    def inactive(self):
+        return self.exclude(_active=True)
+
+    def not_removed(self):
+        return self.filter(removed_at__isnull=True)
+
+    def removed(self):
+        return self.exclude(removed_at__isnull=True)
+
+    def current(self):
+        return self.not_removed().active()
+
+    def get(self, **kwargs):
+        matches = self.filter(**kwargs)._objects
+        if not matches:
+            raise self.model.DoesNotExist(
+                "{} matching query does not exist."
+                .format(self.model._meta.object_name)
+            )
+        if len(matches) > 1:
+            raise self.model.MultipleObjectsReturned(
+                "get() returned more than one {} -- it returned {}!"
+                .format(self.model._meta.object_name, len(matches))
+            )
+        return matches[0]
+
+    def latest(self, field_name=None):
+        field_name = field_name or self.model._meta.get_latest_by
+        if not self._objects:
+            raise self.model.DoesNotExist(
+                "{} matching query does not exist."
+                .format(self.model._meta.object_name)
+            )
+        return max(self._objects, key=lambda obj: getattr(obj, field_name))
+
+    def first(self):
+        return self._objects[0] if self._objects else None
+
+    def exists(self):
+        return bool(self._objects)
+
+    def count(self):
+        return len(self._objects)
+
+
+def _relations(model):
+    """Returns the reverse relations named in the model's _prefetch
+    list as (name, related model, foreign key field) tuples"""
+    for name in getattr(model, "_prefetch", []):
+        rel = model._meta.get_field(name)
+        yield name, rel.related_model, rel.field
+
+
+def prefetch_tree(root, select_related=("created_by",)):
+    """Loads all the records under root in a fixed number of queries:
+    one for each model reachable from root through the relations in
+    the _prefetch lists, regardless of how many records there are.
+    Each record's _prefetch relations are then replaced with in-memory
+    sets (see the _related method on the models), and its parent and
+    AOI are set from the loaded records, so walking the tree, e.g., to
+    serialize it, makes no further queries.
+
+    As every record under an AOI references the AOI, each model is
+    loaded with a single query on the AOI, narrowed to the subtree
+    under root with the materialized path index when root has a path.
+    All records are loaded, including removed and inactive ones, so the
+    sets behave exactly like the relations they stand in for."""
+    aoi = root.aoi
+
+    # find all the models in the tree
+    models, pending = [], [root.__class__]
+    while pending:
+        for name, model, field in _relations(pending.pop()):
+            model = model._meta.concrete_model
+            if model not in models:
+                models.append(model)
+                pending.append(model)
+
+    # one query per model; the managers filter on the classname
+    # so we use the base managers to load the entire tables
+    loaded = {root.pk: root}
+    tables = {}
+    for model in models:
+        query = model._base_manager.filter(aoi=aoi)
+        if getattr(root, "_tree_path", None) and \
+                hasattr(model, "_tree_path_lookup"):
+            query = query.filter(**{
+                model._tree_path_lookup + "__startswith": root._tree_path
+            })
+        tables[model] = [
+            loaded.setdefault(obj.pk, obj)
+            for obj in query.select_related(*select_related)
+        ]
+
+    # group the records by parent for each relation
+    by_parent = {}
+    for obj in loaded.itervalues():
+        for name, model, field in _relations(obj.__class__):
+            key = (model._meta.concrete_model, field.attname)
+            if key not in by_parent:
+                groups = by_parent[key] = defaultdict(list)
+                for child in tables[key[0]]:
+                    groups[getattr(child, field.attname)].append(child)
+
+    for obj in loaded.itervalues():
+        obj.aoi = aoi
+        obj._prefetched_tree = {}
+        for name, model, field in _relations(obj.__class__):
+            model = model._meta.concrete_model
+            related = by_parent[(model, field.attname)].get(obj.pk, [])
+            for child in related:
+                setattr(child, field.name, obj)
+            obj._prefetched_tree[name] = PrefetchedSet(model, related)
+
+    return root
@@ -76,6 +76,30 @@ class HRUZonesData(Directory):
         except ObjectDoesNotExist:
             pass
 
+    def export_content_entries(self, querydate, tempdir, prefix):
+        for entry in self.xml.export_entries(querydate, tempdir, prefix):
+            yield entry
+        for entry in self.hru.export_entries(querydate, tempdir, prefix):
+            yield entry
+        try:
+            param = self.param
+        except ObjectDoesNotExist:
+            return
+        for entry in param.export_entries(querydate, tempdir, prefix):
+            yield entry
+
+    def export_content_versions(self, querydate):
+        for version in self.xml.export_versions(querydate):
+            yield version
+        for version in self.hru.export_versions(querydate):
+            yield version
+        try:
+            param = self.param
+        except ObjectDoesNotExist:
+            return
+        for version in param.export_versions(querydate):
+            yield version
+
 
 class HRUZones(Directory):
     _plural_name = "zones"
@@ -104,6 +128,16 @@ class HRUZones(Directory):
         versions.latest("created_at").export(output_dir,
                                              querydate=querydate)
 
+    def export_content_entries(self, querydate, tempdir, prefix):
+        versions = self.versions.filter(created_at__lt=querydate)
+        return versions.latest("created_at").export_entries(
+            querydate, tempdir, prefix,
+        )
+
+    def export_content_versions(self, querydate):
+        versions = self.versions.filter(created_at__lt=querydate)
+        return versions.latest("created_at").export_versions(querydate)
+
 
 class Zones(Directory):
     class Meta:
@@ -129,3 +163,13 @@ class Zones(Directory):
     def export_content(self, output_dir, querydate=timezone.now()):
         for hruzone in self.hruzones:
             hruzone.export(output_dir, querydate)
+
+    def export_content_entries(self, querydate, tempdir, prefix):
+        for hruzone in self.hruzones:
+            for entry in hruzone.export_entries(querydate, tempdir, prefix):
+                yield entry
+
+    def export_content_versions(self, querydate):
+        for hruzone in self.hruzones:
+            for version in hruzone.export_versions(querydate):
+                yield version
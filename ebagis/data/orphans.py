@@ -0,0 +1,97 @@
+"""Finds content in the AOI_DIRECTORY that no live record refers to.
+
+Files normally go when their records are deactivated (see
+PendingCleanup), but anything left behind by a failed import or a
+cleanup that gave up is found here by comparing the AOI_DIRECTORY with
+the database. AOI directories and versions are named with their IDs,
+so for those the name is enough; the other directories are compared
+with the live directories of their AOI, relative to the AOI directory
+in case the AOI_DIRECTORY has moved since they were created.
+
+Imports write their files before their records are committed, so
+recently modified paths are never reported."""
+from __future__ import absolute_import
+import os
+import time
+import uuid
+
+from django.conf import settings
+
+from .models import Directory, FileData
+
+
+def _uuid(name):
+    """Returns the ID a file or directory is named for, if any;
+    layers are named with underscores instead of dashes"""
+    try:
+        return uuid.UUID(name.split(".", 1)[0].replace("_", "-"))
+    except ValueError:
+        return None
+
+
+def _key(path, root):
+    return os.path.normcase(os.path.relpath(path, root))
+
+
+def _orphans_in(aoi_directory, root, recent):
+    """Yields the orphaned paths inside the directory of a live AOI"""
+    directories = set(
+        _key(directory._storage_path, aoi_directory._storage_path)
+        for directory in Directory.objects.active().filter(
+            aoi_id=aoi_directory.aoi_id,
+        ).exclude(_parent_directory__isnull=True)
+    )
+    versions = set(FileData._base_manager.filter(
+        aoi_id=aoi_directory.aoi_id, _active=True,
+    ).values_list('pk', flat=True))
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in list(dirnames):
+            path = os.path.join(dirpath, name)
+            if _key(path, root) not in directories:
+                # nothing under an orphaned directory is live
+                dirnames.remove(name)
+                if not recent(path):
+                    yield path
+
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            id = _uuid(name)
+            if id is not None and id not in versions and not recent(path):
+                yield path
+
+
+def find_orphans(min_age=24 * 60 * 60):
+    """Yields the paths of directories and files in the AOI_DIRECTORY
+    with no live Directory or FileData record, skipping the blob store
+    and any path modified in the last min_age seconds. Files that are
+    not named for a version (e.g., metadata) are left alone."""
+    root = settings.AOI_DIRECTORY
+    blobs = os.path.normcase(os.path.abspath(settings.AOI_BLOB_DIRECTORY))
+    cutoff = time.time() - min_age
+
+    def recent(path):
+        try:
+            return os.path.getmtime(path) > cutoff
+        except OSError:
+            # gone already
+            return True
+
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.normcase(os.path.abspath(path)) == blobs or \
+                not os.path.isdir(path):
+            continue
+
+        id = _uuid(name)
+        if id is None:
+            continue
+
+        try:
+            aoi_directory = Directory.objects.active().get(pk=id)
+        except Directory.DoesNotExist:
+            if not recent(path):
+                yield path
+        else:
+            for orphan in _orphans_in(aoi_directory, path, recent):
+                yield orphan
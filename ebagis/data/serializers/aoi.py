@@ -1,7 +1,10 @@
 from __future__ import absolute_import
 
 from rest_framework import serializers
-from rest_framework_gis.serializers import GeoFeatureModelSerializer
+from rest_framework_gis.serializers import (
+    GeoFeatureModelSerializer,
+    GeometrySerializerMethodField,
+)
 
 from ebagis.serializers.user import UserSerializer
 
@@ -45,6 +48,11 @@ class AOISerializer(serializers.HyperlinkedModelSerializer):
         read_only=True,
     )
 
+    def _contents(self, obj):
+        # the entire tree is loaded in a handful of queries the first
+        # time it is needed, and all the fields read it from memory
+        return obj.prefetch_contents()
+
     def _get_object(self, obj, obj_to_serialize, serializer):
         return serializer(
             obj_to_serialize,
@@ -55,27 +63,27 @@ class AOISerializer(serializers.HyperlinkedModelSerializer):
         return self._get_object(obj, geodatabase, GeodatabaseSerializer)
 
     def get_surfaces(self, obj):
-        return self._get_geodatabase(obj, obj.contents.surfaces)
+        return self._get_geodatabase(obj, self._contents(obj).surfaces)
 
     def get_layers(self, obj):
-        return self._get_geodatabase(obj, obj.contents.layers)
+        return self._get_geodatabase(obj, self._contents(obj).layers)
 
     def get_aoidb(self, obj):
-        return self._get_geodatabase(obj, obj.contents.aoidb)
+        return self._get_geodatabase(obj, self._contents(obj).aoidb)
 
     def get_analysis(self, obj):
-        return self._get_geodatabase(obj, obj.contents.analysis)
+        return self._get_geodatabase(obj, self._contents(obj).analysis)
 
     def get_prisms(self, obj):
         return [self._get_geodatabase(obj, prism)
-                for prism in obj.contents.prism]
+                for prism in self._contents(obj).prism]
 
     def get_maps(self, obj):
-        return self._get_object(obj, obj.contents.maps, MapsSerializer)
+        return self._get_object(obj, self._contents(obj).maps, MapsSerializer)
 
     def get_zones(self, obj):
         return [self._get_object(obj, zone, HRUZonesSerializer)
-                for zone in obj.contents.zones]
+                for zone in self._contents(obj).zones]
 
     class Meta:
         model = AOI
@@ -91,6 +99,13 @@ class AOISerializer(serializers.HyperlinkedModelSerializer):
 
 
 class AOIGeoSerializer(GeoFeatureModelSerializer, AOISerializer):
+    boundary = GeometrySerializerMethodField()
+
+    def get_boundary(self, obj):
+        if 'boundary_level' in self.context:
+            return obj.boundary_at(self.context['boundary_level'])
+        return obj.boundary
+
     class Meta:
         model = AOI
         geo_field = 'boundary'
@@ -20,7 +20,9 @@ class PourPointSerializer(GeoFeatureModelSerializer):
         use_simplified = self.context['request'].query_params.get(
             'simplified', True
         )
-        if use_boundary and use_simplified:
+        if use_boundary and 'boundary_level' in self.context:
+            return obj.boundary_at(self.context['boundary_level'])
+        elif use_boundary and use_simplified:
             return obj.boundary_simple
         elif use_boundary:
             return obj.boundary
@@ -38,10 +40,12 @@ class PourPointBoundarySerializer(GeoFeatureModelSerializer):
     boundary = GeometrySerializerMethodField()
 
     def get_boundary(self, obj):
+        if 'boundary_level' in self.context:
+            return obj.boundary_at(self.context['boundary_level'])
         use_simplified = self.context['request'].query_params.get(
             'simplified', True
         )
-        return obj.boundary_simple if use_simplified else obj.boundar
+        return obj.boundary_simple if use_simplified else obj.boundary
 
     class Meta:
         model = PourPoint
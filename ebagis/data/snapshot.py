@@ -0,0 +1,100 @@
+"""Materialized snapshots of AOI content trees.
+
+Serializing an AOI's content tree is expensive, but AOIs only change
+on upload, update, or deactivation, so the serialized tree is cached
+per AOI. Each AOI has a generation in the cache that is part of the key
+of all of its snapshots; invalidating an AOI replaces its generation,
+and the old snapshots are simply never read again (and expire on their
+own). Snapshots are rebuilt on the next read. Generations are random
+rather than counters, so if one is evicted from the cache its
+replacement can never match the key of an old snapshot.
+
+Invalidation is deferred until the transaction making the change is
+committed, otherwise a read in between could cache the old tree under
+the new generation. Records staged by an import session are not in the
+database until the session is flushed, so for those the AOI is noted
+on the session and invalidated by the flush."""
+from __future__ import absolute_import
+import json
+import uuid
+import hashlib
+import logging
+
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from rest_framework.utils.encoders import JSONEncoder
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ebagis:aoi-snapshot"
+
+
+def _generation_key(aoi_id):
+    return "{}:{}:generation".format(KEY_PREFIX, aoi_id)
+
+
+def _new_generation():
+    return uuid.uuid4().hex
+
+
+def generation(aoi_id):
+    """Returns the current snapshot generation of the AOI"""
+    key = _generation_key(aoi_id)
+    value = cache.get(key)
+    if value is None:
+        # add, so concurrent readers agree on the new generation
+        cache.add(key, _new_generation(), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+def snapshot_key(aoi_id, variant=()):
+    """Returns the cache key of the AOI's current snapshot. The variant
+    distinguishes snapshots of the same tree that differ otherwise, e.g.,
+    by format or by the host the URLs in them were built for."""
+    variant = hashlib.sha1(
+        "|".join(str(part) for part in variant)
+    ).hexdigest()
+    return "{}:{}:{}:{}".format(
+        KEY_PREFIX, aoi_id, generation(aoi_id), variant,
+    )
+
+
+def get_snapshot(aoi_id, build, variant=()):
+    """Returns the AOI's snapshot for the variant, calling build to
+    make it if there is no current snapshot. build must return data
+    that can be serialized to JSON; snapshots are stored as JSON text,
+    and are returned with their key order preserved."""
+    key = snapshot_key(aoi_id, variant)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        data = build()
+        cache.set(key,
+                  json.dumps(data, cls=JSONEncoder),
+                  timeout=settings.EBAGIS_AOI_SNAPSHOT_TIMEOUT)
+        return data
+    return json.loads(snapshot, object_pairs_hook=OrderedDict)
+
+
+def _bump_generation(aoi_id):
+    cache.set(_generation_key(aoi_id), _new_generation(), timeout=None)
+
+
+def invalidate(aoi_id):
+    """Invalidates all snapshots of the AOI once the
+    current transaction (if any) is committed"""
+    if aoi_id is None:
+        return
+
+    from .models.importer import current_session
+    session = current_session()
+    if session is not None:
+        session.touch(aoi_id)
+    else:
+        transaction.on_commit(partial(_bump_generation, aoi_id))
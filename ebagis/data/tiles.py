@@ -0,0 +1,201 @@
+"""Mapbox vector tiles of the pourpoints and AOI boundaries.
+
+Tiles are built by PostGIS with ST_AsMVT, so the geometries are
+clipped, simplified for the zoom, and encoded in the database, and
+the map only gets what it can show in each tile instead of the full
+GeoJSON of every boundary.
+
+Built tiles are cached. As with the AOI snapshots, there is a
+generation in the cache that is part of every tile key; any change to
+a pourpoint or AOI replaces it once the change is committed, and the
+old tiles are never read again (and expire on their own). Generations
+are random, so one evicted from the cache is never reused.
+Geometries change rarely, so invalidating every tile is much simpler
+than working out which tiles a change touches."""
+from __future__ import absolute_import
+import math
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import AOI, PourPoint
+
+
+KEY_PREFIX = "ebagis:tiles"
+GENERATION_KEY = KEY_PREFIX + ":generation"
+
+# the web mercator world is a square this many meters on a side
+WORLD_SIZE = 2 * math.pi * 6378137
+ORIGIN = WORLD_SIZE / 2
+
+
+def tile_bounds(z, x, y):
+    """Returns the web mercator (xmin, ymin, xmax, ymax) of a tile"""
+    size = WORLD_SIZE / 2 ** z
+    xmin = -ORIGIN + x * size
+    ymax = ORIGIN - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def is_valid(z, x, y):
+    return 0 <= z <= settings.EBAGIS_TILE_MAX_ZOOM and \
+        0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def simplify_tolerance(z):
+    """The tolerance in meters for simplifying geometries at the zoom,
+    a fraction of a tile unit, so the simplification is not visible"""
+    tile_unit = WORLD_SIZE / 2 ** z / settings.EBAGIS_TILE_EXTENT
+    return tile_unit * settings.EBAGIS_TILE_SIMPLIFY_UNITS
+
+
+def _current_aoi_sql(pourpoint_column):
+    aoi = AOI._meta
+    return (
+        "EXISTS (SELECT 1 FROM {table} WHERE {table}.{pourpoint} = {column} "
+        "AND {table}.{removed} IS NULL AND {table}.{active})"
+    ).format(
+        table=aoi.db_table,
+        pourpoint=aoi.get_field('pourpoint').column,
+        removed=aoi.get_field('removed_at').column,
+        active=aoi.get_field('_active').column,
+        column=pourpoint_column,
+    )
+
+
+def _pourpoint_layer(column, simplify):
+    def layer(z, all):
+        table = PourPoint._meta.db_table
+        where = []
+        if not all:
+            where.append(_current_aoi_sql("{}.id".format(table)))
+        return {
+            "table": table,
+            "column": column(z),
+            "properties": ["id", "name", "awdb_id", "source"],
+            "where": where,
+            "simplify": simplify,
+        }
+    return layer
+
+
+def _boundary_column(z):
+    # the simplified boundary is plenty until we are zoomed in close
+    if z <= settings.EBAGIS_TILE_SIMPLE_BOUNDARY_MAX_ZOOM:
+        return "boundary_simple"
+    return "boundary"
+
+
+def _aoi_layer(z, all):
+    aoi = AOI._meta
+    return {
+        "table": aoi.db_table,
+        "column": "boundary",
+        # tiles can't hold UUIDs, so the IDs go as text
+        "properties": ["id::text AS id", "name", "shortname",
+                       aoi.get_field('pourpoint').column],
+        "where": [
+            "{} IS NULL".format(aoi.get_field('removed_at').column),
+            aoi.get_field('_active').column,
+        ],
+        "simplify": True,
+    }
+
+
+# the layers of the tiles, in the order they are drawn
+LAYERS = OrderedDict((
+    ("pourpoint_boundaries", _pourpoint_layer(_boundary_column, True)),
+    ("aois", _aoi_layer),
+    ("pourpoints", _pourpoint_layer(lambda z: "location", False)),
+))
+
+
+def _layer_sql(name, spec, z, bounds):
+    """Returns the SQL and params encoding a layer of the tile"""
+    envelope = "ST_MakeEnvelope(%s, %s, %s, %s, 3857)"
+    geometry = "ST_Transform({}::geometry, 3857)".format(spec["column"])
+    params = []
+
+    if spec["simplify"]:
+        geometry = "ST_SimplifyPreserveTopology({}, %s)".format(geometry)
+        params.append(simplify_tolerance(z))
+
+    # the geometry of the column has a spatial index for this filter
+    # (a geography box would have great circles for its edges)
+    where = ["{}::geometry && ST_Transform({}, {})".format(
+        spec["column"], envelope, settings.GEO_WKID,
+    )] + spec["where"]
+
+    sql = (
+        "SELECT ST_AsMVT(tile, %s, %s, 'geom') FROM ("
+        "SELECT {properties}, ST_AsMVTGeom({geometry}, {envelope}, "
+        "%s, %s, true) AS geom FROM {table} WHERE {where}"
+        ") AS tile WHERE geom IS NOT NULL"
+    ).format(
+        properties=", ".join(spec["properties"]),
+        geometry=geometry,
+        envelope=envelope,
+        table=spec["table"],
+        where=" AND ".join(where),
+    )
+    params = [name, settings.EBAGIS_TILE_EXTENT] + params + \
+        list(bounds) + [settings.EBAGIS_TILE_EXTENT,
+                        settings.EBAGIS_TILE_BUFFER] + list(bounds)
+    return sql, params
+
+
+def build_tile(z, x, y, layers=None, all=False):
+    """Returns the encoded vector tile with the given layers (default
+    all). Unless all is True, only pourpoints with a current AOI are
+    included, as in the pourpoint list."""
+    bounds = tile_bounds(z, x, y)
+    parts, params = [], []
+    for name in layers or LAYERS.keys():
+        sql, layer_params = _layer_sql(name, LAYERS[name](z, all), z, bounds)
+        parts.append("COALESCE(({}), ''::bytea)".format(sql))
+        params.extend(layer_params)
+
+    # a tile is just its layers one after the other
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT {}".format(" || ".join(parts)), params)
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile is not None else b""
+
+
+def _new_generation():
+    return uuid.uuid4().hex
+
+
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # add, so concurrent readers agree on the new generation
+        cache.add(GENERATION_KEY, _new_generation(), timeout=None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def get_tile(z, x, y, layers=None, all=False):
+    """Returns the tile from the cache, building it if needed"""
+    layers = list(layers or LAYERS.keys())
+    key = "{}:{}:{}:{}:{}/{}/{}".format(
+        KEY_PREFIX, generation(), ",".join(layers), int(bool(all)), z, x, y,
+    )
+    tile = cache.get(key)
+    if tile is None:
+        tile = build_tile(z, x, y, layers, all)
+        cache.set(key, tile, timeout=settings.EBAGIS_TILE_CACHE_TIMEOUT)
+    return tile
+
+
+def _bump_generation():
+    cache.set(GENERATION_KEY, _new_generation(), timeout=None)
+
+
+def invalidate():
+    """Invalidates all cached tiles once the
+    current transaction (if any) is committed"""
+    transaction.on_commit(_bump_generation)
@@ -21,6 +21,10 @@ from .mixins import (
     UploadMixin,
     UpdateMixin,
     DownloadMixin,
+    ZonalStatsMixin,
+    ExtractMixin,
 )
 
 from .pourpoint import PourPointViewSet, PourPointBoundaryViewSet
+
+from .tiles import VectorTileViewSet
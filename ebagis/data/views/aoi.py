@@ -21,13 +21,15 @@ from ..serializers.aoi import (
     AOIListSerializer, AOIGeoListSerializer, AOISerializer, AOIGeoSerializer,
 )
 
+from ..snapshot import get_snapshot
+
 from .mixins import (
-    UpdateMixin, DownloadMixin, MultiSerializerMixin,
+    UpdateMixin, DownloadMixin, MultiSerializerMixin, BoundaryLevelMixin,
 )
 
 
 class AOIViewSet(UpdateMixin, DownloadMixin, MultiSerializerMixin,
-                 viewsets.ModelViewSet):
+                 BoundaryLevelMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows AOIs to be viewed or edited.
     """
@@ -46,6 +48,21 @@ class AOIViewSet(UpdateMixin, DownloadMixin, MultiSerializerMixin,
     )
     search_fields = ("name", "shortname")
     filter_class = make_model_filter(AOI, exclude_fields=['boundary'])
+    # see SpatialFilter
+    spatial_fields = ('boundary',)
+
+    def get_queryset(self):
+        queryset = super(AOIViewSet, self).get_queryset().select_related(
+            'created_by',
+        )
+        if self.action == 'retrieve':
+            # the AOI serializer loads the content tree itself
+            queryset = queryset.select_related(
+                'parent_aoi__created_by',
+            ).prefetch_related(
+                'child_aois__created_by',
+            )
+        return queryset
 
     def create(self, request, *args, **kwargs):
         # if the user supplied a parent id for an AOI upload, we know
@@ -82,10 +99,22 @@ class AOIViewSet(UpdateMixin, DownloadMixin, MultiSerializerMixin,
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
 
-        if request.accepted_renderer.format == 'geojson':
-            serializer = AOIGeoSerializer(instance,
-                                          context={'request': request}
-                                          )
-        else:
-            serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        def build():
+            if request.accepted_renderer.format == 'geojson':
+                serializer = AOIGeoSerializer(
+                    instance, context=self.get_serializer_context(),
+                )
+            else:
+                serializer = self.get_serializer(instance)
+            return serializer.data
+
+        # the serialized tree is cached until the AOI changes; the
+        # URLs in it depend on the host and API version requested
+        return Response(get_snapshot(
+            instance.pk,
+            build,
+            variant=(request.accepted_renderer.format,
+                     request.build_absolute_uri('/'),
+                     request.version,
+                     self.get_boundary_level()),
+        ))
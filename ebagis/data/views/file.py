@@ -6,12 +6,14 @@ from ..models import File
 
 from ..serializers.data import FileSerializer
 
-from .mixins import UploadMixin, UpdateMixin, DownloadMixin
+from .mixins import (
+    UploadMixin, UpdateMixin, DownloadMixin, ZonalStatsMixin, ExtractMixin,
+)
 from .base import BaseViewSet
 
 
-class FileViewSet(UploadMixin, UpdateMixin, DownloadMixin,
-                  BaseViewSet):
+class FileViewSet(UploadMixin, UpdateMixin, DownloadMixin, ZonalStatsMixin,
+                  ExtractMixin, BaseViewSet):
     serializer_class = FileSerializer
 
     @property
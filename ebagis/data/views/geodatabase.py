@@ -7,11 +7,13 @@ from ..models.directory import Directory
 from ..serializers.data import GeodatabaseSerializer
 
 from .base import BaseViewSet
-from .mixins import UpdateMixin, DownloadMixin
+from .mixins import (
+    UpdateMixin, DownloadMixin, ZonalStatsMixin, ExtractMixin,
+)
 
 
-class GeodatabaseViewSet(UpdateMixin, DownloadMixin,
-                         BaseViewSet):
+class GeodatabaseViewSet(UpdateMixin, DownloadMixin, ZonalStatsMixin,
+                         ExtractMixin, BaseViewSet):
     serializer_class = GeodatabaseSerializer
 
     @property
@@ -1,9 +1,25 @@
 from __future__ import absolute_import
+import os
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.gis.gdal import GDALException
+from django.contrib.gis.geos import Polygon, GEOSException
+from django.http import Http404
 
 from rest_framework.decorators import detail_route
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
 
 from ...views.upload import UploadView
 from ...views.download import DownloadViewSet
+from ...utils.http import stream_file
+
+from ..models.boundary import level_for_tolerance, level_for_zoom
+from ..models.file import Raster
+from ..zonal import STATISTICS, parse_zones, get_zonal_statistics
+from ..extract import get_extract
 
 
 class MultiSerializerMixin(object):
@@ -32,6 +48,37 @@ class MultiSerializerMixin(object):
         )
 
 
+class BoundaryLevelMixin(object):
+    """Serves the boundaries simplified to one of the precomputed levels
+    (see BoundaryLevel), chosen by the tolerance param in degrees or the
+    zoom param of a web map. The tolerance of the level is passed to
+    the serializers as boundary_level in the context, where None means
+    the full boundary; without either param it is not in the context.
+    """
+    def get_boundary_level(self):
+        params = self.request.query_params
+        try:
+            if 'tolerance' in params:
+                level = level_for_tolerance(float(params['tolerance']))
+            elif 'zoom' in params:
+                level = level_for_zoom(int(params['zoom']))
+            else:
+                return {}
+        except ValueError:
+            raise ParseError("tolerance must be a number and zoom an integer.")
+        return {'boundary_level': level}
+
+    def get_queryset(self):
+        queryset = super(BoundaryLevelMixin, self).get_queryset()
+        level = self.get_boundary_level().get('boundary_level', None)
+        return queryset.model.with_boundary_level(queryset, level)
+
+    def get_serializer_context(self):
+        context = super(BoundaryLevelMixin, self).get_serializer_context()
+        context.update(self.get_boundary_level())
+        return context
+
+
 class UploadMixin(object):
     """Overrides the default viewset create method to
     use the UploadView's new_upload method to make a
@@ -70,3 +117,160 @@ class DownloadMixin(object):
     def download(self, request, *args, **kwargs):
         object = self.get_object()
         return DownloadViewSet.new_download(object, request)
+
+
+class RasterMixin(object):
+    """Gives the raster views access to the current versions of the
+    viewed raster, or of each raster in the viewed geodatabase"""
+    def _raster_versions(self, object):
+        """Returns (raster name, current version) tuples"""
+        if hasattr(object, 'files'):
+            rasters = object.files.filter(classname=Raster.__name__)
+        elif object.classname == Raster.__name__:
+            rasters = [object]
+        else:
+            raise ParseError("Only available for rasters and geodatabases.")
+
+        versions = []
+        for raster in rasters:
+            latest = raster.versions.order_by('-created_at')[:1]
+            if latest:
+                versions.append((raster.name, latest[0]))
+        return versions
+
+
+class ZonalStatsMixin(RasterMixin):
+    """Adds a new viewset method computing zonal statistics of the
+    current version of a raster, or of each raster in a geodatabase.
+    The zones are the AOI boundary by default, or else the zones param
+    (or body field on a POST, for large zones) as WKT or GeoJSON; see
+    parse_zones. Use the statistics param to only get some of the
+    STATISTICS (comma-separated). Results are keyed by raster name.
+    The number of zones and the cells they cover are capped by the
+    EBAGIS_ZONAL_STATS_MAX_ZONES and _MAX_CELLS settings.
+    """
+    def _zones(self, request, object):
+        zones = request.data.get('zones', None) \
+            if request.method == 'POST' else None
+        zones = zones or request.query_params.get('zones', None)
+        if not zones:
+            return [(str(object.aoi_id), object.aoi.boundary)]
+        try:
+            zones = parse_zones(zones)
+        except ValueError as e:
+            raise ParseError(str(e))
+        if len(zones) > settings.EBAGIS_ZONAL_STATS_MAX_ZONES:
+            raise ParseError("At most {} zones are allowed.".format(
+                settings.EBAGIS_ZONAL_STATS_MAX_ZONES,
+            ))
+        return zones
+
+    def _statistics(self, request):
+        statistics = request.query_params.get('statistics', None)
+        if not statistics:
+            return STATISTICS
+        statistics = tuple(statistics.split(','))
+        unknown = [stat for stat in statistics if stat not in STATISTICS]
+        if unknown:
+            raise ParseError(
+                "Unknown statistics: {}".format(", ".join(unknown))
+            )
+        return statistics
+
+    @detail_route(methods=['get', 'post'])
+    def zonal_stats(self, request, *args, **kwargs):
+        object = self.get_object()
+        zones = self._zones(request, object)
+        statistics = self._statistics(request)
+
+        results = OrderedDict()
+        for name, version in self._raster_versions(object):
+            try:
+                stats = get_zonal_statistics(version, zones, statistics)
+            except ValueError as e:
+                # the zones cover too much of the raster
+                raise ParseError(str(e))
+            results[name] = OrderedDict((
+                ('version', version.id),
+                ('zones', stats),
+            ))
+        return Response(results)
+
+
+class ExtractMixin(RasterMixin):
+    """Adds a new viewset method sending the part of the current version
+    of a raster, or of each raster in a geodatabase, in an area as a
+    GeoTIFF (a zip of them for a geodatabase), so clients don't need to
+    download whole geodatabases. The area is the AOI boundary by
+    default, or else the bbox param (xmin,ymin,xmax,ymax in lon/lat)
+    or the geometry param (WKT or GeoJSON). Cells outside the area are
+    nodata unless mask=false. Use the srid param to get the extract in
+    another CRS, and the resolution param to resample it to a cell
+    size in the units of that CRS. Extracts are cached; see extract.
+    Extracts are capped by the EBAGIS_EXTRACT_MAX_CELLS setting.
+    """
+    def _area(self, request, object):
+        params = request.query_params
+        if 'bbox' in params:
+            try:
+                bbox = [float(number) for number in params['bbox'].split(',')]
+                area = Polygon.from_bbox(bbox)
+            except (ValueError, TypeError):
+                raise ParseError("bbox must be 4 comma-separated numbers.")
+            area.srid = settings.GEO_WKID
+            return area
+        if 'geometry' in params:
+            try:
+                zones = parse_zones(params['geometry'])
+                area = zones[0][1]
+                for id, geometry in zones[1:]:
+                    area = area.union(geometry)
+            except (ValueError, IndexError, GEOSException):
+                raise ParseError("geometry must be WKT or GeoJSON.")
+            # only an area can be clipped to
+            if area.geom_type not in ('Polygon', 'MultiPolygon'):
+                raise ParseError("geometry must be a polygon.")
+            return area
+        return object.aoi.boundary
+
+    def _options(self, request):
+        params = request.query_params
+        try:
+            srid = int(params['srid']) if 'srid' in params else None
+            resolution = float(params['resolution']) \
+                if 'resolution' in params else None
+        except ValueError:
+            raise ParseError("srid must be an integer "
+                             "and resolution a number.")
+        if resolution is not None and resolution <= 0:
+            raise ParseError("resolution must be positive.")
+        return {
+            'mask': params.get('mask', 'true').lower() not in
+            ('false', '0', 'no'),
+            'srid': srid,
+            'resolution': resolution,
+        }
+
+    @detail_route()
+    def extract(self, request, *args, **kwargs):
+        object = self.get_object()
+        rasters = self._raster_versions(object)
+        if not rasters:
+            raise Http404("No rasters to extract.")
+
+        try:
+            path = get_extract(rasters,
+                               self._area(request, object),
+                               **self._options(request))
+        except (ValueError, TypeError, GDALException) as e:
+            # e.g., the area is not over the raster,
+            # or the srid is not a known CRS
+            raise ParseError(str(e))
+
+        name = rasters[0][0] if len(rasters) == 1 else object.name
+        return stream_file(
+            path,
+            request,
+            etag=os.path.splitext(os.path.basename(path))[0],
+            filename=name + os.path.splitext(path)[1],
+        )
@@ -13,18 +13,25 @@ from ..serializers.pourpoint import (
 )
 from ..serializers.aoi import AOIListSerializer
 
+from .mixins import BoundaryLevelMixin
 
-class PourPointViewSet(viewsets.ModelViewSet):
+
+class PourPointViewSet(BoundaryLevelMixin, viewsets.ModelViewSet):
     serializer_class = PourPointSerializer
     renderer_classes = (JSONRenderer, BrowsableAPIRenderer, GeoJSONRenderer)
+    # see SpatialFilter
+    spatial_fields = ('location', 'boundary', 'boundary_simple')
+    queryset = PourPoint.objects.all()
 
     def get_queryset(self):
+        # BoundaryLevelMixin prefetches the boundary level
+        queryset = super(PourPointViewSet, self).get_queryset()
         if self.request.query_params.get('all', False) or \
                 self.kwargs.get('pk', None):
-            return PourPoint.objects.all()
+            return queryset
         # unless explicitly specified, we only want to
         # show pourpoints with an associated AOI record
-        return PourPoint.objects.filter(
+        return queryset.filter(
             _aois__removed_at__isnull=True,
             _aois___active__isnull=False,
         ).distinct()
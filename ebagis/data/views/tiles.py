@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+
+from django.conf import settings
+from django.http import HttpResponse, Http404
+from django.utils.cache import patch_cache_control
+
+from rest_framework import viewsets
+from rest_framework.exceptions import ParseError
+
+from .. import tiles
+
+
+MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+class VectorTileViewSet(viewsets.ViewSet):
+    """Mapbox vector tiles of the pourpoints, pourpoint boundaries,
+    and AOI boundaries at z/x/y. Use the layers param to only get some
+    of the layers (comma-separated), and all to include the pourpoints
+    without a current AOI, as in the pourpoint list."""
+
+    def retrieve(self, request, z, x, y, *args, **kwargs):
+        z, x, y = int(z), int(x), int(y)
+        if not tiles.is_valid(z, x, y):
+            raise Http404("No such tile.")
+
+        layers = request.query_params.get('layers', None)
+        if layers:
+            layers = layers.split(',')
+            unknown = [layer for layer in layers
+                       if layer not in tiles.LAYERS]
+            if unknown:
+                raise ParseError(
+                    "Unknown layers: {}".format(", ".join(unknown))
+                )
+
+        tile = tiles.get_tile(z, x, y,
+                              layers=layers,
+                              all=request.query_params.get('all', False))
+
+        response = HttpResponse(tile, content_type=MVT_CONTENT_TYPE)
+        patch_cache_control(response, max_age=settings.EBAGIS_TILE_MAX_AGE)
+        return response
@@ -0,0 +1,113 @@
+"""Zonal statistics of the stored rasters.
+
+Statistics are computed server-side, streaming the raster a block at a
+time (see utils.gis.raster.zonal), so clients wanting the mean elevation
+or precipitation per zone don't need to download the AOI.
+
+Results are cached by the sha256 of the raster version, a hash of the
+zones, and the statistics asked for. The content of a version never
+changes, as a changed raster is a new version with its own hash, so
+cached results never need invalidating; they simply expire."""
+from __future__ import absolute_import
+import json
+import hashlib
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.gis.gdal import GDALRaster, GDALException
+from django.contrib.gis.geos import GEOSGeometry, GEOSException
+
+from ebagis.utils.gis.raster.zonal import STATISTICS, zonal_statistics
+
+
+KEY_PREFIX = "ebagis:zonal-stats"
+
+
+def _geometry(value):
+    geometry = GEOSGeometry(
+        value if isinstance(value, basestring) else json.dumps(value)
+    )
+    if not geometry.srid:
+        geometry.srid = settings.GEO_WKID
+    return geometry
+
+
+def parse_zones(text):
+    """Returns the zones in the text as a list of (id, GEOSGeometry)
+    tuples. The text can be WKT or EWKT, a GeoJSON geometry, or a
+    GeoJSON Feature or FeatureCollection, in which case each feature
+    is a zone with its id (or else its index) as the zone's id. The
+    GeoJSON can also be given already parsed, e.g., from a JSON body.
+    Geometries without an SRID are taken to be in the GEO_WKID.
+    Raises ValueError if the text is not one of those."""
+    if isinstance(text, basestring):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+    else:
+        data = text
+
+    try:
+        if not isinstance(data, dict):
+            return [(None, _geometry(text))]
+        if data.get('type') == 'FeatureCollection':
+            features = data.get('features', [])
+        elif data.get('type') == 'Feature':
+            features = [data]
+        else:
+            return [(None, _geometry(data))]
+        return [
+            (feature.get('id', index), _geometry(feature['geometry']))
+            for index, feature in enumerate(features)
+        ]
+    except (KeyError, TypeError, AttributeError,
+            GEOSException, GDALException):
+        raise ValueError("Zones must be WKT or GeoJSON.")
+
+
+def zones_hash(zones):
+    sha1 = hashlib.sha1()
+    for id, geometry in zones:
+        sha1.update(json.dumps(id))
+        sha1.update(bytes(geometry.ewkb))
+    return sha1.hexdigest()
+
+
+def compute(raster_data, zones, statistics=STATISTICS):
+    """Returns a list of the statistics of the
+    raster version for each of the (id, geometry) zones"""
+    raster = GDALRaster(raster_data.path)
+    results = zonal_statistics(
+        raster, [geometry.ogr for id, geometry in zones],
+        max_cells=settings.EBAGIS_ZONAL_STATS_MAX_CELLS,
+    ).results()
+
+    return [
+        OrderedDict(
+            [('id', id)] +
+            [(statistic, result[statistic]) for statistic in statistics]
+        )
+        for (id, geometry), result in zip(zones, results.values())
+    ]
+
+
+def get_zonal_statistics(raster_data, zones, statistics=STATISTICS):
+    """Returns the statistics of the raster version for the zones,
+    from the cache if they have been computed before. Raises
+    ValueError if the zones cover more than the
+    EBAGIS_ZONAL_STATS_MAX_CELLS of the raster."""
+    key = "{}:{}:{}:{}".format(
+        KEY_PREFIX,
+        raster_data.sha256,
+        zones_hash(zones),
+        ",".join(statistics),
+    )
+    results = cache.get(key)
+    if results is None:
+        results = compute(raster_data, zones, statistics)
+        cache.set(key, results,
+                  timeout=settings.EBAGIS_ZONAL_STATS_CACHE_TIMEOUT)
+    return results
@@ -16,3 +16,7 @@ class LimitError(ebagisError):
 
 class AbortedError(ebagisError):
     pass
+
+
+class AWDBError(ebagisError):
+    pass
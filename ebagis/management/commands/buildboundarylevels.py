@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from ...data.models.boundary import (
+    tolerances, PourPointBoundaryLevel, AOIBoundaryLevel,
+)
+
+
+class Command(BaseCommand):
+    help = """Builds the simplified pourpoint and AOI boundaries at the
+    EBAGIS_BOUNDARY_TOLERANCES in the database. Only missing levels are
+    built unless --rebuild is given, which should be used after the
+    tolerances are changed."""
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '-r',
+            '--rebuild',
+            action='store_true',
+            help='Replace all existing levels.',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Building boundary levels at tolerances {}".format(
+            ", ".join(str(tolerance) for tolerance in tolerances())
+        ))
+        for model in (PourPointBoundaryLevel, AOIBoundaryLevel):
+            with transaction.atomic():
+                count = model.build(rebuild=options['rebuild'])
+            self.stdout.write("Built {} {} levels".format(
+                count, model._parent_field,
+            ))
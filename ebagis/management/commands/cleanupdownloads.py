@@ -0,0 +1,36 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from ...models.download import Download
+from ...data.extract import delete_expired as delete_expired_extracts
+
+
+class Command(BaseCommand):
+    help = """Deletes downloads older than the EXPIRATION_DELTA setting,
+    along with their archives, and raster extracts not used within it.
+    Intended to be run periodically."""
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '-q',
+            '--queue',
+            action='store_true',
+            help='Queue the cleanup as a celery task '
+                 'instead of running it in this process.',
+        )
+
+    def handle(self, *args, **options):
+        if options['queue']:
+            from ...tasks import cleanup_downloads
+            result = cleanup_downloads.delay()
+            self.stdout.write(
+                "Queued download cleanup task {}".format(result.task_id)
+            )
+            return
+
+        count = Download.delete_expired()
+        self.stdout.write("Deleted {} expired downloads".format(count))
+        count = delete_expired_extracts()
+        self.stdout.write("Deleted {} expired extracts".format(count))
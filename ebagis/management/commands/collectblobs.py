@@ -0,0 +1,38 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from ...utils import blobstore
+
+
+class Command(BaseCommand):
+    help = """Removes the blobs in the AOI_BLOB_DIRECTORY no longer
+    linked to by any stored file, and temp files abandoned by failed
+    imports. Blobs are normally removed with the last file linking
+    to them, so this only finds those missed, e.g., by a crash.
+    Intended to be run periodically."""
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '-q',
+            '--queue',
+            action='store_true',
+            help='Queue the collection as a celery task '
+                 'instead of running it in this process.',
+        )
+
+    def handle(self, *args, **options):
+        if options['queue']:
+            from ...tasks import collect_blobs
+            result = collect_blobs.delay()
+            self.stdout.write(
+                "Queued blob collection task {}".format(result.task_id)
+            )
+            return
+
+        removed, freed = blobstore.collect_garbage()
+        self.stdout.write(
+            "Removed {} unreferenced files, freeing {} bytes"
+            .format(removed, freed)
+        )
@@ -0,0 +1,51 @@
+from __future__ import absolute_import
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from ...data.orphans import find_orphans
+from ...models.cleanup import PendingCleanup
+
+
+class Command(BaseCommand):
+    help = """Scans the AOI_DIRECTORY for directories and files with no
+    live Directory or FileData record, such as those left by failed
+    imports. Lists them, or with --reap queues them for removal."""
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '-a',
+            '--min-age',
+            type=float,
+            default=24,
+            help='Skip paths modified within this many hours, '
+                 'as imports in progress are not in the database yet. '
+                 'Default is 24.',
+        )
+        parser.add_argument(
+            '-r',
+            '--reap',
+            action='store_true',
+            help='Queue the orphaned paths for removal by the reaper.',
+        )
+
+    def handle(self, *args, **options):
+        pending = set(PendingCleanup.objects.values_list('path', flat=True))
+        orphans = [
+            path for path in find_orphans(options['min_age'] * 60 * 60)
+            if path not in pending
+        ]
+
+        for path in orphans:
+            self.stdout.write(path)
+
+        if options['reap']:
+            with transaction.atomic():
+                count = PendingCleanup.enqueue(
+                    (path, None) for path in orphans
+                )
+            self.stdout.write("Queued {} orphaned paths for removal"
+                              .format(count))
+        else:
+            self.stdout.write("Found {} orphaned paths".format(len(orphans)))
@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from ...models.cleanup import PendingCleanup
+
+
+class Command(BaseCommand):
+    help = """Removes the files and directories queued for cleanup
+    when their records were deactivated or deleted, including any
+    whose earlier removals failed and are due to be retried.
+    Intended to be run periodically."""
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '-q',
+            '--queue',
+            action='store_true',
+            help='Queue the reaper as a celery task '
+                 'instead of running it in this process.',
+        )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of queued paths to remove per query. '
+                 'Default is the EBAGIS_CLEANUP_BATCH_SIZE setting.',
+        )
+        parser.add_argument(
+            '-r',
+            '--retry-stuck',
+            action='store_true',
+            help='Try the paths the reaper has given up on again.',
+        )
+
+    def handle(self, *args, **options):
+        if options['retry_stuck']:
+            count = PendingCleanup.stuck().update(attempts=0)
+            self.stdout.write("Reset {} stuck paths".format(count))
+
+        if options['queue']:
+            from ...tasks import reap_cleanups
+            result = reap_cleanups.delay(options['batch_size'])
+            self.stdout.write(
+                "Queued reaper task {}".format(result.task_id)
+            )
+            return
+
+        removed, failed = PendingCleanup.reap(options['batch_size'])
+        self.stdout.write(
+            "Removed {} paths, {} failed".format(removed, failed)
+        )
+
+        stuck = PendingCleanup.stuck()
+        if stuck.exists():
+            self.stderr.write(
+                "{} paths could not be removed after repeated attempts:"
+                .format(stuck.count())
+            )
+            for entry in stuck:
+                self.stderr.write(
+                    "  {}: {}".format(entry.path, entry.last_error)
+                )
@@ -0,0 +1,40 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from ...data.models.awdb import AWDBStation
+
+
+class Command(BaseCommand):
+    help = """Replaces the local mirror of the AWDB stations used to
+    match pourpoints with the stations from the AWDB service. Intended
+    to be run periodically."""
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '-f',
+            '--file',
+            default=None,
+            help='Load the stations from a saved AWDB query response '
+                 '(ArcGIS JSON, in the GEO_WKID) instead of the service.',
+        )
+        parser.add_argument(
+            '-q',
+            '--queue',
+            action='store_true',
+            help='Queue the sync as a celery task '
+                 'instead of running it in this process.',
+        )
+
+    def handle(self, *args, **options):
+        if options['queue']:
+            from ...tasks import sync_awdb_stations
+            result = sync_awdb_stations.delay(options['file'])
+            self.stdout.write(
+                "Queued AWDB sync task {}".format(result.task_id)
+            )
+            return
+
+        count = AWDBStation.sync(AWDBStation.fetch_features(options['file']))
+        self.stdout.write("Synced {} AWDB stations".format(count))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebagis', '0005_pendingcleanup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='download',
+            name='task',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='download', to='djcelery.TaskMeta'),
+        ),
+    ]
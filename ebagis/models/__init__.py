@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 # Need to import every declared model for Django to recognize it
+from .cleanup import PendingCleanup
 from .download import Download
 from .misc import ExpiringToken
 from .upload import Upload
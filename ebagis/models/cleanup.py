@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.db import transaction
+from django.contrib.gis.db import models
+
+from ..utils import blobstore
+
+
+logger = logging.getLogger(__name__)
+
+
+def queue_reaper():
+    from ..tasks import reap_cleanups
+    reap_cleanups.delay()
+
+
+class PendingCleanup(models.Model):
+    """A path on disk to remove now that the records using it are gone.
+
+    Entries are written in the transaction that deactivates or deletes
+    the records, so they are only reaped once it commits, and they are
+    never lost if a worker dies or a removal fails: failed entries are
+    retried with a growing delay until EBAGIS_CLEANUP_MAX_ATTEMPTS."""
+    path = models.CharField(max_length=1000)
+    # the hash of the blob the file links to, if any
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now,
+                                           db_index=True)
+    last_error = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return self.path
+
+    @classmethod
+    def enqueue(cls, entries):
+        """Queues the (path, sha256) entries for removal, in order,
+        and has the reaper run once the current transaction commits.
+        Returns the number of entries queued."""
+        objs = [cls(path=path, sha256=sha256 or "")
+                for path, sha256 in entries]
+        if not objs:
+            return 0
+        cls.objects.bulk_create(objs,
+                                batch_size=settings.EBAGIS_CLEANUP_BATCH_SIZE)
+        transaction.on_commit(queue_reaper)
+        return len(objs)
+
+    @classmethod
+    def due(cls):
+        return cls.objects.filter(
+            next_attempt_at__lte=timezone.now(),
+            attempts__lt=settings.EBAGIS_CLEANUP_MAX_ATTEMPTS,
+        )
+
+    @classmethod
+    def stuck(cls):
+        """entries the reaper has given up on"""
+        return cls.objects.filter(
+            attempts__gte=settings.EBAGIS_CLEANUP_MAX_ATTEMPTS,
+        )
+
+    @classmethod
+    def reap(cls, batch_size=None):
+        """Removes the paths of the due entries in the order they were
+        queued, a batch at a time, deleting the entries of the paths
+        removed. Returns a tuple of the number removed and failed."""
+        batch_size = batch_size or settings.EBAGIS_CLEANUP_BATCH_SIZE
+        removed, failed = 0, 0
+        last_pk = 0
+
+        while True:
+            batch = list(
+                cls.due().filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            done = []
+            for entry in batch:
+                try:
+                    blobstore.reap(entry.path, entry.sha256 or None)
+                except Exception as e:
+                    entry.retry_later(e)
+                    failed += 1
+                else:
+                    done.append(entry.pk)
+
+            cls.objects.filter(pk__in=done).delete()
+            removed += len(done)
+
+        return removed, failed
+
+    def retry_later(self, error):
+        self.attempts += 1
+        self.next_attempt_at = timezone.now() + timedelta(
+            seconds=settings.EBAGIS_CLEANUP_RETRY_DELAY *
+            2 ** (self.attempts - 1)
+        )
+        self.last_error = str(error)
+        self.save(update_fields=['attempts', 'next_attempt_at', 'last_error'])
+        logger.warning(
+            "Failed to remove {} (attempt {}): {}"
+            .format(self.path, self.attempts, error)
+        )
@@ -1,6 +1,10 @@
 from __future__ import absolute_import
 
+import os
 import uuid
+import shutil
+import hashlib
+import logging
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -13,10 +17,42 @@ from celery import states
 
 from djcelery.models import TaskMeta
 
+from ..utils.filesystem import hardlink
+
 from .mixins import DateMixin, NameMixin
 
 AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(content_object, querydate):
+    """Returns a key identifying the archive an export of the object
+    at the querydate would produce: a hash of the object, its archive
+    name, the IDs of the FileData versions the export resolves to and
+    the paths they are exported to, plus the compression settings
+    (including which files are stored rather than compressed).
+    Versions are immutable, and renaming the AOI or any file changes the
+    names, so any two downloads with the same key produce equivalent
+    archives, whatever their querydates."""
+    versions = sorted(
+        "{}:{}".format(version.pk, version.parent_object.aoi_path)
+        for version in content_object.export_versions(querydate)
+    )
+    key = hashlib.sha256()
+    key.update(u"{}:{}:{}:{}:{}:{}:{}\n".format(
+        content_object.__class__.__name__,
+        content_object.pk,
+        content_object._archive_name,
+        settings.EBAGIS_EXPORT_COMPRESSION,
+        settings.EBAGIS_EXPORT_COMPRESSION_LEVEL,
+        ",".join(sorted(settings.EBAGIS_EXPORT_STORED_EXTENSIONS)),
+        settings.EBAGIS_EXPORT_MIN_COMPRESSION_SAVINGS,
+    ).encode("utf-8"))
+    for version in versions:
+        key.update(version.encode("utf-8") + "\n")
+    return key.hexdigest()
+
 
 # The name field is not strictly required--it seems that I should
 # be able to query based on the generic foreign key. However, in some
@@ -34,10 +70,94 @@ class Download(DateMixin, NameMixin, models.Model):
     content_object = GenericForeignKey('content_type', 'object_id',
                                        for_concrete_model=False)
     task = models.ForeignKey(TaskMeta, related_name='download',
-                             null=True, blank=True, on_delete=models.CASCADE)
+                             null=True, blank=True, on_delete=models.SET_NULL)
     file = models.FileField(max_length=255, null=True, blank=True)
     # TODO: need a way to pass in a date to this
     querydate = models.DateTimeField(default=timezone.now)
+    # identifies the archive contents so it can be reused
+    cache_key = models.CharField(max_length=64, null=True,
+                                 blank=True, db_index=True)
+    # hash of the archive, used as its ETag
+    sha256 = models.CharField(max_length=64, null=True, blank=True,
+                              editable=False)
+
+    @classmethod
+    def unexpired(cls):
+        return cls.objects.filter(
+            created_at__gt=timezone.now() - settings.EXPIRATION_DELTA
+        )
+
+    @classmethod
+    def expired_downloads(cls):
+        return cls.objects.filter(
+            created_at__lte=timezone.now() - settings.EXPIRATION_DELTA
+        )
+
+    @classmethod
+    def delete_expired(cls):
+        """Deletes all expired downloads and their
+        archives, returning the number deleted"""
+        count = 0
+        for download in cls.expired_downloads():
+            try:
+                download.delete()
+            except Exception:
+                logger.exception(
+                    "Failed to delete expired download {}"
+                    .format(download.pk)
+                )
+            else:
+                count += 1
+        return count
+
+    @classmethod
+    def get_cached(cls, cache_key):
+        """Returns the newest unexpired download with the cache key that
+        has finished its archive, or None if there is not one."""
+        if not cache_key:
+            return None
+        return cls.unexpired().filter(
+            cache_key=cache_key,
+        ).exclude(
+            file__isnull=True,
+        ).exclude(
+            file='',
+        ).order_by('-created_at').first()
+
+    def use_cached(self, cached):
+        """Makes this download share the archive of a cached download,
+        linking the archive so it outlives the cached download. This
+        download gets its own completed task, as sharing the cached
+        download's would tie their lifetimes together. Returns False,
+        leaving this download as it was, if the archive could not be
+        linked or copied (e.g., the cached download just expired), in
+        which case the archive has to be exported as usual."""
+        out_dir = os.path.join(settings.EBAGIS_DOWNLOADS_DIRECTORY,
+                               str(self.pk))
+        os.makedirs(out_dir)
+        path = os.path.join(out_dir, os.path.basename(cached.file.path))
+        try:
+            try:
+                hardlink(cached.file.path, path)
+            except OSError as e:
+                logger.warning(
+                    "Could not link cached download {}, copying instead: {}"
+                    .format(cached.file.path, e)
+                )
+                shutil.copyfile(cached.file.path, path)
+        except (OSError, IOError) as e:
+            logger.warning(
+                "Could not use cached download {}: {}"
+                .format(cached.file.path, e)
+            )
+            # the export task makes the directory itself
+            shutil.rmtree(out_dir, ignore_errors=True)
+            return False
+        self.file = path
+        self.sha256 = cached.sha256
+        self.task = TaskMeta.objects.create(task_id=str(uuid.uuid4()),
+                                            status=states.SUCCESS)
+        return True
 
     @property
     def filename(self):
@@ -53,7 +173,11 @@ class Download(DateMixin, NameMixin, models.Model):
 
     @property
     def nstatus(self):
-        if self.task.status == states.SUCCESS:
+        if self.task is None:
+            # the task results have been cleaned up, so
+            # all we know is whether the archive was made
+            status = 'COMPLETED' if self.file else 'UNKNOWN'
+        elif self.task.status == states.SUCCESS:
             status = 'COMPLETED'
         elif self.task.status == states.PENDING:
             status = 'QUEUED'
@@ -71,6 +195,12 @@ class Download(DateMixin, NameMixin, models.Model):
         if self.file:
             storage, path = self.file.storage, self.file.path
             storage.delete(path)
+            # each download gets its own directory, so we
+            # remove it too, though only if it is now empty
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
 
     @transaction.atomic
     def delete(self, remove_file=True, *args, **kwargs):
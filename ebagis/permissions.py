@@ -6,7 +6,9 @@ READ_ACTIONS = [
     'retrieve'
 ]
 AUTHENTICATED_ACTIONS = READ_ACTIONS + [
-    'download'
+    'download',
+    'extract',
+    'zonal_stats',
 ]
 WRITE_ACTIONS = AUTHENTICATED_ACTIONS + [
     'create',
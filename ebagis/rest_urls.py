@@ -116,6 +116,13 @@ geodatabase_detail = data_views.GeodatabaseViewSet.as_view({
 geodatabase_download = data_views.GeodatabaseViewSet.as_view({
     "get": "download",
 })
+geodatabase_zonal_stats = data_views.GeodatabaseViewSet.as_view({
+    "get": "zonal_stats",
+    "post": "zonal_stats",
+})
+geodatabase_extract = data_views.GeodatabaseViewSet.as_view({
+    "get": "extract",
+})
 
 maps_list = data_views.MapsViewSet.as_view({
     "get": "list",
@@ -144,6 +151,13 @@ file_detail = data_views.FileViewSet.as_view({
 file_download = data_views.FileViewSet.as_view({
     "get": "download",
 })
+file_zonal_stats = data_views.FileViewSet.as_view({
+    "get": "zonal_stats",
+    "post": "zonal_stats",
+})
+file_extract = data_views.FileViewSet.as_view({
+    "get": "extract",
+})
 
 download_list = views.DownloadViewSet.as_view({
     "get": "list",
@@ -182,15 +196,25 @@ pourpoint_boundary_aois = data_views.PourPointBoundaryViewSet.as_view({
     "get": "aois",
 })
 
+vector_tile = data_views.VectorTileViewSet.as_view({
+    "get": "retrieve",
+})
+
 file_patterns = [
     url(r"^$", file_list, name="list"),
     url(r"^{}/$".format(PK_QUERY), file_detail, name="detail"),
     url(r"^{}/download/$".format(PK_QUERY), file_download, name="download"),
+    url(r"^{}/zonal_stats/$".format(PK_QUERY),
+        file_zonal_stats,
+        name="zonal_stats"),
+    url(r"^{}/extract/$".format(PK_QUERY), file_extract, name="extract"),
 ]
 
 file_patterns_no_id = [
     url(r"^$", file_detail, name="detail"),
     url(r"^download/$", file_download, name="download"),
+    url(r"^zonal_stats/$", file_zonal_stats, name="zonal_stats"),
+    url(r"^extract/$", file_extract, name="extract"),
 ]
 
 geodatabase_patterns = [
@@ -199,6 +223,12 @@ geodatabase_patterns = [
     url(r"^{}/download/$".format(PK_QUERY),
         geodatabase_download,
         name="download"),
+    url(r"^{}/zonal_stats/$".format(PK_QUERY),
+        geodatabase_zonal_stats,
+        name="zonal_stats"),
+    url(r"^{}/extract/$".format(PK_QUERY),
+        geodatabase_extract,
+        name="extract"),
     url(r"^{}/layers/".format(PARENT_QUERY),
         include((file_patterns, "file", "layer")),
         {'file_class': data_models.Layer}),
@@ -216,6 +246,8 @@ geodatabase_patterns = [
 geodatabase_patterns_no_id = [
     url(r"^$", geodatabase_detail, name="detail"),
     url(r"^download/$", geodatabase_download, name="download"),
+    url(r"^zonal_stats/$", geodatabase_zonal_stats, name="zonal_stats"),
+    url(r"^extract/$", geodatabase_extract, name="extract"),
     url(r"^layers/",
         include((file_patterns, "file", "layer")),
         {'file_class': data_models.Layer}),
@@ -348,6 +380,11 @@ pourpoint_boundary_patterns = [
         pourpoint_boundary_aois, name="aois"),
 ]
 
+tile_patterns = [
+    url(r"^(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)\.(?:mvt|pbf)$",
+        vector_tile, name="detail"),
+]
+
 
 urlpatterns = [
     # rest framework docs
@@ -493,4 +530,7 @@ urlpatterns = [
         "pourpoint-boundary",
         "pourpoint-boundary-base",
     ))),
+
+    # Vector tile URLs
+    url(r"^tiles/", include((tile_patterns, "tile", "tile-base"))),
 ]
@@ -10,6 +10,19 @@ from datetime import timedelta
 # Path where AOI files will be stored
 AOI_DIRECTORY = os.path.join(BASE_DIR, 'AOIs')
 
+# Path of the content-addressed store backing the AOI files; this must
+# be on the same volume as the AOI_DIRECTORY so files can be hard linked
+AOI_BLOB_DIRECTORY = os.path.join(AOI_DIRECTORY, '.blobs')
+
+# Size in bytes of the buffer used when copying and hashing files
+EBAGIS_IO_BUFFER_SIZE = 4 * 2**20
+
+# Number of threads used to import the parts of an AOI concurrently
+AOI_IMPORT_WORKERS = 4
+
+# Maximum number of records inserted per query when importing an AOI
+AOI_IMPORT_BATCH_SIZE = 500
+
 # Path where AOI and download zips will be temporarily stored unzipped
 EBAGIS_TEMP_DIRECTORY = None
 
@@ -21,6 +34,84 @@ UPLOADS_DIRECTORY = os.path.join(
 # Path where download files will be stored
 EBAGIS_DOWNLOADS_DIRECTORY = os.path.join(MEDIA_ROOT, 'downloads2')
 
+# Path where clipped raster extracts are cached (they are removed
+# with the downloads, after the EXPIRATION_DELTA without use)
+EBAGIS_EXTRACTS_DIRECTORY = os.path.join(MEDIA_ROOT, 'extracts')
+# Most raster cells an extract may read from a raster, or write to one
+# when resampled, as extracts are built within the request
+EBAGIS_EXTRACT_MAX_CELLS = 50 * 1000 * 1000
+
+# Compression of the files in download archives: 'deflate', 'store',
+# or 'zstd' (requires the zstandard package, and zstd zips can only
+# be opened by some unzip tools, so use for internal clients only)
+EBAGIS_EXPORT_COMPRESSION = 'deflate'
+# None uses the default level for the compression method
+EBAGIS_EXPORT_COMPRESSION_LEVEL = None
+# Files with these extensions are always stored without compression
+EBAGIS_EXPORT_STORED_EXTENSIONS = (
+    ".zip", ".gz", ".bz2", ".7z", ".xz",
+    ".jpg", ".jpeg", ".png", ".jp2", ".j2k", ".sid", ".ecw",
+)
+# Files are stored if compressing a sample saves less than this fraction
+EBAGIS_EXPORT_MIN_COMPRESSION_SAVINGS = 0.05
+# Number of zstd compression threads (0 for none, -1 for one per CPU)
+EBAGIS_EXPORT_ZSTD_THREADS = 0
+# Number of threads used to deflate the files of a download archive;
+# keep in mind each celery worker process may be running an export
+EBAGIS_EXPORT_WORKERS = 2
+
+# Have the front-end server send download files instead of django:
+# None, 'x-sendfile' (apache mod_xsendfile, lighttpd), or
+# 'x-accel-redirect' (nginx), which requires the locations below
+EBAGIS_DOWNLOAD_OFFLOAD = None
+# For X-Accel-Redirect, maps directories to the internal nginx
+# locations serving them, e.g., {MEDIA_ROOT: '/protected/media/'}
+EBAGIS_DOWNLOAD_OFFLOAD_LOCATIONS = {}
+# Range requests for more ranges than this get the whole file
+EBAGIS_DOWNLOAD_MAX_RANGES = 16
+
+# Seconds to keep cached AOI snapshots (they are also
+# invalidated whenever the AOI changes)
+EBAGIS_AOI_SNAPSHOT_TIMEOUT = 60 * 60 * 24
+
+# Tolerances in degrees of the simplified pourpoint and AOI boundaries
+# clients can choose from; rebuild the levels after changing these with
+# the buildboundarylevels command
+EBAGIS_BOUNDARY_TOLERANCES = (0.0005, 0.002, 0.008, 0.03, 0.1)
+
+# Vector tiles of the pourpoints and AOI boundaries
+EBAGIS_TILE_MAX_ZOOM = 16
+# Size of the tile grid geometries are snapped to, and the buffer
+# around the tile, in grid units (4096 is the Mapbox default)
+EBAGIS_TILE_EXTENT = 4096
+EBAGIS_TILE_BUFFER = 64
+# Geometries are simplified by this many grid units; below 1 the
+# simplification can't be seen, as everything is snapped to the grid
+EBAGIS_TILE_SIMPLIFY_UNITS = 0.5
+# Highest zoom drawing the pourpoints' simplified boundaries
+# instead of their full-resolution boundaries
+EBAGIS_TILE_SIMPLE_BOUNDARY_MAX_ZOOM = 8
+# Seconds to keep cached tiles (they are also invalidated
+# whenever a pourpoint or AOI changes)
+EBAGIS_TILE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Seconds clients may keep tiles before asking again
+EBAGIS_TILE_MAX_AGE = 60 * 60
+
+# Seconds to keep cached zonal statistics (they are keyed by the hash
+# of the raster, so they never go stale)
+EBAGIS_ZONAL_STATS_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+# Most zones per request, and most raster cells the window covering
+# them may have, as statistics are computed within the request
+EBAGIS_ZONAL_STATS_MAX_ZONES = 1000
+EBAGIS_ZONAL_STATS_MAX_CELLS = 50 * 1000 * 1000
+
+# Number of queued file system removals the reaper handles per query
+EBAGIS_CLEANUP_BATCH_SIZE = 500
+# Times the reaper tries to remove a path before giving up on it
+EBAGIS_CLEANUP_MAX_ATTEMPTS = 5
+# Seconds before a failed removal is retried, doubled with each attempt
+EBAGIS_CLEANUP_RETRY_DELAY = 60
+
 # Download Expiration Time
 EXPIRATION_DELTA = timedelta(days=1)
 
@@ -33,6 +124,11 @@ AWDB_QUERY_URL = 'http://localhost/arcgis/rest/services/AWDB_ALL/stations_USGS_A
 # search envelope, so take care in setting as not all found points
 # may be within the specified distance from the search point
 AWDB_SEARCH_BUFFER = "100 Meters"
+# Seconds to wait on the AWDB service
+AWDB_QUERY_TIMEOUT = 60
+# Number of stations requested per query when syncing the local
+# mirror (see the syncawdb command); the service may return fewer
+AWDB_SYNC_PAGE_SIZE = 1000
 
 # Conf Files
 CONF_DIR =  r"C:\ebagis"
@@ -2,9 +2,11 @@ from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 
 from ebagis.data.models import Directory, FileData
+from ebagis.models.cleanup import PendingCleanup
 
 
 @receiver(pre_delete, sender=Directory)
 @receiver(pre_delete, sender=FileData)
-def create_user_profile(sender, instance, using, **kwargs):
-    instance.cleanup()
+def queue_cleanup(sender, instance, using, **kwargs):
+    # the files are removed by the reaper once the delete is committed
+    PendingCleanup.enqueue(instance.cleanup_entries())
@@ -5,38 +5,78 @@ from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
 
 from .models.upload import Upload
+from .models.cleanup import PendingCleanup
+from .data.models.awdb import AWDBStation
+from .data.extract import delete_expired as delete_expired_extracts
 from .models.download import Download
 
+from .utils import blobstore
 from .utils.filesystem import tempdirectory, get_path_from_tempdir
-from .utils.zipfile import unzipfile, zip_directory
+from .utils.zipfile import unzipfile, zip_entries
+from .utils.validation import hash_file
 from .utils.transaction import abortable_task
 
 from .settings import EBAGIS_TEMP_DIRECTORY, EBAGIS_DOWNLOADS_DIRECTORY
 
 
 @abortable_task
-def export_data(self, download_id):
+def export_data(self, download_id, workers=None):
     download = Download.objects.get(pk=download_id)
     out_dir = os.path.join(EBAGIS_DOWNLOADS_DIRECTORY, download_id)
     os.makedirs(out_dir)
 
+    content = download.content_object
+    zip_path = os.path.join(out_dir, content._archive_name + ".zip")
+    if workers is None:
+        workers = settings.EBAGIS_EXPORT_WORKERS
+
+    # the files are streamed into the zip from where they are stored;
+    # the tempdir only holds content that has to be written out
+    # to be exported, like geodatabases, and only one at a time
     with tempdirectory(prefix="AOI_", dir=EBAGIS_TEMP_DIRECTORY,
                        do_not_remove=settings.DEBUG) as tempdir:
-        temp_aoi_dir = download.content_object.export(
-            tempdir,
-            querydate=download.querydate,
-            create_heirarchy=True,
+        download.file = zip_entries(
+            content.export_entries(download.querydate, tempdir),
+            zip_path,
+            workers=workers,
         )
 
-        zip_dir = os.path.join(out_dir,
-                               os.path.basename(temp_aoi_dir) + ".zip")
-
-        download.file = zip_directory(temp_aoi_dir, zip_dir)
-
+    download.sha256 = hash_file(zip_path)
     download.save()
     return download.id
 
 
+@abortable_task
+def cleanup_downloads(self):
+    delete_expired_extracts()
+    return Download.delete_expired()
+
+
+@abortable_task
+def reap_cleanups(self, batch_size=None):
+    """Removes the paths queued for cleanup. If any removals fail the
+    task is retried with the same growing delay as the failed entries;
+    once the retries run out, they are left to the reapfiles command."""
+    removed, failed = PendingCleanup.reap(batch_size)
+    if failed and self.request.retries < settings.EBAGIS_CLEANUP_MAX_ATTEMPTS:
+        raise self.retry(
+            countdown=settings.EBAGIS_CLEANUP_RETRY_DELAY *
+            2 ** self.request.retries,
+            max_retries=settings.EBAGIS_CLEANUP_MAX_ATTEMPTS,
+        )
+    return "{},{}".format(removed, failed)
+
+
+@abortable_task
+def collect_blobs(self):
+    return "{},{}".format(*blobstore.collect_garbage())
+
+
+@abortable_task
+def sync_awdb_stations(self, path=None):
+    return AWDBStation.sync(AWDBStation.fetch_features(path))
+
+
 @abortable_task
 def process_upload(self, upload_id):
     # I was hoping the upload_id arg could go away,
@@ -1,3 +1,1485 @@
-from django.test import TestCase
+from __future__ import absolute_import
+import os
+import json
+import uuid
+import random
+import shutil
+import zipfile
+import tempfile
 
-# Create your tests here.
+from collections import namedtuple
+from datetime import timedelta
+
+import mock
+import numpy
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.gis.gdal import GDALRaster, OGRGeometry
+from django.contrib.gis.geos import (
+    GEOSGeometry, Point, Polygon, MultiPolygon,
+)
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, RequestFactory,
+)
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.six import StringIO
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from ebagis.data.models import AOI, PourPoint, Directory, File, FileData
+from ebagis.data.models.mixins import remove_subtrees, deactivate_subtrees
+from ebagis.data.models.prefetch import tree_path
+from ebagis.data.serializers import AOISerializer
+from ebagis.data.views.mixins import ZonalStatsMixin, ExtractMixin
+from ebagis.data.extract import request_hash, get_extract
+from ebagis.data.zonal import parse_zones
+from ebagis.models.cleanup import PendingCleanup
+from ebagis.models.download import Download, make_cache_key
+from ebagis.utils import blobstore
+from ebagis.utils.compression import CompressionPolicy, PolicyZipFile
+from ebagis.utils.http import (
+    parse_range_header, _range_applies, stream_file,
+)
+from ebagis.utils.gis.raster import transform
+from ebagis.utils.gis.raster.clip import extend_raster, block_size
+from ebagis.utils.validation import hash_file
+from ebagis.utils.gis.raster.zonal import ZoneStatistics, zonal_statistics
+from ebagis.views.download import DownloadViewSet
+from ebagis.views.filters import SpatialFilter
+
+
+class AOISerializerQueryTest(TestCase):
+    """The AOI detail serializer should load the AOI's content tree in
+    a fixed number of queries, however many layers the AOI has."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="test")
+        self.pourpoint = PourPoint.objects.create(
+            name="test",
+            location=Point(0, 0),
+            source=PourPoint.SOURCE_REFERENCE,
+        )
+
+    def make_aoi(self, name, layers, tree_paths=True):
+        """Makes an AOI with the given number of layers in each of its
+        geodatabases. Without tree_paths the records have no
+        materialized paths, like those imported before they were added,
+        so the tree is loaded by AOI alone."""
+        aoi = AOI.objects.create(
+            name=name,
+            shortname=name,
+            boundary=MultiPolygon(
+                Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0)))
+            ),
+            pourpoint=self.pourpoint,
+            created_by=self.user,
+        )
+
+        # the records are inserted in bulk, as saving
+        # them would also create them in the file system
+        directories, files, versions = [], [], []
+
+        def directory(classname, parent=None, name=None):
+            id = uuid.uuid4()
+            obj = Directory(id=id, aoi=aoi, classname=classname,
+                            name=name or classname.lower(),
+                            _parent_object=parent,
+                            _parent_directory="test",
+                            _tree_path=tree_path(parent, id)
+                            if tree_paths else "",
+                            created_by=self.user)
+            directories.append(obj)
+            return obj
+
+        def add_file(parent, name, classname="File"):
+            obj = File(id=uuid.uuid4(), aoi=aoi, classname=classname,
+                       name=name, _parent_object=parent,
+                       _tree_path=parent._tree_path,
+                       created_by=self.user)
+            files.append(obj)
+            versions.append(FileData(id=uuid.uuid4(), aoi=aoi,
+                                     classname="FileData",
+                                     _parent_object=obj,
+                                     sha256="0" * 64,
+                                     created_by=self.user))
+
+        contents = directory("AOIDirectory")
+        for classname in ("Surfaces", "Layers", "AOIdb", "Analysis"):
+            gdb = directory(classname, contents)
+            for i in range(layers):
+                add_file(gdb, "raster{}".format(i), "Raster")
+                add_file(gdb, "vector{}".format(i), "Vector")
+        prism = directory("Prism", directory("PrismDir", contents))
+        for i in range(layers):
+            add_file(prism, "prism{}".format(i), "Raster")
+        maps = directory("Maps", contents)
+        for i in range(layers):
+            add_file(maps, "map{}.mxd".format(i))
+        zones = directory("Zones", contents)
+        for i in range(layers):
+            hruzones = directory("HRUZones", zones, "zone{}".format(i))
+            data = directory("HRUZonesData", hruzones, hruzones.name)
+            add_file(directory("HRUZonesGDB", data, hruzones.name),
+                     "hru", "Vector")
+            add_file(data, "log.xml")
+
+        Directory._base_manager.bulk_create(directories)
+        File._base_manager.bulk_create(files)
+        FileData._base_manager.bulk_create(versions)
+        return aoi
+
+    def count_queries(self, aoi):
+        request = Request(APIRequestFactory().get("/"))
+        with CaptureQueriesContext(connection) as queries:
+            AOISerializer(
+                AOI.objects.get(pk=aoi.pk), context={"request": request},
+            ).data
+        return len(queries)
+
+    def test_query_count_is_constant(self):
+        small = self.count_queries(self.make_aoi("small", 1))
+        large = self.count_queries(self.make_aoi("large", 20))
+        self.assertEqual(small, large)
+
+    def test_query_count_is_constant_without_tree_paths(self):
+        small = self.count_queries(
+            self.make_aoi("small", 1, tree_paths=False))
+        large = self.count_queries(
+            self.make_aoi("large", 20, tree_paths=False))
+        self.assertEqual(small, large)
+
+    def test_tree_paths_do_not_change_the_tree(self):
+        # two AOIs, so loading a subtree by path alone would pick up
+        # the records of the other AOI if the paths were wrong
+        request = Request(APIRequestFactory().get("/"))
+        with_paths = self.make_aoi("paths", 2)
+        without_paths = self.make_aoi("nopaths", 2, tree_paths=False)
+
+        def layers(aoi):
+            data = AOISerializer(
+                AOI.objects.get(pk=aoi.pk), context={"request": request},
+            ).data
+            return sorted(name for name in _names(data) if name != aoi.name)
+
+        self.assertEqual(layers(with_paths), layers(without_paths))
+
+
+def _names(data):
+    """Yields the names of all the records in serialized data"""
+    if isinstance(data, dict):
+        if 'name' in data and 'id' in data:
+            yield data['name']
+        for value in data.values():
+            for name in _names(value):
+                yield name
+    elif isinstance(data, list):
+        for item in data:
+            for name in _names(item):
+                yield name
+
+
+class TransformTest(SimpleTestCase):
+    # rotated and skewed, so every term of the geotransform matters
+    GEOTRANSFORM = (500000.0, 30.0, 4.0, 4200000.0, 2.5, -30.0)
+
+    def test_round_trip(self):
+        rows = numpy.array([0, 0.5, 10, 123.25, 4000])
+        cols = numpy.array([0, 7.75, 0, 987.5, 3000])
+        xs, ys = transform.forward(self.GEOTRANSFORM, rows, cols)
+        back_rows, back_cols = transform.inverse(self.GEOTRANSFORM, xs, ys)
+        numpy.testing.assert_allclose(back_rows, rows, atol=1e-6)
+        numpy.testing.assert_allclose(back_cols, cols, atol=1e-6)
+
+    def test_inverse_of_singular_geotransform(self):
+        with self.assertRaises(ValueError):
+            transform.inverse((0.0, 1.0, 2.0, 0.0, 1.0, 2.0), [0], [0])
+
+    def test_to_cells_snaps_float_error(self):
+        cells = transform.to_cells([2.9999999999, 3.0000000001, 2.5, -0.5])
+        self.assertEqual(cells.tolist(), [3, 3, 2, -1])
+
+    def test_window_for_extent(self):
+        # a 10x10 raster from (0, 10) to (10, 0)
+        geotransform = (0.0, 1.0, 0.0, 10.0, 0.0, -1.0)
+        window = transform.window_for_extent(
+            geotransform, (2.5, 3, 4, 8.5), 10, 10)
+        self.assertEqual(window, (2, 1, 2, 6))
+
+    def test_window_for_extent_is_clamped(self):
+        geotransform = (0.0, 1.0, 0.0, 10.0, 0.0, -1.0)
+        self.assertEqual(
+            transform.window_for_extent(geotransform, (-5, -5, 20, 20), 10, 10),
+            (0, 0, 10, 10),
+        )
+        self.assertEqual(
+            transform.window_for_extent(geotransform, (5, 5, 15, 15), 10, 10),
+            (5, 0, 5, 5),
+        )
+
+    def test_window_for_extent_off_the_raster(self):
+        geotransform = (0.0, 1.0, 0.0, 10.0, 0.0, -1.0)
+        col, row, width, height = transform.window_for_extent(
+            geotransform, (20, 20, 30, 30), 10, 10)
+        self.assertEqual((width, height), (0, 0))
+
+
+class ZoneStatisticsTest(SimpleTestCase):
+    def test_add(self):
+        stats = ZoneStatistics(2)
+        stats.add([[1, 1], [2, 0]], [[1.0, 3.0], [5.0, 100.0]])
+        # statistics accumulate over blocks
+        stats.add([2, 2], [-1.0, 2.0])
+        results = stats.results(["a", "b"])
+        self.assertEqual(results["a"], {
+            'count': 2, 'sum': 4.0, 'mean': 2.0, 'min': 1.0, 'max': 3.0,
+        })
+        self.assertEqual(results["b"], {
+            'count': 3, 'sum': 6.0, 'mean': 2.0, 'min': -1.0, 'max': 5.0,
+        })
+
+    def test_invalid_cells_are_skipped(self):
+        stats = ZoneStatistics(1)
+        stats.add([1, 1, 1], [1.0, -9999.0, 2.0], [True, False, True])
+        self.assertEqual(stats.results()[1]['count'], 2)
+        self.assertEqual(stats.results()[1]['min'], 1.0)
+
+    def test_empty_zones(self):
+        stats = ZoneStatistics(2)
+        stats.add([1], [1.0], [False])
+        self.assertEqual(stats.results(), {
+            1: {'count': 0, 'sum': None, 'mean': None,
+                'min': None, 'max': None},
+            2: {'count': 0, 'sum': None, 'mean': None,
+                'min': None, 'max': None},
+        })
+
+
+class ZonalStatisticsTest(SimpleTestCase):
+    def setUp(self):
+        # a 4x4 raster from (0, 4) to (4, 0) with the values 0 to 15
+        # by row, where the bottom-right cell (15) is nodata
+        self.raster = GDALRaster({
+            'srid': 4326,
+            'width': 4,
+            'height': 4,
+            'origin': (0, 4),
+            'scale': (1, -1),
+            'datatype': 6,
+            'bands': [{'data': range(16), 'nodata_value': 15}],
+        })
+
+    def box(self, xmin, ymin, xmax, ymax):
+        return OGRGeometry(
+            Polygon.from_bbox((xmin, ymin, xmax, ymax)).wkt, srs=4326,
+        )
+
+    def test_overlapping_zones(self):
+        # the top-left 2x2 cells (0, 1, 4, 5) and the 2x2 cells to the
+        # right of the first column (1, 2, 5, 6): the overlapping cells
+        # count for the later zone only
+        results = zonal_statistics(self.raster, [
+            self.box(0, 2, 2, 4),
+            self.box(1, 2, 3, 4),
+        ]).results()
+        self.assertEqual(results[1]['count'], 2)
+        self.assertEqual(results[1]['sum'], 4.0)
+        self.assertEqual(results[2]['count'], 4)
+        self.assertEqual(results[2]['sum'], 14.0)
+        self.assertEqual(results[2]['max'], 6.0)
+
+    def test_nodata_and_empty_zones(self):
+        results = zonal_statistics(self.raster, [
+            # the nodata cell
+            self.box(3, 0, 4, 1),
+            # off the raster
+            self.box(10, 10, 11, 11),
+            # the bottom row
+            self.box(0, 0, 4, 1),
+        ]).results()
+        self.assertEqual(results[1]['count'], 0)
+        self.assertIsNone(results[1]['mean'])
+        self.assertEqual(results[2]['count'], 0)
+        self.assertEqual(results[3]['count'], 3)
+        self.assertEqual(results[3]['mean'], 13.0)
+
+    def test_max_cells(self):
+        with self.assertRaises(ValueError):
+            zonal_statistics(self.raster, [self.box(0, 0, 4, 4)],
+                             max_cells=15)
+
+
+class ParseRangeHeaderTest(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range_header("bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(parse_range_header("bytes=90-", 100), [(90, 99)])
+        # the last byte is limited to the file
+        self.assertEqual(parse_range_header("bytes=90-200", 100),
+                         [(90, 99)])
+
+    def test_suffix_ranges(self):
+        self.assertEqual(parse_range_header("bytes=-10", 100), [(90, 99)])
+        # longer than the file is the whole file
+        self.assertEqual(parse_range_header("bytes=-200", 100), [(0, 99)])
+        # an empty suffix is not satisfiable
+        self.assertEqual(parse_range_header("bytes=-0", 100), [])
+
+    def test_overlapping_ranges_are_merged(self):
+        self.assertEqual(
+            parse_range_header("bytes=50-59,0-9,5-14,15-19,-45", 100),
+            [(0, 19), (50, 99)],
+        )
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(parse_range_header("bytes=100-", 100), [])
+        self.assertEqual(parse_range_header("bytes=100-200,300-", 100), [])
+        # but any satisfiable range is served
+        self.assertEqual(parse_range_header("bytes=100-,0-0", 100),
+                         [(0, 0)])
+
+    def test_malformed_ranges(self):
+        for header in ("bytes=", "bytes=-", "bytes=a-b", "bytes=9-0",
+                       "items=0-9", "0-9"):
+            self.assertIsNone(parse_range_header(header, 100), header)
+
+
+class RangeAppliesTest(SimpleTestCase):
+    ETAG = "abc123"
+    LAST_MODIFIED = 1500000000
+
+    def applies(self, if_range=None):
+        meta = {"HTTP_IF_RANGE": if_range} if if_range else {}
+        request = RequestFactory().get("/", **meta)
+        return _range_applies(request, self.ETAG, self.LAST_MODIFIED)
+
+    def test_without_if_range(self):
+        self.assertTrue(self.applies())
+
+    def test_etag(self):
+        self.assertTrue(self.applies('"abc123"'))
+        self.assertFalse(self.applies('"def456"'))
+        # weak ETags never match
+        self.assertFalse(self.applies('W/"abc123"'))
+
+    def test_date(self):
+        self.assertTrue(self.applies(http_date(self.LAST_MODIFIED)))
+        self.assertFalse(self.applies(http_date(self.LAST_MODIFIED - 1)))
+        self.assertFalse(self.applies("not a date"))
+
+
+@override_settings(EBAGIS_DOWNLOAD_OFFLOAD=None,
+                   EBAGIS_DOWNLOAD_MAX_RANGES=10)
+class StreamFileRangesTest(SimpleTestCase):
+    CONTENT = b"0123456789abcdefghij"
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "test.bin")
+        with open(self.path, "wb") as f:
+            f.write(self.CONTENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def get(self, range_header):
+        request = RequestFactory().get("/", HTTP_RANGE=range_header)
+        response = stream_file(self.path, request, etag="test",
+                               content_type="application/octet-stream")
+        content = b"".join(response.streaming_content)
+        response.close()
+        return response, content
+
+    def test_single_range(self):
+        response, content = self.get("bytes=2-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, b"2345")
+        self.assertEqual(response["Content-Range"], "bytes 2-5/20")
+        self.assertEqual(int(response["Content-Length"]), 4)
+
+    def test_unsatisfiable_range(self):
+        request = RequestFactory().get("/", HTTP_RANGE="bytes=20-")
+        response = stream_file(self.path, request, etag="test")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */20")
+
+    def test_multipart_ranges(self):
+        response, content = self.get("bytes=0-1,10-12")
+        self.assertEqual(response.status_code, 206)
+
+        content_type, _, boundary = response["Content-Type"].partition(
+            "; boundary=")
+        self.assertEqual(content_type, "multipart/byteranges")
+        self.assertTrue(boundary)
+        self.assertEqual(content, (
+            "--{0}\r\n"
+            "Content-Type: application/octet-stream\r\n"
+            "Content-Range: bytes 0-1/20\r\n"
+            "\r\n"
+            "01\r\n"
+            "--{0}\r\n"
+            "Content-Type: application/octet-stream\r\n"
+            "Content-Range: bytes 10-12/20\r\n"
+            "\r\n"
+            "abc\r\n"
+            "--{0}--\r\n"
+        ).format(boundary).encode("ascii"))
+        self.assertEqual(int(response["Content-Length"]), len(content))
+
+
+class ZonesTest(SimpleTestCase):
+    ZONES = {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "id": "a", "properties": {},
+             "geometry": {"type": "Polygon", "coordinates": [
+                 [[0, 0], [0, 1], [1, 1], [1, 0], [0, 0]]]}},
+            {"type": "Feature", "properties": {},
+             "geometry": {"type": "Polygon", "coordinates": [
+                 [[1, 1], [1, 2], [2, 2], [2, 1], [1, 1]]]}},
+        ],
+    }
+
+    def test_parse_wkt(self):
+        zones = parse_zones("POLYGON ((0 0, 0 1, 1 1, 1 0, 0 0))")
+        self.assertEqual(len(zones), 1)
+        self.assertIsNone(zones[0][0])
+        self.assertEqual(zones[0][1].area, 1)
+
+    def test_parse_geojson(self):
+        zones = parse_zones(json.dumps(self.ZONES))
+        self.assertEqual([id for id, geometry in zones], ["a", 1])
+
+    def test_parse_parsed_geojson(self):
+        zones = parse_zones(self.ZONES)
+        self.assertEqual([id for id, geometry in zones], ["a", 1])
+        self.assertEqual(zones[1][1].extent, (1, 1, 2, 2))
+
+    def test_parse_invalid(self):
+        for zones in ("not a geometry",
+                      {"type": "FeatureCollection", "features": [{}]},
+                      {"type": "FeatureCollection", "features": {"a": 1}},
+                      [1, 2]):
+            with self.assertRaises(ValueError):
+                parse_zones(zones)
+
+    def post(self, data):
+        request = Request(
+            APIRequestFactory().post("/", data, format="json"),
+            parsers=[JSONParser()],
+        )
+        return ZonalStatsMixin()._zones(request, None)
+
+    def test_zones_in_json_body(self):
+        zones = self.post({"zones": self.ZONES})
+        self.assertEqual([id for id, geometry in zones], ["a", 1])
+
+    def test_invalid_zones_in_json_body(self):
+        with self.assertRaises(ParseError):
+            self.post({"zones": {"type": "FeatureCollection",
+                                 "features": [{"id": "a"}]}})
+
+    @override_settings(EBAGIS_ZONAL_STATS_MAX_ZONES=1)
+    def test_too_many_zones(self):
+        with self.assertRaises(ParseError):
+            self.post({"zones": self.ZONES})
+
+
+class PolicyZipFileTest(SimpleTestCase):
+    CHUNK_SIZE = 4096
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        rand = random.Random(0)
+        self.files = {
+            # several chunks, and not a whole number of them
+            "text.txt": "".join(
+                "line {} of some text\n".format(i) for i in range(2000)
+            ),
+            # exactly two chunks
+            "even.txt": "ab" * self.CHUNK_SIZE,
+            # incompressible, so it is stored
+            "random.bin": "".join(
+                chr(rand.randint(0, 255)) for i in range(3 * self.CHUNK_SIZE)
+            ),
+            "photo.jpg": "x" * 100,
+            "empty.txt": "",
+        }
+        self.entries = []
+        for name, content in self.files.items():
+            path = os.path.join(self.tempdir, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            self.entries.append((os.path.join("dir", name), path))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, workers):
+        zip_path = os.path.join(self.tempdir,
+                                "workers{}.zip".format(workers))
+        policy = CompressionPolicy(stored_extensions=(".jpg",),
+                                   min_savings=0.05,
+                                   sample_size=self.CHUNK_SIZE)
+        with PolicyZipFile(zip_path, "w", policy=policy, workers=workers,
+                           chunk_size=self.CHUNK_SIZE) as zipf:
+            zipf.write_entries(self.entries)
+        return zip_path
+
+    def check(self, zip_path):
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(
+                sorted(zipf.namelist()),
+                sorted("dir/" + name for name in self.files),
+            )
+            for name, content in self.files.items():
+                self.assertEqual(zipf.read("dir/" + name), content, name)
+            return dict(
+                (info.filename, info.compress_type)
+                for info in zipf.infolist()
+            )
+
+    def test_parallel_deflate(self):
+        methods = self.check(self.write(workers=3))
+        self.assertEqual(methods["dir/text.txt"], zipfile.ZIP_DEFLATED)
+        self.assertEqual(methods["dir/even.txt"], zipfile.ZIP_DEFLATED)
+        self.assertEqual(methods["dir/random.bin"], zipfile.ZIP_STORED)
+        self.assertEqual(methods["dir/photo.jpg"], zipfile.ZIP_STORED)
+
+    def test_same_as_serial(self):
+        self.assertEqual(self.check(self.write(workers=1)),
+                         self.check(self.write(workers=3)))
+
+
+Version = namedtuple('Version', ['path', 'sha256'])
+
+
+class ExtractTest(SimpleTestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.extracts = os.path.join(self.tempdir, "extracts")
+        self.settings = override_settings(
+            EBAGIS_EXTRACTS_DIRECTORY=self.extracts,
+            EBAGIS_EXTRACT_MAX_CELLS=1000,
+            EBAGIS_EXPORT_WORKERS=1,
+        )
+        self.settings.enable()
+        self.dem = self.make_raster("dem", 0)
+        self.ppt = self.make_raster("ppt", 100)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tempdir)
+
+    def make_raster(self, name, offset):
+        # 10x10 cells of 0.1 degrees from (0, 1) to (1, 0)
+        path = os.path.join(self.tempdir, name + ".tif")
+        GDALRaster({
+            'driver': 'GTiff',
+            'name': path,
+            'srid': 4326,
+            'width': 10,
+            'height': 10,
+            'origin': (0, 1),
+            'scale': (0.1, -0.1),
+            'datatype': 6,
+            'bands': [{'data': range(offset, offset + 100),
+                       'nodata_value': -1}],
+        })._flush()
+        return Version(path, (name * 64)[:64])
+
+    def area(self, xmin, ymin, xmax, ymax):
+        area = Polygon.from_bbox((xmin, ymin, xmax, ymax))
+        area.srid = 4326
+        return area
+
+    def test_request_hash(self):
+        area = self.area(0, 0, 0.5, 0.5)
+        key = request_hash([self.dem], area)
+        self.assertEqual(key, request_hash([self.dem], area))
+        for other in (request_hash([self.ppt], area),
+                      request_hash([self.dem, self.ppt], area),
+                      request_hash([self.dem], self.area(0, 0, 0.4, 0.5)),
+                      request_hash([self.dem], area, mask=False),
+                      request_hash([self.dem], area, srid=3857),
+                      request_hash([self.dem], area, resolution=0.2)):
+            self.assertNotEqual(key, other)
+
+    def test_single_raster(self):
+        # the bottom-left quarter of the raster
+        path = get_extract([("dem", self.dem)], self.area(0, 0, 0.5, 0.5))
+        self.assertTrue(path.startswith(self.extracts))
+        self.assertTrue(path.endswith(".tif"))
+        extract = GDALRaster(path)
+        self.assertEqual((extract.width, extract.height), (5, 5))
+        self.assertEqual(extract.bands[0].data()[0, 0], 50)
+
+        # served from the cache the second time
+        os.utime(path, (0, 0))
+        self.assertEqual(
+            get_extract([("dem", self.dem)], self.area(0, 0, 0.5, 0.5)),
+            path,
+        )
+        self.assertNotEqual(os.path.getmtime(path), 0)
+
+    def test_many_rasters(self):
+        path = get_extract([("dem", self.dem), ("ppt", self.ppt)],
+                           self.area(0, 0, 0.5, 0.5))
+        self.assertTrue(path.endswith(".zip"))
+        with zipfile.ZipFile(path) as zipf:
+            self.assertEqual(sorted(zipf.namelist()),
+                             ["dem.tif", "ppt.tif"])
+
+    def test_no_overlap(self):
+        with self.assertRaises(ValueError):
+            get_extract([("dem", self.dem)], self.area(5, 5, 6, 6))
+        self.assertEqual(os.listdir(self.extracts), [])
+
+    def test_too_many_cells(self):
+        with override_settings(EBAGIS_EXTRACT_MAX_CELLS=99):
+            with self.assertRaises(ValueError):
+                get_extract([("dem", self.dem)], self.area(0, 0, 1, 1))
+
+    def test_resolution_too_fine(self):
+        with self.assertRaises(ValueError):
+            get_extract([("dem", self.dem)], self.area(0, 0, 0.5, 0.5),
+                        resolution=0.001)
+
+
+class ExtractParamsTest(SimpleTestCase):
+    class AOIObject(object):
+        class aoi(object):
+            boundary = MultiPolygon(
+                Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0))), srid=4326,
+            )
+
+    def request(self, **params):
+        return Request(APIRequestFactory().get("/", params))
+
+    def area(self, **params):
+        return ExtractMixin()._area(self.request(**params), self.AOIObject)
+
+    def options(self, **params):
+        return ExtractMixin()._options(self.request(**params))
+
+    def test_default_area(self):
+        self.assertEqual(self.area(), self.AOIObject.aoi.boundary)
+
+    def test_bbox(self):
+        area = self.area(bbox="0,1,2,3")
+        self.assertEqual(area.extent, (0, 1, 2, 3))
+        self.assertEqual(area.srid, 4326)
+        for bbox in ("0,1,2", "a,b,c,d"):
+            with self.assertRaises(ParseError):
+                self.area(bbox=bbox)
+
+    def test_geometry(self):
+        area = self.area(geometry="POLYGON ((0 0, 0 1, 1 1, 1 0, 0 0))")
+        self.assertEqual(area.area, 1)
+        for geometry in ("POINT (0 0)", "LINESTRING (0 0, 1 1)",
+                         "not a geometry",
+                         '{"type": "FeatureCollection", "features": []}'):
+            with self.assertRaises(ParseError):
+                self.area(geometry=geometry)
+
+    def test_options(self):
+        self.assertEqual(self.options(), {
+            'mask': True, 'srid': None, 'resolution': None,
+        })
+        self.assertEqual(
+            self.options(mask="false", srid="3857", resolution="30"),
+            {'mask': False, 'srid': 3857, 'resolution': 30.0},
+        )
+        for params in ({'srid': "web"}, {'resolution': "fine"},
+                       {'resolution': "0"}, {'resolution': "-1"}):
+            with self.assertRaises(ParseError):
+                self.options(**params)
+
+
+class BlobStoreTest(SimpleTestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tempdir, "blobs")
+        self.settings = override_settings(AOI_BLOB_DIRECTORY=self.root)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def nlink(self, path):
+        return os.stat(path).st_nlink
+
+    def test_store(self):
+        src = self.write("src", b"layer")
+        sha256, blob = blobstore.store(src)
+        self.assertEqual(sha256, hash_file(src))
+        self.assertEqual(blob, blobstore.blob_path(sha256))
+        self.assertTrue(blob.startswith(
+            os.path.join(self.root, sha256[:2]))
+        )
+        with open(blob, 'rb') as f:
+            self.assertEqual(f.read(), b"layer")
+
+        # the same content is stored once
+        other = self.write("other", b"layer")
+        self.assertEqual(blobstore.store(other), (sha256, blob))
+        self.assertEqual(blobstore.store(other, sha256), (sha256, blob))
+        self.assertEqual(self.nlink(blob), 1)
+        self.assertEqual(os.listdir(self.root), [sha256[:2]])
+
+    def test_checkout(self):
+        sha256, blob = blobstore.store(self.write("src", b"layer"))
+        first = blobstore.checkout(sha256, os.path.join(self.tempdir, "a"))
+        second = blobstore.checkout(sha256, os.path.join(self.tempdir, "b"))
+        self.assertEqual(self.nlink(blob), 3)
+        for path in (first, second):
+            self.assertTrue(os.path.samefile(path, blob))
+
+        with self.assertRaises(blobstore.BlobMissing):
+            blobstore.checkout("0" * 64, os.path.join(self.tempdir, "c"))
+
+    def test_store_and_checkout(self):
+        dst = os.path.join(self.tempdir, "dst")
+        sha256, path = blobstore.store_and_checkout(
+            self.write("src", b"layer"), dst
+        )
+        self.assertEqual(path, dst)
+        self.assertTrue(os.path.samefile(dst, blobstore.blob_path(sha256)))
+
+    def test_release(self):
+        sha256, blob = blobstore.store(self.write("src", b"layer"))
+        first = blobstore.checkout(sha256, os.path.join(self.tempdir, "a"))
+        second = blobstore.checkout(sha256, os.path.join(self.tempdir, "b"))
+
+        # the blob stays while another file links to it
+        blobstore.release(first, sha256)
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(self.nlink(blob), 2)
+
+        blobstore.release(second, sha256)
+        self.assertFalse(os.path.exists(second))
+        self.assertFalse(os.path.exists(blob))
+
+        # releasing again is harmless
+        blobstore.release(second, sha256)
+
+    def test_release_without_hash(self):
+        sha256, blob = blobstore.store(self.write("src", b"layer"))
+        path = blobstore.checkout(sha256, os.path.join(self.tempdir, "a"))
+        blobstore.release(path)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.nlink(blob), 1)
+
+    def test_reap(self):
+        sha256, blob = blobstore.store(self.write("src", b"layer"))
+        path = blobstore.checkout(sha256, os.path.join(self.tempdir, "a"))
+        blobstore.reap(path, sha256)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(blob))
+
+        directory = os.path.join(self.tempdir, "aoi")
+        os.makedirs(os.path.join(directory, "layers"))
+        self.write(os.path.join("aoi", "layers", "dem.img"), b"dem")
+        blobstore.reap(directory)
+        self.assertFalse(os.path.exists(directory))
+        blobstore.reap(directory)
+
+    def test_collect_garbage(self):
+        used, used_blob = blobstore.store(self.write("used", b"used"))
+        unused, unused_blob = blobstore.store(self.write("unused", b"old"))
+        blobstore.checkout(used, os.path.join(self.tempdir, "a"))
+
+        fresh = blobstore._temp_name(os.path.join(self.root, "ingest"))
+        stale = blobstore._temp_name(os.path.join(self.root, "ingest"))
+        for path in (fresh, stale):
+            with open(path, 'wb') as f:
+                f.write(b"part")
+        os.utime(stale, (0, 0))
+
+        self.assertEqual(blobstore.collect_garbage(), (2, 7))
+        self.assertTrue(os.path.exists(used_blob))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertFalse(os.path.exists(unused_blob))
+        self.assertFalse(os.path.exists(stale))
+
+
+class MakeCacheKeyTest(SimpleTestCase):
+    class Parent(object):
+        def __init__(self, aoi_path):
+            self.aoi_path = aoi_path
+
+    class Version(object):
+        def __init__(self, pk, aoi_path):
+            self.pk = pk
+            self.parent_object = MakeCacheKeyTest.Parent(aoi_path)
+
+    class Content(object):
+        pk = uuid.UUID(int=1)
+        _archive_name = "test"
+
+        def __init__(self, versions):
+            self.versions = versions
+
+        def export_versions(self, querydate):
+            return self.versions
+
+    def key(self, versions=None):
+        if versions is None:
+            versions = [self.Version(1, "a/dem.img"),
+                        self.Version(2, "a/ppt.img")]
+        return make_cache_key(self.Content(versions), None)
+
+    def test_versions(self):
+        key = self.key()
+        self.assertEqual(len(key), 64)
+        # whatever order they are exported in
+        self.assertEqual(key, self.key([self.Version(2, "a/ppt.img"),
+                                        self.Version(1, "a/dem.img")]))
+        self.assertNotEqual(key, self.key([self.Version(1, "a/dem.img")]))
+        self.assertNotEqual(key, self.key([self.Version(1, "a/dem.img"),
+                                           self.Version(3, "a/ppt.img")]))
+        self.assertNotEqual(key, self.key([self.Version(1, "a/dem.img"),
+                                           self.Version(2, "b/ppt.img")]))
+
+    def test_compression_settings(self):
+        key = self.key()
+        for setting, value in (
+                ('EBAGIS_EXPORT_COMPRESSION', 'stored'),
+                ('EBAGIS_EXPORT_COMPRESSION_LEVEL', 1),
+                ('EBAGIS_EXPORT_STORED_EXTENSIONS', ('.zip',)),
+                ('EBAGIS_EXPORT_MIN_COMPRESSION_SAVINGS', 0.5)):
+            with override_settings(**{setting: value}):
+                self.assertNotEqual(key, self.key(), setting)
+
+
+class CachedDownloadTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.settings = override_settings(
+            EBAGIS_DOWNLOADS_DIRECTORY=self.tempdir,
+        )
+        self.settings.enable()
+        self.user = get_user_model().objects.create(username="test")
+        self.content_type = ContentType.objects.get_for_model(AOI)
+        self.object_id = uuid.uuid4()
+
+        archive = os.path.join(self.tempdir, "cached", "test.zip")
+        os.makedirs(os.path.dirname(archive))
+        with open(archive, 'wb') as f:
+            f.write(b"archive")
+        self.cached = Download.objects.create(
+            user=self.user,
+            content_type=self.content_type,
+            object_id=self.object_id,
+            name="test",
+            cache_key="key",
+            file=archive,
+            sha256="hash",
+        )
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tempdir)
+
+    def new_download(self):
+        return Download(user=self.user,
+                        content_type=self.content_type,
+                        object_id=self.object_id,
+                        name="test",
+                        cache_key="key")
+
+    def test_get_cached(self):
+        self.assertEqual(Download.get_cached("key"), self.cached)
+        self.assertIsNone(Download.get_cached("other"))
+        self.assertIsNone(Download.get_cached(None))
+
+    def test_use_cached(self):
+        download = self.new_download()
+        self.assertTrue(download.use_cached(self.cached))
+        download.save()
+
+        self.assertEqual(download.sha256, "hash")
+        self.assertEqual(download.nstatus, 'COMPLETED')
+        self.assertNotEqual(download.task_id, None)
+        self.assertEqual(os.path.dirname(download.file.path),
+                         os.path.join(self.tempdir, str(download.pk)))
+        with open(download.file.path, 'rb') as f:
+            self.assertEqual(f.read(), b"archive")
+
+        # the archive outlives the cached download
+        self.cached.delete()
+        self.assertTrue(os.path.exists(download.file.path))
+
+    def test_use_cached_archive_gone(self):
+        os.remove(self.cached.file.path)
+        download = self.new_download()
+        self.assertFalse(download.use_cached(self.cached))
+        self.assertFalse(download.file)
+        self.assertIsNone(download.task)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tempdir, str(download.pk))
+        ))
+
+    def test_archive_gone_is_exported(self):
+        os.remove(self.cached.file.path)
+        request = Request(APIRequestFactory().get("/"))
+        request.user = self.user
+
+        with mock.patch('ebagis.views.download.export_data') as export:
+            export.delay.return_value.task_id = str(uuid.uuid4())
+            response = DownloadViewSet().download(
+                request, self.content_type, self.object_id,
+                name="test", cache_key="key",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        download = Download.objects.get(pk=response.data['id'])
+        export.delay.assert_called_once_with(str(download.pk))
+        self.assertFalse(download.file)
+        self.assertEqual(download.task.task_id,
+                         export.delay.return_value.task_id)
+
+
+class SpatialFilterTest(TestCase):
+    class View(object):
+        action = 'list'
+        spatial_fields = ('location', 'boundary')
+
+    def setUp(self):
+        for name, lon, lat in (("origin", 0, 0),
+                               ("near", 0.1, 0),
+                               ("far", 10, 10)):
+            PourPoint.objects.create(
+                name=name,
+                location=Point(lon, lat),
+                source=PourPoint.SOURCE_REFERENCE,
+            )
+
+    def filter(self, **params):
+        request = Request(APIRequestFactory().get("/", params))
+        return SpatialFilter().filter_queryset(
+            request, PourPoint.objects.all(), self.View(),
+        )
+
+    def names(self, **params):
+        return [point.name for point in self.filter(**params)]
+
+    def test_no_params(self):
+        self.assertEqual(sorted(self.names()), ["far", "near", "origin"])
+
+    def test_not_list(self):
+        view = self.View()
+        view.action = 'retrieve'
+        request = Request(APIRequestFactory().get("/", {'in_bbox': "a"}))
+        queryset = PourPoint.objects.all()
+        self.assertIs(
+            SpatialFilter().filter_queryset(request, queryset, view),
+            queryset,
+        )
+
+    def test_spatial_field(self):
+        self.assertEqual(self.names(spatial_field="boundary",
+                                    in_bbox="-1,-1,1,1"), [])
+        with self.assertRaises(ParseError):
+            self.filter(spatial_field="name", in_bbox="-1,-1,1,1")
+
+    def test_in_bbox(self):
+        self.assertEqual(sorted(self.names(in_bbox="-1,-1,1,1")),
+                         ["near", "origin"])
+        for bbox in ("-1,-1,1", "-1,-1,1,1,1", "a,b,c,d", ""):
+            with self.assertRaises(ParseError):
+                self.filter(in_bbox=bbox)
+
+    def test_intersects(self):
+        polygon = "POLYGON ((9 9, 9 11, 11 11, 11 9, 9 9))"
+        self.assertEqual(self.names(intersects=polygon), ["far"])
+        self.assertEqual(
+            self.names(intersects=json.dumps(json.loads(
+                GEOSGeometry(polygon).geojson
+            ))),
+            ["far"],
+        )
+        # transformed to lon/lat
+        self.assertEqual(self.names(
+            intersects="SRID=3857;POLYGON ((-1000 -1000, -1000 1000, "
+                       "1000 1000, 1000 -1000, -1000 -1000))",
+        ), ["origin"])
+
+    def test_intersects_invalid(self):
+        for geometry in ("not a geometry", "POLYGON ((0 0))",
+                         "SRID=999999;POINT (0 0)"):
+            with self.assertRaises(ParseError):
+                self.filter(intersects=geometry)
+
+    def test_point(self):
+        self.assertEqual(self.names(point="0.09,0"),
+                         ["near", "origin", "far"])
+        for point in ("0", "0,0,0", "a,b"):
+            with self.assertRaises(ParseError):
+                self.filter(point=point)
+
+    def test_dwithin(self):
+        self.assertEqual(self.names(point="0,0", dwithin="1km"), ["origin"])
+        self.assertEqual(self.names(point="0,0", dwithin="20000"),
+                         ["origin", "near"])
+        self.assertEqual(self.names(point="0,0", dwithin="20 km"),
+                         ["origin", "near"])
+        with self.assertRaises(ParseError):
+            self.filter(point="0,0", dwithin="far")
+        with self.assertRaises(ParseError):
+            self.filter(dwithin="1km")
+
+    def test_nearest(self):
+        self.assertEqual(self.names(point="10,9", nearest="1"), ["far"])
+        self.assertEqual(self.names(point="0,0", nearest="2"),
+                         ["origin", "near"])
+        for nearest in ("0", "-1", "a", "1.5"):
+            with self.assertRaises(ParseError):
+                self.filter(point="0,0", nearest=nearest)
+        with self.assertRaises(ParseError):
+            self.filter(nearest="1")
+
+
+class ClipTest(SimpleTestCase):
+    # an L along the left and bottom of the raster's bottom-left
+    # quarter; its edges are on cell edges, so no cell is ambiguous
+    GEOMETRY = "POLYGON ((0 0, 0 5, 2 5, 2 2, 5 2, 5 0, 0 0))"
+
+    def setUp(self):
+        # 10x10 cells from (0, 10) to (10, 0), valued row * 10 + col
+        self.raster = extend_raster(GDALRaster({
+            'srid': 4326,
+            'width': 10,
+            'height': 10,
+            'origin': (0, 10),
+            'scale': (1, -1),
+            'datatype': 5,
+            'bands': [{'data': range(100)}],
+        }))
+        self.geometry = OGRGeometry(self.GEOMETRY, srs=4326)
+
+    def test_clip(self):
+        clipped = self.raster.clip(self.geometry)
+        self.assertEqual((clipped.width, clipped.height), (5, 5))
+        self.assertEqual(clipped.origin, [0, 5])
+        numpy.testing.assert_array_equal(
+            clipped.bands[0].data(),
+            numpy.arange(100).reshape(10, 10)[5:, :5],
+        )
+
+    def test_clip_with_mask(self):
+        clipped = self.raster.clip(self.geometry, mask=True)
+        nodata = clipped.bands[0].nodata_value
+        self.assertEqual(nodata, 0)
+
+        expected = numpy.arange(100).reshape(10, 10)[5:, :5]
+        rows, cols = numpy.indices(expected.shape)
+        expected[(cols >= 2) & (rows < 3)] = nodata
+        numpy.testing.assert_array_equal(clipped.bands[0].data(), expected)
+
+    def test_clip_to_file(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            # a tiled source keeps its tiles in the clip
+            source = extend_raster(GDALRaster({
+                'driver': 'GTiff',
+                'name': os.path.join(tempdir, "source.tif"),
+                'srid': 4326,
+                'width': 64,
+                'height': 64,
+                'origin': (0, 10),
+                'scale': (0.25, -0.25),
+                'datatype': 1,
+                'nr_of_bands': 1,
+                'papsz_options': {
+                    'tiled': 'yes',
+                    'blockxsize': 16,
+                    'blockysize': 16,
+                },
+            }))
+            name = os.path.join(tempdir, "clip.tif")
+            clipped = source.clip(self.geometry, name=name)
+            self.assertEqual(clipped.name, name)
+            self.assertEqual(clipped.driver.name, 'GTiff')
+            self.assertEqual((clipped.width, clipped.height), (20, 20))
+            self.assertEqual(block_size(clipped.bands[0]), (16, 16))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_mask_in_place(self):
+        self.raster.bands[0].nodata_value = -1
+        masked = self.raster.mask(self.geometry)
+        self.assertIs(masked, self.raster)
+
+        expected = numpy.arange(100).reshape(10, 10)
+        rows, cols = numpy.indices(expected.shape)
+        inside = ((cols < 2) & (rows >= 5)) | ((cols < 5) & (rows >= 8))
+        expected[~inside] = -1
+        numpy.testing.assert_array_equal(masked.bands[0].data(), expected)
+
+    def test_mask_clone(self):
+        masked = self.raster.mask(self.geometry, clone=True)
+        self.assertIsNot(masked, self.raster)
+        self.assertEqual((masked.width, masked.height), (10, 10))
+        self.assertEqual(masked.bands[0].data()[0, 9], 0)
+        # the source is untouched
+        numpy.testing.assert_array_equal(
+            self.raster.bands[0].data(),
+            numpy.arange(100).reshape(10, 10),
+        )
+
+    def test_no_overlap(self):
+        with self.assertRaises(ValueError):
+            self.raster.clip(OGRGeometry(
+                "POLYGON ((20 20, 20 30, 30 30, 30 20, 20 20))", srs=4326,
+            ))
+
+    def test_not_a_polygon(self):
+        for geometry in ("POINT (1 1)", "LINESTRING (0 0, 5 5)"):
+            with self.assertRaises(TypeError):
+                self.raster.clip(OGRGeometry(geometry, srs=4326))
+            with self.assertRaises(TypeError):
+                self.raster.mask(OGRGeometry(geometry, srs=4326))
+
+
+class SubtreeTest(TestCase):
+    """Removing and deactivating a directory updates everything under
+    it, and only that, and queues the files of what is deactivated."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="test")
+        self.created_at = timezone.now() - timedelta(days=1)
+        self.aoi = AOI.objects.create(
+            name="test",
+            shortname="test",
+            boundary=MultiPolygon(
+                Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0)))
+            ),
+            pourpoint=PourPoint.objects.create(
+                name="test",
+                location=Point(0, 0),
+                source=PourPoint.SOURCE_REFERENCE,
+            ),
+            created_by=self.user,
+        )
+
+    def make_tree(self, tree_paths=True):
+        """top/child/grandchild and other, with a
+        file in each of child, grandchild and other"""
+        directories, files, versions = [], [], []
+
+        def directory(name, parent=None):
+            id = uuid.uuid4()
+            obj = Directory(id=id, aoi=self.aoi, classname="Directory",
+                            name=name, _parent_object=parent,
+                            _parent_directory="test",
+                            _tree_path=tree_path(parent, id)
+                            if tree_paths else "",
+                            created_at=self.created_at,
+                            created_by=self.user)
+            directories.append(obj)
+            return obj
+
+        def add_file(parent, name):
+            obj = File(id=uuid.uuid4(), aoi=self.aoi, classname="File",
+                       name=name, _parent_object=parent,
+                       _tree_path=parent._tree_path,
+                       created_at=self.created_at,
+                       created_by=self.user)
+            files.append(obj)
+            versions.append(FileData(id=uuid.uuid4(), aoi=self.aoi,
+                                     classname="FileData",
+                                     _parent_object=obj,
+                                     sha256=name * 64,
+                                     created_at=self.created_at,
+                                     created_by=self.user))
+
+        top = directory("top")
+        child = directory("child", top)
+        grandchild = directory("grandchild", child)
+        other = directory("other")
+        for parent in (child, grandchild, other):
+            add_file(parent, parent.name[0])
+
+        Directory._base_manager.bulk_create(directories)
+        File._base_manager.bulk_create(files)
+        FileData._base_manager.bulk_create(versions)
+        return child
+
+    def names(self, queryset):
+        return sorted(obj.name for obj in queryset)
+
+    def versions(self, queryset):
+        return sorted(obj._parent_object.name for obj in queryset)
+
+    def test_remove(self):
+        child = self.make_tree()
+        removed_at = timezone.now()
+        report = remove_subtrees(
+            Directory._base_manager.filter(pk=child.pk), removed_at,
+        )
+        self.assertEqual(dict(report.updated),
+                         {'Directory': 2, 'File': 2, 'FileData': 2})
+        self.assertEqual(report.cleanup, {})
+
+        # the subtree is hidden
+        self.assertEqual(self.names(Directory.objects.current()),
+                         ["other", "top"])
+        self.assertEqual(self.names(File.objects.current()), ["o"])
+        self.assertEqual(self.versions(FileData.objects.current()), ["o"])
+
+        # but still there as of an earlier date
+        querydate = removed_at - timedelta(hours=1)
+        self.assertEqual(
+            self.names(Directory.objects.filter(created_at__lte=querydate)),
+            ["child", "grandchild", "other", "top"],
+        )
+        self.assertEqual(
+            self.versions(FileData.objects.removed().filter(
+                created_at__lte=querydate, removed_at__gt=querydate,
+            )),
+            ["c", "g"],
+        )
+        self.assertFalse(PendingCleanup.objects.exists())
+
+    def test_remove_keeps_removal_dates(self):
+        child = self.make_tree()
+        first = timezone.now() - timedelta(hours=2)
+        Directory.objects.filter(name="grandchild").delete()
+        grandchild = Directory._base_manager.get(name="grandchild")
+        grandchild_removed_at = grandchild.removed_at
+
+        remove_subtrees(Directory._base_manager.filter(pk=child.pk), first)
+        self.assertEqual(
+            Directory._base_manager.get(name="grandchild").removed_at,
+            grandchild_removed_at,
+        )
+        self.assertEqual(
+            Directory._base_manager.get(name="child").removed_at, first,
+        )
+
+    def test_queryset_delete(self):
+        self.make_tree(tree_paths=False)
+        report = Directory.objects.filter(name="child").delete()
+        self.assertEqual(report.total, 6)
+        self.assertEqual(self.names(Directory.objects.removed()),
+                         ["child", "grandchild"])
+        self.assertEqual(self.names(File.objects.removed()), ["c", "g"])
+
+    def test_deactivate_requires_removal(self):
+        child = self.make_tree()
+        with self.assertRaises(ValueError):
+            deactivate_subtrees(Directory._base_manager.filter(pk=child.pk))
+        self.assertEqual(Directory.objects.inactive().count(), 0)
+        self.assertFalse(PendingCleanup.objects.exists())
+
+    def check_deactivated(self, report):
+        self.assertEqual(dict(report.updated),
+                         {'Directory': 2, 'File': 2, 'FileData': 2})
+        self.assertEqual(self.names(Directory.objects.archived()),
+                         ["child", "grandchild"])
+        self.assertEqual(self.names(File.objects.archived()), ["c", "g"])
+        self.assertEqual(self.versions(FileData.objects.archived()),
+                         ["c", "g"])
+        self.assertEqual(self.names(Directory.objects.active()),
+                         ["other", "top"])
+
+        # still there as of an earlier date
+        querydate = timezone.now() - timedelta(hours=1)
+        self.assertEqual(
+            self.versions(FileData._base_manager.filter(
+                created_at__lte=querydate,
+            )),
+            ["c", "g", "o"],
+        )
+
+        # the files go before the directories holding them
+        versions = FileData._base_manager.filter(
+            _active=False,
+        ).select_related('_parent_object___parent_object')
+        directories = Directory._base_manager.filter(_active=False)
+        self.assertEqual(
+            sorted(report.cleanup),
+            [Directory._meta.label, FileData._meta.label],
+        )
+        self.assertEqual(
+            sorted(report.cleanup[FileData._meta.label]),
+            sorted(str(version.pk) for version in versions),
+        )
+        entries = list(PendingCleanup.objects.order_by('pk').values_list(
+            'path', 'sha256',
+        ))
+        self.assertEqual(
+            sorted(entries[:2]),
+            sorted((version._storage_path, version.sha256)
+                   for version in versions),
+        )
+        self.assertEqual(
+            sorted(entries[2:]),
+            sorted((directory._storage_path, "")
+                   for directory in directories),
+        )
+        self.assertEqual(PendingCleanup.due().count(), 4)
+
+    def test_deactivate(self):
+        child = self.make_tree()
+        remove_subtrees(Directory._base_manager.filter(pk=child.pk))
+        self.check_deactivated(
+            deactivate_subtrees(Directory._base_manager.filter(pk=child.pk))
+        )
+
+    def test_queryset_deactivate_without_tree_paths(self):
+        self.make_tree(tree_paths=False)
+        Directory.objects.filter(name="child").delete()
+        self.check_deactivated(
+            Directory.objects.filter(name="child").deactivate()
+        )
+
+
+@override_settings(EBAGIS_CLEANUP_MAX_ATTEMPTS=3,
+                   EBAGIS_CLEANUP_RETRY_DELAY=60)
+class PendingCleanupTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.settings = override_settings(
+            AOI_BLOB_DIRECTORY=os.path.join(self.tempdir, "blobs"),
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, content=b"content"):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def failed(self, entry, attempts):
+        """makes the entry due with the given number of failures"""
+        PendingCleanup.objects.filter(pk=entry.pk).update(
+            attempts=attempts,
+            next_attempt_at=timezone.now() - timedelta(seconds=1),
+        )
+
+    def test_reap(self):
+        directory = os.path.join(self.tempdir, "directory")
+        os.mkdir(directory)
+        self.write(os.path.join("directory", "file"))
+        sha256, blob = blobstore.store(self.write("layer"))
+        version = blobstore.checkout(sha256, self.write("version"))
+        paths = [self.write("file{}".format(i)) for i in range(3)]
+
+        self.assertEqual(PendingCleanup.enqueue(
+            [(path, None) for path in paths] +
+            [(version, sha256), (directory, None)]
+        ), 5)
+        self.assertEqual(PendingCleanup.reap(batch_size=2), (5, 0))
+
+        for path in paths + [version, blob, directory]:
+            self.assertFalse(os.path.exists(path), path)
+        self.assertFalse(PendingCleanup.objects.exists())
+        self.assertEqual(PendingCleanup.enqueue([]), 0)
+
+    def test_retry_later(self):
+        path = self.write("file")
+        PendingCleanup.enqueue([(path, None)])
+        entry = PendingCleanup.objects.get()
+
+        with mock.patch('ebagis.models.cleanup.blobstore.reap',
+                        side_effect=OSError("busy")):
+            before = timezone.now()
+            self.assertEqual(PendingCleanup.reap(batch_size=1), (0, 1))
+            entry.refresh_from_db()
+            self.assertEqual(entry.attempts, 1)
+            self.assertEqual(entry.last_error, "busy")
+            self.assertGreaterEqual(entry.next_attempt_at,
+                                    before + timedelta(seconds=60))
+            self.assertLessEqual(entry.next_attempt_at,
+                                 timezone.now() + timedelta(seconds=60))
+
+            # not due until the delay has passed
+            self.assertFalse(PendingCleanup.due().exists())
+            self.assertEqual(PendingCleanup.reap(), (0, 0))
+
+            # and the delay doubles with each attempt
+            self.failed(entry, 1)
+            before = timezone.now()
+            self.assertEqual(PendingCleanup.reap(), (0, 1))
+            entry.refresh_from_db()
+            self.assertEqual(entry.attempts, 2)
+            self.assertGreaterEqual(entry.next_attempt_at,
+                                    before + timedelta(seconds=120))
+
+        self.failed(entry, 2)
+        self.assertEqual(PendingCleanup.reap(), (1, 0))
+        self.assertFalse(os.path.exists(path))
+
+    def test_max_attempts(self):
+        path = self.write("file")
+        PendingCleanup.enqueue([(path, None)])
+        entry = PendingCleanup.objects.get()
+
+        with mock.patch('ebagis.models.cleanup.blobstore.reap',
+                        side_effect=OSError("busy")):
+            self.failed(entry, 2)
+            self.assertEqual(PendingCleanup.reap(), (0, 1))
+
+        # given up on, even once the delay has passed
+        self.failed(entry, 3)
+        self.assertFalse(PendingCleanup.due().exists())
+        self.assertEqual(list(PendingCleanup.stuck()), [entry])
+        self.assertEqual(PendingCleanup.reap(), (0, 0))
+        self.assertTrue(os.path.exists(path))
+
+    def test_retry_stuck(self):
+        path = self.write("file")
+        PendingCleanup.enqueue([(path, None)])
+        self.failed(PendingCleanup.objects.get(), 3)
+
+        out = StringIO()
+        call_command('reapfiles', stdout=out, stderr=out)
+        self.assertTrue(os.path.exists(path))
+        self.assertIn("1 paths could not be removed", out.getvalue())
+
+        call_command('reapfiles', retry_stuck=True, stdout=out, stderr=out)
+        self.assertIn("Reset 1 stuck paths", out.getvalue())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(PendingCleanup.objects.exists())
+
+
+class PendingCleanupCommitTest(TransactionTestCase):
+    """The reaper is only queued once the records using the paths
+    are gone for good, that is, once the transaction commits."""
+
+    def test_queued_on_commit(self):
+        with mock.patch('ebagis.models.cleanup.queue_reaper') as queue:
+            with transaction.atomic():
+                PendingCleanup.enqueue([("/nonexistent", None)])
+                self.assertFalse(queue.called)
+            queue.assert_called_once_with()
+        self.assertEqual(PendingCleanup.due().count(), 1)
+
+    def test_not_queued_on_rollback(self):
+        with mock.patch('ebagis.models.cleanup.queue_reaper') as queue:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    PendingCleanup.enqueue([("/nonexistent", None)])
+                    raise ValueError()
+            self.assertFalse(queue.called)
+        self.assertFalse(PendingCleanup.objects.exists())
@@ -0,0 +1,235 @@
+from __future__ import absolute_import
+import os
+import errno
+import time
+import shutil
+import logging
+
+from django.conf import settings
+
+from .misc import random_string
+from .filesystem import hardlink
+from .validation import copy_and_hash
+
+
+logger = logging.getLogger(__name__)
+
+# seconds before an orphaned temp file is considered abandoned
+STALE_TEMP_AGE = 24 * 60 * 60
+
+# times to store a file if its blob keeps being released before
+# it can be checked out (see store_and_checkout)
+STORE_ATTEMPTS = 3
+
+
+# Content-addressed storage for imported files.
+#
+# Every blob is stored once under its sha256 hash and the files
+# inside the AOI directories are hard links to these blobs. Identical
+# content (e.g., the PRISM or DEM layers shared by many AOIs) therefore
+# only takes up space on disk once. The link count of a blob doubles as
+# its reference count: a blob with a single link is only referenced by
+# the store itself and can be garbage collected.
+#
+# Blobs are shared between AOIs, so they must never be modified in
+# place. All files in the store are treated as immutable, and only
+# finished files go in it: layers are written by arcpy to a temp
+# directory first, and only stored once arcpy is done with them.
+#
+# Blobs are removed when the last file linking to them is released;
+# collect_garbage (see the collectblobs command) finds any missed.
+
+
+class BlobMissing(OSError):
+    """The blob to check out is not in the store"""
+
+
+def get_root():
+    return settings.AOI_BLOB_DIRECTORY
+
+
+def blob_path(sha256):
+    """Returns the path of the blob for the given hash.
+    Blobs are split into subdirectories by the first two
+    characters of the hash to keep directory sizes sane."""
+    return os.path.join(get_root(), sha256[:2], sha256)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise e
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except (IOError, OSError) as e:
+        # check to see if the error was
+        # that the file is already gone
+        if e.errno != errno.ENOENT:
+            raise e
+
+
+def _temp_name(path):
+    return "{}.{}.tmp".format(path, random_string(8))
+
+
+def _link_count(path):
+    """Returns the number of hard links to path, or None
+    if the platform does not report link counts (python 2
+    on windows always reports 0)."""
+    nlink = os.stat(path).st_nlink
+    return nlink if nlink > 0 else None
+
+
+def store(src, sha256=None):
+    """Add a copy of the file at src to the blob store,
+    returning a tuple of the hash and the blob path. If the
+    hash is not given, the file is hashed while it is copied
+    so it only has to be read once."""
+    if sha256 is not None and os.path.exists(blob_path(sha256)):
+        return sha256, blob_path(sha256)
+
+    # copy to a temp name first so a partial
+    # copy can never be mistaken for a blob
+    _makedirs(get_root())
+    tmp = _temp_name(os.path.join(get_root(), "ingest"))
+    try:
+        if sha256 is None:
+            sha256 = copy_and_hash(src, tmp)
+        else:
+            copy_and_hash(src, tmp)
+
+        path = blob_path(sha256)
+        if os.path.exists(path):
+            # we already had this content
+            _remove(tmp)
+            return sha256, path
+
+        _makedirs(os.path.dirname(path))
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another import stored the same content
+            # while we were copying; ours can go
+            if not os.path.exists(path):
+                raise
+    finally:
+        _remove(tmp)
+
+    return sha256, path
+
+
+def checkout(sha256, dst):
+    """Make dst a hard link to the blob with the given hash.
+    Falls back to a plain copy if the link cannot be created
+    (e.g., the blob store is on a different volume). Raises
+    BlobMissing if there is no such blob."""
+    src = blob_path(sha256)
+    try:
+        try:
+            hardlink(src, dst)
+        except OSError as e:
+            if not os.path.exists(src):
+                raise
+            logger.warning(
+                "Could not link blob {} to {}, copying instead: {}"
+                .format(src, dst, e)
+            )
+            shutil.copyfile(src, dst)
+    except (IOError, OSError) as e:
+        if os.path.exists(src):
+            raise
+        raise BlobMissing(errno.ENOENT, "No blob {}".format(sha256), src)
+    return dst
+
+
+def store_and_checkout(src, dst, sha256=None):
+    """Add a copy of the file at src to the blob store and make dst a
+    link to it (see store and checkout), returning a tuple of the hash
+    and dst. The blob is unreferenced until it is checked out, so it can
+    be released, or collected, by another process in between; if so the
+    file is stored again, up to STORE_ATTEMPTS times."""
+    for attempt in range(1, STORE_ATTEMPTS + 1):
+        sha256, blob = store(src, sha256)
+        try:
+            return sha256, checkout(sha256, dst)
+        except BlobMissing:
+            if attempt == STORE_ATTEMPTS:
+                raise
+            logger.info(
+                "Blob {} was removed before it was checked out, "
+                "storing it again".format(sha256)
+            )
+
+
+def release(path, sha256=None):
+    """Remove a file that may be linked to the blob store. If
+    the hash is given and the blob is no longer referenced by
+    any other file, the blob is removed as well."""
+    _remove(path)
+
+    if sha256 is None:
+        return
+
+    blob = blob_path(sha256)
+    try:
+        if _link_count(blob) == 1:
+            _remove(blob)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise e
+
+
+def reap(path, sha256=None):
+    """Remove a path queued for cleanup: a directory is removed
+    with everything in it, and a file is released (see release)."""
+    if os.path.isdir(path):
+        try:
+            shutil.rmtree(path)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise e
+    else:
+        release(path, sha256)
+
+
+def collect_garbage():
+    """Walk the blob store and remove any blobs no longer
+    referenced by a file outside the store. Stale temp files
+    from failed copies are removed as well. Returns a tuple
+    of the number of files and bytes removed."""
+    removed, freed = 0, 0
+
+    for root, dirs, files in os.walk(get_root()):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            if name.endswith(".tmp"):
+                # don't pull the rug out from under a copy in progress
+                if time.time() - stat.st_mtime < STALE_TEMP_AGE:
+                    continue
+            elif stat.st_nlink != 1:
+                # either still referenced or the platform does not
+                # give us link counts, in which case we can't know
+                continue
+
+            try:
+                _remove(path)
+            except (IOError, OSError):
+                logger.exception(
+                    "Failed to remove blob: {}".format(path)
+                )
+                continue
+
+            removed += 1
+            freed += stat.st_size
+
+    return removed, freed
@@ -0,0 +1,391 @@
+from __future__ import absolute_import
+import os
+import time
+import zlib
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# zip compression method ID for zstandard (APPNOTE 6.3.7);
+# not all unzip tools support it, so only use it for internal clients
+ZIP_ZSTANDARD = 93
+
+# version needed to extract entries by compression method
+_EXTRACT_VERSIONS = {
+    zipfile.ZIP_STORED: 10,
+    zipfile.ZIP_DEFLATED: 20,
+    ZIP_ZSTANDARD: 63,
+}
+
+COMPRESSION_METHODS = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'zstd': ZIP_ZSTANDARD,
+}
+
+DEFAULT_LEVELS = {
+    zipfile.ZIP_STORED: None,
+    zipfile.ZIP_DEFLATED: 6,
+    ZIP_ZSTANDARD: 3,
+}
+
+
+def _setting(name, fallback):
+    """Returns the django setting, or the fallback if django is not
+    configured, e.g., in the benchmarks. The defaults are only set in
+    the settings (see settings/ebagis.py); the fallbacks simply turn
+    the corresponding checks off."""
+    try:
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+    except ImportError:
+        return fallback
+    try:
+        return getattr(settings, name, fallback)
+    except ImproperlyConfigured:
+        return fallback
+
+
+class CompressionPolicy(object):
+    """Decides how each file written to an archive is compressed.
+
+    Files with an extension in stored_extensions are stored without
+    compression. Otherwise a sample of the file is compressed with
+    the cheapest deflate level, and if that does not shrink the sample
+    by at least min_savings (a fraction of the sample size) the file is
+    stored, as compressing it would mostly just burn CPU. Everything
+    else uses the policy's method and level. stored_extensions and
+    min_savings default to the EBAGIS_EXPORT_STORED_EXTENSIONS and
+    EBAGIS_EXPORT_MIN_COMPRESSION_SAVINGS settings.
+
+    zstd requires the optional zstandard package, and threads sets
+    the number of zstd worker threads (0 for none, -1 for one per CPU).
+    """
+    def __init__(self, method='deflate', level=None,
+                 stored_extensions=None, sample_size=2**16,
+                 min_savings=None, threads=0):
+        try:
+            self.method = COMPRESSION_METHODS[method]
+        except KeyError:
+            raise ValueError(
+                "Unknown compression method: {}".format(method)
+            )
+
+        if self.method == ZIP_ZSTANDARD and zstandard is None:
+            raise ValueError(
+                "zstd compression requires the zstandard package"
+            )
+
+        if stored_extensions is None:
+            stored_extensions = _setting('EBAGIS_EXPORT_STORED_EXTENSIONS',
+                                         ())
+        if min_savings is None:
+            min_savings = _setting('EBAGIS_EXPORT_MIN_COMPRESSION_SAVINGS',
+                                   0)
+
+        self.level = level if level is not None \
+            else DEFAULT_LEVELS[self.method]
+        self.stored_extensions = tuple(ext.lower()
+                                       for ext in stored_extensions)
+        self.sample_size = sample_size
+        self.min_savings = min_savings
+        self.threads = threads
+
+    @classmethod
+    def from_settings(cls):
+        from django.conf import settings
+        return cls(
+            method=settings.EBAGIS_EXPORT_COMPRESSION,
+            level=settings.EBAGIS_EXPORT_COMPRESSION_LEVEL,
+            threads=settings.EBAGIS_EXPORT_ZSTD_THREADS,
+        )
+
+    def choose(self, path):
+        """Returns the (compression method, level) to use for a file"""
+        if self.method == zipfile.ZIP_STORED:
+            return zipfile.ZIP_STORED, None
+
+        if path.lower().endswith(self.stored_extensions):
+            return zipfile.ZIP_STORED, None
+
+        if self.sample_size and not self._compressible(path):
+            return zipfile.ZIP_STORED, None
+
+        return self.method, self.level
+
+    def _compressible(self, path):
+        # sample the start and the middle of the file, as
+        # many formats start with a very compressible header
+        size = os.path.getsize(path)
+        offsets = [0] if size <= self.sample_size else [0, size // 2]
+        chunk = self.sample_size // len(offsets)
+
+        sample = []
+        with open(path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                sample.append(f.read(chunk))
+        sample = "".join(sample)
+
+        if not sample:
+            return False
+
+        compressed = len(zlib.compress(sample, 1))
+        return 1 - float(compressed) / len(sample) >= self.min_savings
+
+    def compressor(self, method, level):
+        if method == zipfile.ZIP_DEFLATED:
+            return zlib.compressobj(level, zlib.DEFLATED, -15)
+        elif method == ZIP_ZSTANDARD:
+            return zstandard.ZstdCompressor(
+                level=level, threads=self.threads,
+            ).compressobj()
+        return None
+
+
+def _deflate_chunk(data, level, final):
+    """Deflates a chunk of a file on its own. All but the last chunk
+    end with a sync flush, which ends the output on a byte boundary
+    without ending the stream, so the compressed chunks can simply be
+    concatenated. Each chunk starts with an empty dictionary, which
+    costs a little in compression ratio on chunk boundaries."""
+    cmpr = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return cmpr.compress(data) + \
+        cmpr.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _Entry(object):
+    """the state of an entry while its data is being written"""
+    def __init__(self, zinfo, zip64, cmpr=None):
+        self.zinfo = zinfo
+        self.zip64 = zip64
+        self.cmpr = cmpr
+        self.CRC = 0
+        self.file_size = 0
+        self.compress_size = 0
+
+
+class PolicyZipFile(zipfile.ZipFile):
+    """ZipFile that compresses each file written according to a
+    CompressionPolicy. Python 2's ZipFile.write always deflates with
+    the default level and only knows deflate, so write is reimplemented
+    here to support per-file methods and levels, and zstd.
+
+    With more than one worker, write_entries deflates files in chunks
+    on a thread pool (zlib releases the GIL while compressing), while
+    the calling thread writes the chunks out in order."""
+    def __init__(self, file, mode="w", policy=None, allowZip64=True,
+                 workers=1, chunk_size=2**20):
+        super(PolicyZipFile, self).__init__(
+            file, mode, zipfile.ZIP_DEFLATED, allowZip64,
+        )
+        self.policy = policy or CompressionPolicy()
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def _resolve(self, filename, compress_type, compress_level):
+        if compress_type is None:
+            return self.policy.choose(filename)
+        elif compress_level is None:
+            return compress_type, DEFAULT_LEVELS[compress_type]
+        return compress_type, compress_level
+
+    def write(self, filename, arcname=None, compress_type=None,
+              compress_level=None):
+        """Put the bytes from filename into the archive under the name
+        arcname, compressed per the policy unless a compression method
+        is given. Directories are not supported."""
+        if not self.fp:
+            raise RuntimeError(
+                "Attempt to write to ZIP archive that was already closed"
+            )
+
+        compress_type, compress_level = self._resolve(
+            filename, compress_type, compress_level,
+        )
+        zinfo = self._make_zinfo(filename, arcname, compress_type)
+        entry = self._start_entry(
+            zinfo, self.policy.compressor(compress_type, compress_level),
+        )
+
+        with open(filename, "rb") as fp:
+            while True:
+                buf = fp.read(self.chunk_size)
+                if not buf:
+                    break
+                self._write_data(entry, buf)
+
+        self._finish_entry(entry)
+
+    def write_entries(self, entries):
+        """Put each file in an iterable of (archive name, path) tuples
+        into the archive. Uses the worker threads, if any."""
+        if self.workers <= 1:
+            for arcname, path in entries:
+                self.write(path, arcname)
+            return
+
+        from collections import deque
+        from multiprocessing.pool import ThreadPool
+
+        if not self.fp:
+            raise RuntimeError(
+                "Attempt to write to ZIP archive that was already closed"
+            )
+
+        # we only read ahead a few chunks per worker
+        # to keep the memory use bounded
+        window = self.workers * 4
+        pending = deque()
+        pool = ThreadPool(self.workers)
+        try:
+            for chunk in self._read_chunks(entries, pool):
+                pending.append(chunk)
+                if len(pending) >= window:
+                    self._write_chunk(*pending.popleft())
+            while pending:
+                self._write_chunk(*pending.popleft())
+        finally:
+            pool.close()
+            pool.join()
+
+    def _read_chunks(self, entries, pool):
+        """Yields (entry, data, result, final) for each chunk of each
+        file, where result is the pending deflated chunk, or None if
+        the chunk is to be compressed by the writer in order."""
+        for arcname, path in entries:
+            compress_type, level = self._resolve(path, None, None)
+            zinfo = self._make_zinfo(path, arcname, compress_type)
+            deflate = compress_type == zipfile.ZIP_DEFLATED
+            # zstd (which has its own threads) and stored
+            # entries are handled by the writer as usual
+            entry = _Entry(
+                zinfo, None,
+                None if deflate else self.policy.compressor(compress_type,
+                                                            level),
+            )
+
+            with open(path, "rb") as fp:
+                data = fp.read(self.chunk_size)
+                while True:
+                    # read ahead to know if this is the last chunk
+                    next_data = fp.read(self.chunk_size)
+                    final = not next_data
+                    result = None
+                    if deflate:
+                        result = pool.apply_async(_deflate_chunk,
+                                                  (data, level, final))
+                    yield entry, data, result, final
+                    if final:
+                        break
+                    data = next_data
+
+    def _write_chunk(self, entry, data, result, final):
+        if entry.zip64 is None:
+            # first chunk of the entry
+            self._start_entry(entry.zinfo, entry.cmpr, entry)
+        if result is None:
+            self._write_data(entry, data)
+        else:
+            self._write_data(entry, data, result.get())
+        if final:
+            self._finish_entry(entry)
+
+    def _make_zinfo(self, filename, arcname, compress_type):
+        st = os.stat(filename)
+        if arcname is None:
+            arcname = filename
+        arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
+        while arcname[0] in (os.sep, os.altsep):
+            arcname = arcname[1:]
+
+        zinfo = zipfile.ZipInfo(arcname,
+                                time.localtime(st.st_mtime)[0:6])
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+        zinfo.compress_type = compress_type
+        zinfo.extract_version = max(zinfo.extract_version,
+                                    _EXTRACT_VERSIONS[compress_type])
+        zinfo.create_version = max(zinfo.create_version,
+                                   zinfo.extract_version)
+        zinfo.file_size = st.st_size
+        zinfo.flag_bits = 0x00
+        return zinfo
+
+    def _check(self, zinfo):
+        # ZipFile._writecheck rejects methods it does not know, so
+        # this does its remaining checks for the methods we allow
+        if zinfo.filename in self.NameToInfo:
+            import warnings
+            warnings.warn('Duplicate name: %r' % zinfo.filename,
+                          stacklevel=3)
+        if zinfo.compress_type not in _EXTRACT_VERSIONS:
+            raise RuntimeError(
+                "That compression method is not supported"
+            )
+        if not self._allowZip64 and (
+                zinfo.file_size > zipfile.ZIP64_LIMIT or
+                zinfo.header_offset > zipfile.ZIP64_LIMIT):
+            raise zipfile.LargeZipFile("Zipfile size would require ZIP64 "
+                                       "extensions")
+
+    def _start_entry(self, zinfo, cmpr, entry=None):
+        zinfo.header_offset = self.fp.tell()
+        self._check(zinfo)
+        self._didModify = True
+
+        # Must overwrite CRC and sizes with correct data later
+        zinfo.CRC = 0
+        zinfo.compress_size = 0
+        # Compressed size can be larger than uncompressed size
+        zip64 = self._allowZip64 and \
+            zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        self.fp.write(zinfo.FileHeader(zip64))
+
+        if entry is None:
+            entry = _Entry(zinfo, zip64, cmpr)
+        entry.zip64 = zip64
+        return entry
+
+    def _write_data(self, entry, data, compressed=None):
+        """Writes a chunk of the entry's file. The compressed data
+        is given if the chunk was compressed elsewhere; otherwise
+        the entry's compressor, if any, is used."""
+        entry.file_size += len(data)
+        entry.CRC = zlib.crc32(data, entry.CRC) & 0xffffffff
+        if compressed is None:
+            compressed = entry.cmpr.compress(data) if entry.cmpr else data
+        entry.compress_size += len(compressed)
+        self.fp.write(compressed)
+
+    def _finish_entry(self, entry):
+        zinfo = entry.zinfo
+        if entry.cmpr:
+            buf = entry.cmpr.flush()
+            entry.compress_size += len(buf)
+            self.fp.write(buf)
+
+        zinfo.compress_size = entry.compress_size
+        zinfo.CRC = entry.CRC
+        zinfo.file_size = entry.file_size
+        if not entry.zip64 and self._allowZip64:
+            if entry.file_size > zipfile.ZIP64_LIMIT:
+                raise RuntimeError(
+                    'File size has increased during compressing'
+                )
+            if entry.compress_size > zipfile.ZIP64_LIMIT:
+                raise RuntimeError(
+                    'Compressed size larger than uncompressed size'
+                )
+
+        # Seek backwards and write file header (which will now include
+        # correct CRC and file sizes)
+        position = self.fp.tell()
+        self.fp.seek(zinfo.header_offset, 0)
+        self.fp.write(zinfo.FileHeader(entry.zip64))
+        self.fp.seek(position, 0)
+        self.filelist.append(zinfo)
+        self.NameToInfo[zinfo.filename] = zinfo
@@ -121,6 +121,52 @@ def tempdirectory(suffix="", prefix="", dir=None, do_not_remove=False):
             rmtree(tmpdir)
 
 
+def hardlink(src, dst):
+    """Create a hard link at dst to the file at src"""
+    import os
+    try:
+        link = os.link
+    except AttributeError:
+        # python 2 on windows does not provide os.link,
+        # so we have to call the win32 API directly
+        import ctypes
+        if not ctypes.windll.kernel32.CreateHardLinkW(
+            unicode(dst), unicode(src), None
+        ):
+            raise ctypes.WinError()
+    else:
+        link(src, dst)
+
+
+def walk_files(directory_path, archive_root=""):
+    """Yields an (archive name, path) tuple for every file under
+    the directory path, where the archive name is the path of the
+    file relative to the directory, joined to the archive root."""
+    import os
+    for root, dirs, files in os.walk(directory_path):
+        rel_dir = os.path.relpath(root, directory_path)
+        for f in files:
+            yield (os.path.normpath(os.path.join(archive_root, rel_dir, f)),
+                   os.path.join(root, f))
+
+
+def materialized_entries(export, archive_root="", dir=None):
+    """For content that can only be exported by writing it out (e.g.,
+    geodatabases, which arcpy has to build), calls export with a new
+    temp directory and yields the (archive name, path) tuples for the
+    files under the path it returns. The temp directory is removed once
+    all the entries have been consumed, so only one such export needs
+    to exist on disk at a time."""
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    tmpdir = mkdtemp(prefix="export_", dir=dir)
+    try:
+        for entry in walk_files(export(tmpdir), archive_root):
+            yield entry
+    finally:
+        rmtree(tmpdir)
+
+
 def get_path_from_tempdir(tempdir):
     import os
     tempdircontents = os.listdir(tempdir)
@@ -157,7 +203,7 @@ class FileWrapper(object):
         # get methods off filelike
         self.tell = filelike.tell
         self.read = filelike.read
-        if hasattr(filelike, ' close'):
+        if hasattr(filelike, 'close'):
             self.close = filelike.close
 
     def __getitem__(self, key):
@@ -89,23 +89,17 @@ def get_wkt_geometry(sourcefile, layername=None):
 
     crs_wkt = layer.GetSpatialRef().ExportToWkt()
 
-    # iterate through features in shapefile, getting geometry as WKT
+    # iterate through features in order, getting geometry as WKT;
+    # reading sequentially avoids guessing at the feature IDs, which
+    # start at 0 in shapefiles but at 1 in geodatabases
+    # (see also geom.extract, which avoids WKT altogether)
     geometries = []
 
-    # shapefiles start feature indicies at 0, but geodatabase seems
-    # to start a 1; using a while loop to allow skipping indicies within
-    # the feature count range that do not return a feature
-    i = 0
-    while i <= layer.GetFeatureCount():
-        try:
-            feature = layer.GetFeature(i)
-            wkt = feature.GetGeometryRef().ExportToWkt()
-            geometries.append(wkt)
-        except AttributeError:
-            pass
-        except RuntimeError:
-            pass
-        i += 1
+    layer.ResetReading()
+    for feature in layer:
+        geom = feature.GetGeometryRef()
+        if geom is not None:
+            geometries.append(geom.ExportToWkt())
 
     feature = None
     layer = None
@@ -0,0 +1,125 @@
+"""Extracts the geometry of a vector layer as a GEOS geometry.
+
+The features are read in order with the layer's own reader (no
+per-index GetFeature probing), their parts are collected into a single
+OGR geometry, and that is unioned and reprojected once before being
+handed to GEOS as WKB. Nothing goes through WKT, so large boundaries
+are never formatted, sliced, and parsed as strings."""
+from __future__ import absolute_import
+
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
+from django.utils import six
+
+from .. import validate_spatial_ref
+
+
+def open_layer(sourcefile, layername=None):
+    """Returns the OGR dataset and the layer with the
+    given name (default the first) of the sourcefile.
+    The dataset must be kept while the layer is used."""
+    from osgeo import ogr
+
+    ogr.UseExceptions()
+
+    dataset = ogr.Open(sourcefile)
+
+    if not dataset:
+        raise Exception("Failed to open file {}.".format(sourcefile))
+
+    if layername:
+        layer = dataset.GetLayerByName(layername)
+    else:
+        layer = dataset.GetLayer(0)
+
+    if layer is None:
+        raise Exception(
+            "Failed to open layer {} of {}.".format(layername, sourcefile)
+        )
+
+    return dataset, layer
+
+
+def iter_geometries(layer):
+    """Yields the OGR geometries of the features of the layer, in
+    order, skipping features without a geometry. Each geometry is a
+    clone, so it outlives its feature."""
+    layer.ResetReading()
+    feature = layer.GetNextFeature()
+    while feature is not None:
+        geom = feature.GetGeometryRef()
+        if geom is not None and not geom.IsEmpty():
+            yield geom.Clone()
+        feature = layer.GetNextFeature()
+
+
+def _to_geos(geom, srid):
+    return GEOSGeometry(six.memoryview(bytes(geom.ExportToWkb())),
+                        srid=srid)
+
+
+def _transform(geom, src_crs, dst_epsg):
+    from osgeo import osr
+    dst_crs = validate_spatial_ref(dst_epsg)
+    # a layer without a spatial reference is taken to be in dst_epsg
+    if src_crs is not None and not src_crs.IsSame(dst_crs):
+        geom.Transform(osr.CoordinateTransformation(src_crs, dst_crs))
+    return geom
+
+
+def get_multipolygon(sourcefile, dst_epsg, layername=None):
+    """Returns the polygons of the layer, unioned into a single GEOS
+    MultiPolygon in the dst_epsg. Overlapping or touching polygons
+    are dissolved, so the result is always a valid multipolygon."""
+    from osgeo import ogr
+
+    dataset, layer = open_layer(sourcefile, layername=layername)
+    src_crs = layer.GetSpatialRef()
+
+    parts = ogr.Geometry(ogr.wkbMultiPolygon)
+    for geom in iter_geometries(layer):
+        geom.FlattenTo2D()
+        # also linearizes the curved polygons geodatabases can have
+        geom = ogr.ForceToMultiPolygon(geom)
+        if geom.GetGeometryType() != ogr.wkbMultiPolygon:
+            raise TypeError("Invalid or unknown geometry type detected.")
+        for i in xrange(geom.GetGeometryCount()):
+            parts.AddGeometry(geom.GetGeometryRef(i))
+
+    if parts.IsEmpty():
+        raise ValueError(
+            "No polygons found in {} of {}.".format(layername, sourcefile)
+        )
+
+    # a single polygon is already as good as it gets
+    if parts.GetGeometryCount() > 1:
+        parts = ogr.ForceToMultiPolygon(parts.UnionCascaded())
+
+    geom = _to_geos(_transform(parts, src_crs, dst_epsg), dst_epsg)
+    layer = dataset = None
+
+    if not isinstance(geom, MultiPolygon):
+        geom = MultiPolygon(geom, srid=dst_epsg)
+    return geom
+
+
+def get_point(sourcefile, dst_epsg, layername=None):
+    """Returns the first point of the layer as a GEOS Point in the
+    dst_epsg. Only the 2D coordinates are kept."""
+    from osgeo import ogr
+
+    dataset, layer = open_layer(sourcefile, layername=layername)
+    src_crs = layer.GetSpatialRef()
+
+    for geom in iter_geometries(layer):
+        if ogr.GT_Flatten(geom.GetGeometryType()) == ogr.wkbMultiPoint:
+            geom = geom.GetGeometryRef(0).Clone()
+        elif ogr.GT_Flatten(geom.GetGeometryType()) != ogr.wkbPoint:
+            raise TypeError("Invalid or unknown geometry type detected.")
+        geom.FlattenTo2D()
+        point = _to_geos(_transform(geom, src_crs, dst_epsg), dst_epsg)
+        layer = dataset = None
+        return point
+
+    raise ValueError(
+        "No points found in {} of {}.".format(layername, sourcefile)
+    )
@@ -1,54 +1,49 @@
+"""Clipping and masking of GDAL rasters to polygons.
+
+Rasters are processed a block at a time, using the native block size
+of the source, and only the blocks in the window covering the extent
+of the geometry are read. The mask is rasterized per block, and only
+for blocks the geometry's boundary crosses: blocks entirely outside
+the geometry are filled with nodata without being read, and blocks
+entirely inside are copied as is. Output is written block by block,
+so with a file output memory use is bounded by the block size and the
+GDAL cache (GDAL_CACHEMAX), not by the size of the raster."""
 from __future__ import absolute_import, print_function
 
-from math import floor, ceil
+from ctypes import byref, c_char_p, c_int, c_void_p, POINTER, c_double
 
-from ctypes import c_char_p, c_int, c_void_p, POINTER, c_double
+import numpy
 
-from django.contrib.gis.gdal import GDALRaster
+from django.contrib.gis.gdal import GDALRaster, OGRGeometry
 from django.contrib.gis.gdal.libgdal import lgdal
+from django.contrib.gis.gdal.raster.const import GDAL_TO_CTYPES
 from django.contrib.gis.gdal.prototypes.raster import void_output
 from django.contrib.gis.gdal.prototypes.generation import voidptr_output
 
+from . import transform
 
-def px_coords_from_geographic_coords(gdal_raster, pointcoords, roundfn=floor):
-    image = gdal_raster
 
-    # get raster edge coords
-    left = image.geotransform[0]
-    top = image.geotransform[3]
-    right = image.width * image.geotransform[1] + image.geotransform[0]
-    bottom = image.height * image.geotransform[5] + image.geotransform[3]
-
-    # calc px coords for each set of point coords
-    pxcoords = []
-    for coords in pointcoords:
-        col = int(roundfn(image.width * (coords[0] - left) / (right - left)))
-        row = int(roundfn(image.height * (coords[1] - top) / (bottom - top)))
-        pxcoords.append((row, col))
-
-    return pxcoords
+def px_coords_from_geographic_coords(gdal_raster, pointcoords,
+                                     roundfn=numpy.floor):
+    """
+    returns pxcoords in (row, col) format; roundfn is applied
+    to each coordinate, as by transform.to_cells
+    """
+    if not isinstance(roundfn, numpy.ufunc):
+        roundfn = numpy.vectorize(roundfn)
+    xs, ys = numpy.asarray(pointcoords, dtype=numpy.float64).reshape(-1, 2).T
+    rows, cols = transform.to_pixel(gdal_raster.geotransform, xs, ys,
+                                    roundfn=roundfn)
+    return zip(rows.tolist(), cols.tolist())
 
 
 def geographic_coords_from_px_coords(gdal_raster, pxcoords):
     """
     uses (row, col) format for pxcoords
     """
-    image = gdal_raster
-
-    # get raster edge coords
-    left = image.geotransform[0]
-    top = image.geotransform[3]
-    horz_px_size = image.geotransform[1]
-    vert_px_size = image.geotransform[5]
-
-    # calc geo coords for each set of px coords
-    pointcoords = []
-    for coord in pxcoords:
-        x = left + coord[1] * horz_px_size
-        y = top + coord[0] * vert_px_size
-        pointcoords.append((x, y))
-
-    return pointcoords
+    rows, cols = numpy.asarray(pxcoords, dtype=numpy.float64).reshape(-1, 2).T
+    xs, ys = transform.forward(gdal_raster.geotransform, rows, cols)
+    return zip(xs.tolist(), ys.tolist())
 
 
 def check_geom_is_polygon(geom):
@@ -65,46 +60,39 @@ def check_geom_is_polygon(geom):
         )
 
 
-def extend_raster(gdal_raster):
-    gdal_raster.clip = clip.__get__(gdal_raster)
-    gdal_raster.mask = mask.__get__(gdal_raster)
-    return gdal_raster
-
-
-def clip(self, ogr_geom):
-    check_geom_is_polygon(ogr_geom)
-
-    # reproject geom to match raster
-    transformed_geom = ogr_geom.transform(self.srs, clone=True) \
-        if ogr_geom.srs != self.srs else ogr_geom
+def pixel_window(gdal_raster, extent):
+    """Returns the (col, row, width, height) of the cells of the
+    raster covering the (xmin, ymin, xmax, ymax) extent, limited
+    to the cells of the raster"""
+    return transform.window_for_extent(
+        gdal_raster.geotransform,
+        extent,
+        gdal_raster.width,
+        gdal_raster.height,
+    )
 
-    # find the raster cells for the clipped origin and antiorigin
-    # (the latter is the lower right corner)
-    origin_x, antiorigin_y, antiorigin_x, origin_y = transformed_geom.extent
-    origin_pxcoords = px_coords_from_geographic_coords(
-        self,
-        ((origin_x, origin_y),),
-    )[0]
-    antiorigin_pxcoords = px_coords_from_geographic_coords(
-        self,
-        ((antiorigin_x, antiorigin_y),),
-        roundfn=ceil,
-    )[0]
 
-    new_origin = geographic_coords_from_px_coords(self, (origin_pxcoords,))[0]
+def iter_blocks(window, size):
+    """Yields the (col, row, width, height) of the parts of the window
+    in each block of a raster with blocks of the given (width, height),
+    so every read or write covers at most one native block"""
+    col, row, width, height = window
+    block_x, block_y = size
+    end_col, end_row = col + width, row + height
 
-    height = antiorigin_pxcoords[0] - origin_pxcoords[0]
-    width = antiorigin_pxcoords[1] - origin_pxcoords[1]
+    for block_row in xrange(row - row % block_y, end_row, block_y):
+        top = max(block_row, row)
+        bottom = min(block_row + block_y, end_row)
+        for block_col in xrange(col - col % block_x, end_col, block_x):
+            left = max(block_col, col)
+            right = min(block_col + block_x, end_col)
+            yield left, top, right - left, bottom - top
 
-    raster = extend_raster(self.warp(
-        {
-            'width': width,
-            'height': height,
-            'origin': new_origin,
-        },
-    ))
 
-    return raster
+def extend_raster(gdal_raster):
+    gdal_raster.clip = clip.__get__(gdal_raster)
+    gdal_raster.mask = mask.__get__(gdal_raster)
+    return gdal_raster
 
 
 # GDALRasterizeOptionsNew
@@ -199,60 +187,61 @@ rasterize_geometries = void_output(
 )
 
 
-def mask(
-    self,
-    ogr_geom,
-    all_touched=False,
-    clone=False,
-):
-    """
-    Clips an instance of django.contrib.gis.gdal.GDALRaster to the shape of
-    a django.contrib.gis.geos.OGRGeometry instance.
-    """
-    check_geom_is_polygon(ogr_geom)
+# GDALGetBlockSize
+# GDALRasterBandH hBand the band.
+# int * pnXSize the block width.
+# int * pnYSize the block height.
+get_block_size = void_output(
+    lgdal['GDALGetBlockSize'],
+    [
+        c_void_p,
+        POINTER(c_int),
+        POINTER(c_int),
+    ],
+    errcheck=False,
+)
 
-    # reproject geom to match raster
-    transformed_geom = ogr_geom.transform(self.srs, clone=True) \
-        if ogr_geom.srs != self.srs else ogr_geom
 
-    # create a temp raster dataset for masking
-    masked = GDALRaster({
-        'srid': self.srid,
-        'width': self.width,
-        'height': self.height,
-        'origin': self.origin,
-        'scale': self.scale,
-        'skew': self.skew,
-        'nr_of_bands': 1,
-        'datatype': 5,
-    })
+def block_size(band):
+    """Returns the native (width, height) of the blocks of the band"""
+    x, y = c_int(), c_int()
+    get_block_size(band.ptr, byref(x), byref(y))
+    return x.value, y.value
+
 
-    # we only need one band for the mask
+def burn(gdal_raster, ogr_geom, all_touched=False):
+    """Burns a value of 1 into the first band of the raster
+    wherever it is covered by the geometry"""
+    burn_geometries(gdal_raster, [ogr_geom], [1], all_touched=all_touched)
+
+
+def burn_geometries(gdal_raster, ogr_geoms, values, all_touched=False):
+    """Burns each of the geometries into the first band of the raster
+    with the corresponding value, in a single pass. Where geometries
+    overlap the value of the later geometry is kept."""
+    # we only need one band
     band_arr = (c_int * 1)()
     band_arr[:] = [1]
 
-    # could make the geom arg a list in the future
-    # if wanting to provide a means to mask with
-    # multiple geometries
-    geom_arr = (c_void_p * 1)()
-    geom_arr[:] = [transformed_geom.ptr]
+    geom_arr = (c_void_p * len(ogr_geoms))()
+    geom_arr[:] = [geom.ptr for geom in ogr_geoms]
 
-    # we're simply using a burn  value of 1 for each band
-    burn_arr = (c_double * len(band_arr))()
-    burn_arr[:] = [1] * len(band_arr)
+    # one value per band for each geometry
+    burn_arr = (c_double * len(ogr_geoms))()
+    burn_arr[:] = [float(value) for value in values]
 
     # create the opts to set all touched
     opts = []
     if all_touched:
-        opts.append('ALL_TOUCHED')
+        opts.append('ALL_TOUCHED=TRUE')
 
-    # make the opts a C array
-    opt_arr = (c_char_p * len(opts))()
-    opt_arr[:] = opts
+    # make the opts a NULL-terminated C array
+    opt_arr = (c_char_p * (len(opts) + 1))()
+    opt_arr[:] = opts + [None]
 
     # call the C function to make the mask
     rasterize_geometries(
-        masked.ptr,
+        gdal_raster.ptr,
         len(band_arr),
         band_arr,
         len(geom_arr),
@@ -265,23 +254,196 @@ def mask(
         None,
     )
 
-    # probably don't need this with the MEM driver,
-    # but it shouldn't hurt anything to have it
-    masked._flush()
 
-    #masked.warp({'driver': 'GTiff', 'name': 'mask.tif'})
+def block_mask(gdal_raster, ogr_geom, block, all_touched=False):
+    """Returns whether the cells of the block are in the geometry:
+    True if all are, False if none are, or else an array of bools.
+    Only blocks the boundary crosses need to be rasterized."""
+    box = footprint(gdal_raster, block)
+    if not ogr_geom.intersects(box):
+        return False
+    if ogr_geom.contains(box):
+        return True
+
+    # a small mask dataset just for this block
+    masked = create_band_like(gdal_raster, block, datatype=1)
+    burn(masked, ogr_geom, all_touched=all_touched)
+    return masked.bands[0].data() != 0
+
+
+def footprint(gdal_raster, window):
+    """Returns the polygon covered by the window of the
+    raster, which is not a box if the raster is skewed"""
+    xs, ys = transform.corners(gdal_raster.geotransform, window)
+    return OGRGeometry('POLYGON (({}))'.format(", ".join(
+        "{!r} {!r}".format(x, y)
+        for x, y in zip(xs.tolist() + xs[:1].tolist(),
+                        ys.tolist() + ys[:1].tolist())
+    )))
+
+
+def create_band_like(gdal_raster, window, datatype):
+    """Creates a single-band in-memory raster of the datatype
+    aligned with the raster and covering the window"""
+    col, row, width, height = window
+    return GDALRaster({
+        'srid': gdal_raster.srid,
+        'width': width,
+        'height': height,
+        'origin': geographic_coords_from_px_coords(
+            gdal_raster,
+            ((row, col),),
+        )[0],
+        'scale': gdal_raster.scale,
+        'skew': gdal_raster.skew,
+        'nr_of_bands': 1,
+        'datatype': datatype,
+    })
+
+
+def nodata(band):
+    """the value for cells outside the geometry"""
+    return band.nodata_value if band.nodata_value is not None else 0
+
+
+def copy_blocks(source, window, target, ogr_geom=None,
+                all_touched=False, in_place=False):
+    """Copies the window of the source raster into the target, one
+    block at a time, setting the cells outside the geometry (if any)
+    to nodata. The target covers exactly the window. If in_place, the
+    target is the source, and blocks that do not change are skipped."""
+    col, row = window[:2]
+    for block in iter_blocks(window, block_size(source.bands[0])):
+        inside = True
+        if ogr_geom is not None:
+            inside = block_mask(source, ogr_geom, block,
+                                all_touched=all_touched)
+        if in_place and inside is True:
+            continue
+
+        offset = (block[0] - col, block[1] - row)
+        size = block[2:]
+        for band, target_band in zip(source.bands, target.bands):
+            if inside is False:
+                # nothing to read, as nothing is kept
+                data = numpy.full(
+                    (size[1], size[0]),
+                    nodata(band),
+                    dtype=GDAL_TO_CTYPES[band.datatype()],
+                )
+            else:
+                data = band.data(offset=block[:2], size=size)
+                if inside is not True:
+                    data[~inside] = nodata(band)
+            target_band.data(data=data, offset=offset, size=size)
+
+    target._flush()
+    return target
+
+
+def create_like(gdal_raster, window, name=None, driver=None):
+    """Creates a raster like the given one covering the window, as a
+    tiled GeoTIFF at name if given, else in memory"""
+    col, row, width, height = window
+    x, y = block_size(gdal_raster.bands[0])
+
+    options = {
+        'srid': gdal_raster.srid,
+        'width': width,
+        'height': height,
+        'origin': geographic_coords_from_px_coords(
+            gdal_raster,
+            ((row, col),),
+        )[0],
+        'scale': gdal_raster.scale,
+        'skew': gdal_raster.skew,
+        'nr_of_bands': len(gdal_raster.bands),
+        'datatype': gdal_raster.bands[0].datatype(),
+    }
+    if name:
+        options['name'] = name
+        options['driver'] = driver or 'GTiff'
+        # GeoTIFF tiles must be multiples of 16, so strips
+        # and odd-sized blocks get the default tile size;
+        # creation options need Django 1.11 (see setup.py)
+        if driver in (None, 'GTiff') and not (x % 16 or y % 16):
+            options['papsz_options'] = {
+                'tiled': 'yes',
+                'blockxsize': x,
+                'blockysize': y,
+            }
+
+    raster = GDALRaster(options)
+    for band, new_band in zip(gdal_raster.bands, raster.bands):
+        new_band.nodata_value = nodata(band)
+    return extend_raster(raster)
+
+
+def clip(self, ogr_geom, mask=False, all_touched=False,
+         name=None, driver=None):
+    """
+    Clips an instance of django.contrib.gis.gdal.GDALRaster to the extent
+    of a django.contrib.gis.gdal.OGRGeometry instance, and to its shape
+    if mask is True. The clipped raster is written to a file at name if
+    given (default a tiled GeoTIFF), otherwise it is kept in memory.
+    """
+    check_geom_is_polygon(ogr_geom)
+
+    # reproject geom to match raster
+    transformed_geom = ogr_geom.transform(self.srs, clone=True) \
+        if ogr_geom.srs != self.srs else ogr_geom
+
+    window = pixel_window(self, transformed_geom.extent)
+    if not window[2] or not window[3]:
+        raise ValueError('Geometry does not overlap the raster')
+
+    return copy_blocks(
+        self,
+        window,
+        create_like(self, window, name=name, driver=driver),
+        ogr_geom=transformed_geom if mask else None,
+        all_touched=all_touched,
+    )
+
+
+def mask(
+    self,
+    ogr_geom,
+    all_touched=False,
+    clone=False,
+    name=None,
+    driver=None,
+):
+    """
+    Masks an instance of django.contrib.gis.gdal.GDALRaster to the shape
+    of a django.contrib.gis.gdal.OGRGeometry instance, setting the cells
+    outside it to nodata. The raster is changed in place unless clone
+    is True, in which case the masked copy is written to name as for
+    clip (or kept in memory).
+    """
+    check_geom_is_polygon(ogr_geom)
 
-    # make a copy of the raster if we need to clone
-    raster = self.warp({}) if clone else self
+    # reproject geom to match raster
+    transformed_geom = ogr_geom.transform(self.srs, clone=True) \
+        if ogr_geom.srs != self.srs else ogr_geom
 
-    # mask each band in the output raster
-    mask = masked.bands[0].data()
-    mask = mask == 0
-    print(mask)
-    for band in raster.bands:
-        d = band.data()
-        d[mask] = band.nodata_value
-        print(d)
-        band.data(data=d)
+    window = (0, 0, self.width, self.height)
+    if clone:
+        return copy_blocks(
+            self,
+            window,
+            create_like(self, window, name=name, driver=driver),
+            ogr_geom=transformed_geom,
+            all_touched=all_touched,
+        )
 
-    return raster
+    for band in self.bands:
+        band.nodata_value = nodata(band)
+    return copy_blocks(
+        self,
+        window,
+        self,
+        ogr_geom=transformed_geom,
+        all_touched=all_touched,
+        in_place=True,
+    )
@@ -0,0 +1,100 @@
+"""Conversions between geographic and pixel coordinates of a raster.
+
+The functions take arrays (or sequences) of coordinates and apply the
+raster's affine geotransform to all of them at once with numpy,
+including any rotation/skew terms. Pixel coordinates are (row, col)
+floats, with cell (0, 0) covering [0, 1) in both; to_cells rounds them
+to cell indices, snapping values within EPSILON of a whole number to it
+first so cell edges land in the same cell however they are computed."""
+from __future__ import absolute_import
+
+import numpy
+
+
+# pixel coordinates this close to a whole number are taken to be one
+EPSILON = 1e-9
+
+
+def forward(geotransform, rows, cols):
+    """Returns the geographic (xs, ys) of the pixel coordinates,
+    per GDAL's x = gt[0] + col * gt[1] + row * gt[2] and
+    y = gt[3] + col * gt[4] + row * gt[5]"""
+    rows = numpy.asarray(rows, dtype=numpy.float64)
+    cols = numpy.asarray(cols, dtype=numpy.float64)
+    gt = geotransform
+    return (
+        gt[0] + cols * gt[1] + rows * gt[2],
+        gt[3] + cols * gt[4] + rows * gt[5],
+    )
+
+
+def inverse(geotransform, xs, ys):
+    """Returns the pixel (rows, cols) of the geographic coordinates,
+    as floats, by inverting the geotransform"""
+    xs = numpy.asarray(xs, dtype=numpy.float64)
+    ys = numpy.asarray(ys, dtype=numpy.float64)
+    gt = geotransform
+
+    det = gt[1] * gt[5] - gt[2] * gt[4]
+    if det == 0:
+        raise ValueError(
+            "Geotransform is not invertible: {}".format(tuple(gt))
+        )
+
+    dx, dy = xs - gt[0], ys - gt[3]
+    return (
+        (gt[1] * dy - gt[4] * dx) / det,
+        (gt[5] * dx - gt[2] * dy) / det,
+    )
+
+
+def snap(values):
+    """Returns the values, with those within EPSILON of a whole number
+    replaced by it, so rounding them is not thrown by float error"""
+    values = numpy.asarray(values, dtype=numpy.float64)
+    nearest = numpy.round(values)
+    return numpy.where(numpy.abs(values - nearest) < EPSILON,
+                       nearest, values)
+
+
+def to_cells(values, roundfn=numpy.floor):
+    """Returns the pixel coordinates rounded with the roundfn (default
+    floor, the cell containing the coordinate) as integers"""
+    return roundfn(snap(values)).astype(numpy.int64)
+
+
+def to_pixel(geotransform, xs, ys, roundfn=numpy.floor):
+    """Returns the integer (rows, cols) of the cells
+    containing the geographic coordinates"""
+    rows, cols = inverse(geotransform, xs, ys)
+    return to_cells(rows, roundfn), to_cells(cols, roundfn)
+
+
+def corners(geotransform, window):
+    """Returns the geographic (xs, ys) of the corners of the
+    (col, row, width, height) window, clockwise from the origin"""
+    col, row, width, height = window
+    return forward(
+        geotransform,
+        [row, row, row + height, row + height],
+        [col, col + width, col + width, col],
+    )
+
+
+def window_for_extent(geotransform, extent, width, height):
+    """Returns the (col, row, width, height) of the cells covering the
+    (xmin, ymin, xmax, ymax) extent, limited to a raster of the given
+    size. With rotation the window covers the extent's whole
+    footprint in pixel space."""
+    xmin, ymin, xmax, ymax = extent
+    rows, cols = inverse(
+        geotransform,
+        [xmin, xmax, xmax, xmin],
+        [ymin, ymin, ymax, ymax],
+    )
+
+    col = max(int(to_cells(cols.min())), 0)
+    row = max(int(to_cells(rows.min())), 0)
+    end_col = min(int(to_cells(cols.max(), numpy.ceil)), width)
+    end_row = min(int(to_cells(rows.max(), numpy.ceil)), height)
+    return col, row, max(end_col - col, 0), max(end_row - row, 0)
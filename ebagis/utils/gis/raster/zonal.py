@@ -0,0 +1,175 @@
+"""Zonal statistics of a raster for many polygons in one pass.
+
+All the zone polygons (e.g. the HRU zones, or the boundaries of the
+child AOIs) are burned into a label raster with GDALRasterizeGeometries
+in a single call, zone n (in the order given) burned with n and 0 left
+for cells in no zone. Statistics for every zone are then reduced from
+the label array at once with numpy.bincount and ufunc.at, instead of
+masking the raster once per zone.
+
+As with clip, the raster is read a block at a time, and only the
+blocks touching a zone are read and labeled. The statistics of the
+blocks are accumulated in a ZoneStatistics."""
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+import numpy
+
+from .clip import (
+    block_size, burn_geometries, create_band_like,
+    footprint, iter_blocks, pixel_window,
+)
+
+
+STATISTICS = ('count', 'sum', 'mean', 'min', 'max')
+
+
+class ZoneStatistics(object):
+    """Running count, sum, min, and max of the values of each of a
+    number of zones, from which the mean follows. Index 0 of each
+    array is for cells in no zone, and is never added to."""
+
+    def __init__(self, zones):
+        self.zones = zones
+        self.count = numpy.zeros(zones + 1, dtype=numpy.int64)
+        self.sum = numpy.zeros(zones + 1, dtype=numpy.float64)
+        self.min = numpy.full(zones + 1, numpy.inf)
+        self.max = numpy.full(zones + 1, -numpy.inf)
+
+    def add(self, labels, values, valid=None):
+        """Adds the values to the zones given by the labels,
+        skipping cells that are not valid (e.g. nodata)"""
+        labels = numpy.asarray(labels).ravel()
+        values = numpy.asarray(values, dtype=numpy.float64).ravel()
+
+        keep = labels > 0
+        if valid is not None:
+            keep &= numpy.asarray(valid).ravel()
+        labels, values = labels[keep], values[keep]
+        if not labels.size:
+            return
+
+        self.count += numpy.bincount(labels, minlength=self.zones + 1)
+        self.sum += numpy.bincount(labels, weights=values,
+                                   minlength=self.zones + 1)
+        numpy.minimum.at(self.min, labels, values)
+        numpy.maximum.at(self.max, labels, values)
+
+    @property
+    def mean(self):
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(self.count > 0,
+                               self.sum / self.count,
+                               numpy.nan)
+
+    def results(self, ids=None):
+        """Returns an OrderedDict of the statistics of each zone
+        keyed by the ids (default the zone numbers). Zones without
+        any valid cells have a count of 0 and None for the rest."""
+        ids = ids if ids is not None else range(1, self.zones + 1)
+        mean = self.mean
+        results = OrderedDict()
+        for zone, id in enumerate(ids, 1):
+            if not self.count[zone]:
+                results[id] = dict.fromkeys(STATISTICS)
+                results[id]['count'] = 0
+                continue
+            results[id] = {
+                'count': int(self.count[zone]),
+                'sum': float(self.sum[zone]),
+                'mean': float(mean[zone]),
+                'min': float(self.min[zone]),
+                'max': float(self.max[zone]),
+            }
+        return results
+
+
+def _prepare(gdal_raster, ogr_geoms):
+    # reproject geoms to match raster
+    return [
+        geom.transform(gdal_raster.srs, clone=True)
+        if geom.srs != gdal_raster.srs else geom
+        for geom in ogr_geoms
+    ]
+
+
+def _overlaps(a, b):
+    """whether the (xmin, ymin, xmax, ymax) extents overlap"""
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def label_raster(gdal_raster, ogr_geoms, window=None, all_touched=False,
+                 zones=None):
+    """Returns an in-memory Int32 raster aligned with the raster and
+    covering the window (default all of it), with each cell labeled
+    with the number of the geometry covering it (1 for the first),
+    or 0. Use zones to give the numbers of the geometries instead."""
+    if window is None:
+        window = (0, 0, gdal_raster.width, gdal_raster.height)
+    if zones is None:
+        zones = range(1, len(ogr_geoms) + 1)
+
+    labels = create_band_like(gdal_raster, window, datatype=5)
+    labels.bands[0].nodata_value = 0
+    if ogr_geoms:
+        burn_geometries(labels, _prepare(gdal_raster, ogr_geoms), zones,
+                        all_touched=all_touched)
+    return labels
+
+
+def zonal_statistics(gdal_raster, ogr_geoms, band=0, all_touched=False,
+                     max_cells=None):
+    """Returns the ZoneStatistics of the band of the raster for each of
+    the geometries, in order. Cells with the nodata value are skipped.
+    Where geometries overlap, cells count for the later geometry.
+    Raises ValueError if the window covering all the geometries has
+    more than max_cells cells (if given), before reading any."""
+    geoms = _prepare(gdal_raster, ogr_geoms)
+    stats = ZoneStatistics(len(geoms))
+    if not geoms:
+        return stats
+
+    # the window covering all the zones
+    extents = [geom.extent for geom in geoms]
+    window = pixel_window(gdal_raster, (
+        min(extent[0] for extent in extents),
+        min(extent[1] for extent in extents),
+        max(extent[2] for extent in extents),
+        max(extent[3] for extent in extents),
+    ))
+    if not window[2] or not window[3]:
+        return stats
+    if max_cells is not None and window[2] * window[3] > max_cells:
+        raise ValueError(
+            "The zones cover {} cells; the limit is {}.".format(
+                window[2] * window[3], max_cells,
+            )
+        )
+
+    source = gdal_raster.bands[band]
+    nodata = source.nodata_value
+    for block in iter_blocks(window, block_size(source)):
+        box = footprint(gdal_raster, block)
+        box_extent = box.extent
+
+        # only the zones in this block need to be burned
+        zones = [
+            zone for zone, (geom, extent) in enumerate(zip(geoms, extents), 1)
+            if _overlaps(extent, box_extent) and geom.intersects(box)
+        ]
+        if not zones:
+            continue
+
+        labels = create_band_like(gdal_raster, block, datatype=5)
+        burn_geometries(labels, [geoms[zone - 1] for zone in zones], zones,
+                        all_touched=all_touched)
+
+        values = source.data(offset=block[:2], size=block[2:])
+        valid = None
+        if nodata is not None:
+            valid = ~numpy.isnan(values) if numpy.isnan(nodata) \
+                else values != nodata
+        stats.add(labels.bands[0].data(), values, valid)
+
+    return stats
@@ -2,12 +2,14 @@ from __future__ import absolute_import
 import logging
 import os
 import re
+import uuid
 import mimetypes
 
-from django.http import StreamingHttpResponse
-
-from rest_framework import status
-from rest_framework.response import Response
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
+from django.utils.http import (
+    http_date, parse_http_date_safe, parse_etags, quote_etag
+)
 
 from ..constants import CHUNK_SIZE
 
@@ -17,49 +19,263 @@ from .filesystem import FileWrapper
 logger = logging.getLogger(__name__)
 
 
-def stream_file(file_path, request):
-    #import pdb; pdb.set_trace()
+RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
 
-    file_size = os.path.getsize(file_path)
-    start, end = 0, None
 
-    if "HTTP_RANGE" in request.META:
-        try:
-            start, end = re.findall(r"/d+", request.META["HTTP_RANGE"])
-        except TypeError:
-            logger.exception(
-                "Malformed HTTP_RANGE in download request: {}"
-                .format(request.META["HTTP_RANGE"])
-            )
-            return Response(
-                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+def parse_range_header(header, file_size):
+    """Parses the value of a Range header into a list of (first, last)
+    byte positions (inclusive, as in HTTP) within a file of file_size.
+
+    Returns None if the header is malformed or not a byte range, in
+    which case the header must be ignored and the whole file served.
+    Returns an empty list if the header is valid but none of its ranges
+    are satisfiable. Overlapping and adjacent ranges are merged."""
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        match = RANGE_RE.match(part)
+        if not match:
+            return None
+        first, last = match.groups()
+
+        if not first:
+            # suffix range: the last N bytes of the file
+            if not last:
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            first, last = max(file_size - length, 0), file_size - 1
+        else:
+            first = int(first)
+            if last and int(last) < first:
+                return None
+            if first >= file_size:
+                continue
+            last = min(int(last), file_size - 1) if last else file_size - 1
+
+        ranges.append((first, last))
+
+    if not ranges:
+        return []
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for first, last in ranges[1:]:
+        prev_first, prev_last = merged[-1]
+        if first <= prev_last + 1:
+            merged[-1] = (prev_first, max(prev_last, last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def file_etag(file_path, stat=None):
+    """An ETag for a file without a known hash,
+    from its size and modification time"""
+    stat = stat or os.stat(file_path)
+    return "{:x}-{:x}".format(stat.st_size, int(stat.st_mtime))
+
+
+def _etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    # parse_etags returns the tags unquoted before django 1.11,
+    # and If-None-Match uses the weak comparison, so W/ is ignored
+    etags = [tag[2:] if tag.startswith("W/") else tag
+             for tag in parse_etags(header)]
+    return etag in etags or quote_etag(etag) in etags
+
+
+def _range_applies(request, etag, last_modified):
+    """Checks the If-Range header, if any: the range
+    only applies if the file has not changed"""
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    # a weak ETag never matches for If-Range
+    if if_range.startswith('"'):
+        return if_range == quote_etag(etag)
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _offload_location(file_path):
+    """Returns the internal URL through which the front-end server
+    can serve the file for an X-Accel-Redirect, or None if the
+    file is not in any of the configured locations"""
+    file_path = os.path.abspath(file_path)
+    for root, location in \
+            settings.EBAGIS_DOWNLOAD_OFFLOAD_LOCATIONS.iteritems():
+        root = os.path.join(os.path.abspath(root), "")
+        if file_path.startswith(root):
+            relpath = file_path[len(root):].replace(os.sep, "/")
+            return location.rstrip("/") + "/" + relpath
+    return None
+
+
+def _offload(file_path):
+    """Returns a response handing the file off to the front-end server
+    to send, if offloading is configured, otherwise None. The server
+    handles any Range request itself."""
+    method = settings.EBAGIS_DOWNLOAD_OFFLOAD
+    if not method:
+        return None
+
+    method = method.lower()
+    if method == "x-sendfile":
+        response = HttpResponse()
+        response["X-Sendfile"] = os.path.abspath(file_path).encode("utf-8")
+    elif method == "x-accel-redirect":
+        location = _offload_location(file_path)
+        if location is None:
+            logger.warning(
+                "Cannot offload {}: not in an offload location"
+                .format(file_path)
             )
+            return None
+        response = HttpResponse()
+        response["X-Accel-Redirect"] = location.encode("utf-8")
+    else:
+        raise ValueError(
+            "Unknown EBAGIS_DOWNLOAD_OFFLOAD method: {}".format(method)
+        )
+
+    # let the server set the type from the file
+    del response["Content-Type"]
+    return response
+
+
+def _multipart_ranges(file_path, ranges, file_size, content_type, boundary):
+    """Yields the parts of a multipart/byteranges body"""
+    with open(file_path, 'rb') as f:
+        for first, last in ranges:
+            yield _part_header(boundary, content_type,
+                               first, last, file_size)
+            for chunk in FileWrapper(f, blksize=CHUNK_SIZE,
+                                     start=first, end=last + 1):
+                yield chunk
+            yield "\r\n"
+        yield "--{}--\r\n".format(boundary)
+
+
+def _part_header(boundary, content_type, first, last, file_size):
+    return (
+        "--{}\r\n"
+        "Content-Type: {}\r\n"
+        "Content-Range: bytes {}-{}/{}\r\n"
+        "\r\n"
+    ).format(boundary, content_type, first, last, file_size)
+
+
+def _multipart_length(ranges, file_size, content_type, boundary):
+    length = len("--{}--\r\n".format(boundary))
+    for first, last in ranges:
+        length += len(_part_header(boundary, content_type,
+                                   first, last, file_size))
+        length += last - first + 1 + len("\r\n")
+    return length
+
+
+def stream_file(file_path, request, etag=None, filename=None,
+                content_type=None):
+    """Returns a response sending the file at file_path, supporting
+    conditional requests and single or multiple byte ranges so
+    clients can resume large downloads.
+
+    etag should be the hash of the file when it is known; otherwise
+    one is made from the file size and modification time. If download
+    offloading is configured, the front-end server is told to send the
+    file (X-Sendfile or X-Accel-Redirect) so no bytes pass through
+    python. Otherwise whole files, and ranges running to the end of the
+    file, are sent with FileResponse, so the WSGI server can use its
+    wsgi.file_wrapper (i.e., sendfile) to send them."""
+    stat = os.stat(file_path)
+    file_size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = etag or file_etag(file_path, stat)
+    filename = filename or os.path.basename(file_path)
+    content_type = content_type or \
+        mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+
+    def set_headers(response):
+        response["ETag"] = quote_etag(etag)
+        response["Last-Modified"] = http_date(last_modified)
+        response["Accept-Ranges"] = "bytes"
+        return response
 
-        if start > end or end > file_size:
-            return Response(
-                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return set_headers(HttpResponse(status=304))
+
+    response = _offload(file_path)
+    if response is not None:
+        response["Content-Disposition"] = \
+            'attachment; filename="' + filename + '"'
+        return set_headers(response)
+
+    ranges = None
+    if "HTTP_RANGE" in request.META and \
+            _range_applies(request, etag, last_modified):
+        ranges = parse_range_header(request.META["HTTP_RANGE"], file_size)
+        if ranges is None:
+            logger.info(
+                "Ignoring malformed HTTP_RANGE in download request: {}"
+                .format(request.META["HTTP_RANGE"])
             )
+        elif len(ranges) > settings.EBAGIS_DOWNLOAD_MAX_RANGES:
+            # too many ranges is more likely abuse than a real client
+            ranges = None
 
-    fwrapper = FileWrapper(
-        open(file_path, 'rb'),
-        blksize=CHUNK_SIZE,
-        start=start,
-        end=end
-    )
-    response = StreamingHttpResponse(
-        fwrapper,
-        content_type=mimetypes.guess_type(file_path)[0]
-    )
-    name = os.path.basename(file_path)
-    response["Content-Disposition"] = \
-        'attachment; filename="' + name + '"'
-    response["Content-Length"] = file_size
-    response["Accept-Ranges"] = 'bytes'
-
-    if "HTTP_RANGE" in request.META:
-        response["status"] = 206
-        response["Content-Range"] = "bytes {}-{}/{}".format(start,
-                                                            end,
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = "bytes */{}".format(file_size)
+        return set_headers(response)
+
+    if ranges is None or ranges == [(0, file_size - 1)]:
+        response = FileResponse(open(file_path, 'rb'),
+                                content_type=content_type)
+        response["Content-Length"] = file_size
+
+    elif len(ranges) == 1:
+        first, last = ranges[0]
+        f = open(file_path, 'rb')
+        if last == file_size - 1:
+            # the file wrapper sends from the current offset to the
+            # end of the file, so we can still use sendfile when
+            # resuming, which is by far the most common range request
+            f.seek(first)
+            response = FileResponse(f, status=206,
+                                    content_type=content_type)
+        else:
+            response = StreamingHttpResponse(
+                FileWrapper(f, blksize=CHUNK_SIZE,
+                            start=first, end=last + 1),
+                status=206,
+                content_type=content_type,
+            )
+        response["Content-Length"] = last - first + 1
+        response["Content-Range"] = "bytes {}-{}/{}".format(first,
+                                                            last,
                                                             file_size)
 
-    return response
+    else:
+        boundary = uuid.uuid4().hex
+        response = StreamingHttpResponse(
+            _multipart_ranges(file_path, ranges, file_size,
+                              content_type, boundary),
+            status=206,
+            content_type="multipart/byteranges; boundary=" + boundary,
+        )
+        response["Content-Length"] = _multipart_length(
+            ranges, file_size, content_type, boundary,
+        )
+
+    response["Content-Disposition"] = \
+        'attachment; filename="' + filename + '"'
+    return set_headers(response)
@@ -1,34 +1,79 @@
 from __future__ import absolute_import
 
 
-def hash_file(filepath):
+def _io_buffer(buffer_size=None):
+    """Returns a reusable read buffer and a view on it. Large
+    buffers keep the number of read/write calls down on the
+    multi-GB rasters, and reading into a preallocated buffer
+    avoids allocating a new string per block."""
+    if buffer_size is None:
+        from django.conf import settings
+        buffer_size = settings.EBAGIS_IO_BUFFER_SIZE
+    buf = bytearray(buffer_size)
+    return buf, memoryview(buf)
+
+
+def hash_file(filepath, buffer_size=None):
+    import io
     import hashlib
     sha = hashlib.sha256()
-    with open(filepath, 'rb') as f:
+    buf, view = _io_buffer(buffer_size)
+    with io.open(filepath, 'rb', buffering=0) as f:
         while True:
-            block = f.read(2**10)
-            if not block:
+            read = f.readinto(buf)
+            if not read:
                 break
+            sha.update(view[:read])
+    return sha.hexdigest()
+
+
+def copy_and_hash(src, dst, buffer_size=None):
+    """Copy the file at src to dst, returning the sha256 hash of
+    the content. The source is only read once: each block is written
+    to the destination and fed to the hash in the same pass, rather
+    than copying the file and then reading the copy back to hash it.
+
+    Python 2 has no sendfile or copy_file_range, and we would need
+    to read the data back anyway for the hash, so this is a plain
+    buffered tee."""
+    import io
+    import hashlib
+    sha = hashlib.sha256()
+    buf, view = _io_buffer(buffer_size)
+    with io.open(src, 'rb', buffering=0) as fsrc, \
+            io.open(dst, 'wb', buffering=0) as fdst:
+        while True:
+            read = fsrc.readinto(buf)
+            if not read:
+                break
+            block = view[:read]
             sha.update(block)
+            # raw writes may be partial
+            written = 0
+            while written < read:
+                written += fdst.write(block[written:])
     return sha.hexdigest()
 
 
-def generate_uuid(model_class):
+def generate_uuid(model_class, check=True):
+    """Returns a random UUID not yet used as a primary key in the
+    table of model_class. The check is a single lookup on the primary
+    key index, so the cost does not grow with the size of the table.
+
+    A collision of two UUID4s is practically impossible, and the primary
+    key constraint will reject one regardless, so callers allocating
+    many IDs at once (e.g., bulk imports) can skip the check."""
     import uuid
-    # get a list of all of this model's object IDs in the table
-    # this does create a race condition, but the performance gain of
-    # only hitting the DB offsets the incredibly small chance that
-    # an equal UUID will be created in the time this method will run
-    existing_ids = model_class.objects.values_list('id', flat=True)
-
-    # generate UUIDs until one is created
-    # that is not in the existing list
+    # use the base manager so we check the whole table, and not just
+    # the rows of the model's class (proxy models share a table)
+    manager = model_class._base_manager
+
+    # there is a race between the check and the insert,
+    # but again, the primary key constraint covers that
     while True:
         id = uuid.uuid4()
-        if id not in existing_ids:
-            break
-
-    return id
+        if not check or not manager.filter(pk=id).exists():
+            return id
 
 
 def sanitize_uuid(uuid):
@@ -1,10 +1,17 @@
 import requests
 import json
 
-from arcpy import Buffer_analysis, Geometry, FromWKT, SpatialReference
+from django.conf import settings
+
+from ..exceptions import AWDBError
+
+
+# the queries share a session so connections to the service are reused
+session = requests.Session()
 
 
 def gen_query_params_from_point(pointWKT, sr, dist='100 Meters'):
+    from arcpy import Buffer_analysis, Geometry, FromWKT, SpatialReference
     point = FromWKT(pointWKT, SpatialReference(sr))
     buff = json.loads(Buffer_analysis(point, Geometry(), dist)[0].extent.JSON)
     return {
@@ -29,8 +36,38 @@ def gen_query_params_from_point(pointWKT, sr, dist='100 Meters'):
 
 
 def query_AWDB(layer_url, query_params):
-    # need to get the query url + params
-    # then parse the output to build features and return
-    print query_params
-    resp = requests.get(layer_url, params=query_params)
-    return resp.json()
+    resp = session.get(layer_url,
+                       params=query_params,
+                       timeout=settings.AWDB_QUERY_TIMEOUT)
+    resp.raise_for_status()
+    result = resp.json()
+    # the service reports errors in the response, not the status
+    if 'error' in result:
+        raise AWDBError(
+            "AWDB query failed: {}".format(result['error'].get('message'))
+        )
+    return result
+
+
+def iter_AWDB_features(layer_url, out_sr, page_size=1000):
+    """Yields all the features of the AWDB layer with their geometries
+    in the out_sr, querying the service a page of features at a time"""
+    offset = 0
+    while True:
+        result = query_AWDB(layer_url, {
+            'where': '1=1',
+            'outFields': 'name,stationtriplet',
+            'returnGeometry': True,
+            'outSR': out_sr,
+            'orderByFields': 'stationtriplet',
+            'resultOffset': offset,
+            'resultRecordCount': page_size,
+            'f': 'json',
+        })
+        features = result.get('features', [])
+        for feature in features:
+            yield feature
+
+        if not features or not result.get('exceededTransferLimit', False):
+            break
+        offset += len(features)
@@ -1,27 +1,37 @@
 from __future__ import absolute_import
 
 
-def zip_directory(directory_path, zip_path):
+def zip_entries(entries, zip_path, policy=None, workers=1):
+    """Takes an iterable of (archive name, file path) tuples and
+    an output zip path and writes each file into a zipfile at the
+    output path location under its archive name. Files are read
+    straight from their paths as the entries are consumed, so the
+    content never has to be gathered in one directory first.
+
+    Each file is compressed as decided by the CompressionPolicy; if
+    none is given the policy is built from the export settings. Files
+    are compressed using the given number of worker threads."""
+    from .compression import PolicyZipFile, CompressionPolicy
+    if policy is None:
+        policy = CompressionPolicy.from_settings()
+    # large AOIs can easily exceed the 2 GB limit without zip64
+    with PolicyZipFile(zip_path, 'w', policy=policy,
+                       allowZip64=True, workers=workers) as zipf:
+        zipf.write_entries(entries)
+    return zip_path
+
+
+def zip_directory(directory_path, zip_path, policy=None, workers=1):
     """Takes an input directory path and an output zip path
     and zips the contents of the directory into a zipfile at
     output path location. The name of the output zipfile
     should be included in the zip_path argument."""
-    import os
-    import zipfile
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(directory_path):
-            for f in files:
-                rel_dir = os.path.relpath(root, directory_path)
-                # first arg is file to zip (root/f), and the
-                # second arg is the archive name (rel_dir/f)
-                # (second arg is path realtive to the root of the AOI
-                # to keep whole higher level directory structure from
-                # getting zipped)
-                zipf.write(os.path.join(root, f), os.path.join(rel_dir, f))
-            # NEED TO USE THIS FOR EMPTY DIRS
-            #for d in dirs:
-              #  zips.writestr(zipfile.ZipInfo('empty/'), '')
-    return zip_path
+    from .filesystem import walk_files
+    # archive names are realtive to the directory to keep the
+    # whole higher level directory structure from getting zipped
+    # NOTE: empty directories are not included
+    return zip_entries(walk_files(directory_path), zip_path,
+                       policy, workers)
 
 
 def unzipfile(zipf, unzipdir):
@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+import logging
 
 from django.contrib.contenttypes.models import ContentType
 
@@ -7,10 +8,12 @@ from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
+from django.utils import timezone
+
 from djcelery.models import TaskMeta
 
 # model objects
-from ..models.download import Download
+from ..models.download import Download, make_cache_key
 
 # serializers
 from ..serializers.download import DownloadSerializer
@@ -25,6 +28,9 @@ from ..utils.queries import owner_or_admin, get_object_owner_or_admin
 from .filters import make_model_filter
 
 
+logger = logging.getLogger(__name__)
+
+
 class DownloadViewSet(viewsets.ModelViewSet):
     model = Download
     serializer_class = DownloadSerializer
@@ -43,16 +49,30 @@ class DownloadViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
 
         if instance.file:
-            return stream_file(instance.file.file.name, request)
+            return stream_file(instance.file.path, request,
+                               etag=instance.sha256)
 
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
-    def download(self, request, content_type, object_id, name=""):
+    def download(self, request, content_type, object_id, name="",
+                 querydate=None, cache_key=None):
         download = self.model(user=request.user,
                               content_type=content_type,
                               object_id=object_id,
-                              name=name)
+                              name=name,
+                              querydate=querydate or timezone.now(),
+                              cache_key=cache_key)
+
+        # if an unexpired download of the same content exists
+        # we can just give this download that download's archive
+        cached = self.model.get_cached(cache_key)
+        if cached and download.use_cached(cached):
+            download.save()
+            serializer = self.serializer_class(download,
+                                               context={'request': request})
+            return Response(serializer.data)
+
         download.save()
         result = export_data.delay(str(download.pk))
         download.task, created = \
@@ -66,11 +86,28 @@ class DownloadViewSet(viewsets.ModelViewSet):
     def new_download(cls, object, request):
         download_view = cls()
         if request.method == 'GET':
+            querydate = timezone.now()
             return download_view.download(
                 request,
                 ContentType.objects.get_for_model(object),
                 object.pk,
                 name=object.name,
+                querydate=querydate,
+                cache_key=cls.get_cache_key(object, querydate),
             )
         else:
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    def get_cache_key(object, querydate):
+        # the export task reports any problems with the object
+        # to the user, so we just skip the cache if we can't
+        # resolve what the object would export
+        try:
+            return make_cache_key(object, querydate)
+        except Exception:
+            logger.exception(
+                "Could not make download cache key for {} {}"
+                .format(object.__class__.__name__, object.pk)
+            )
+            return None
@@ -1,7 +1,17 @@
 from __future__ import absolute_import
 
+from django.conf import settings
+from django.contrib.gis.db.models.functions import Distance as DistanceTo
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.contrib.gis.gdal.error import GDALException
+from django.contrib.gis.geos.error import GEOSException
+
 from django_filters import rest_framework as filters
 from rest_framework import ISO_8601
+from rest_framework.exceptions import ParseError
+from rest_framework.filters import BaseFilterBackend
+
+from ..utils.gis import Distance
 
 
 FilterSet = filters.FilterSet
@@ -85,3 +95,125 @@ def make_model_filter(model, base=BaseFilterSet,
             meta
         )},
     )
+
+
+class SpatialFilter(BaseFilterBackend):
+    """Filters list views by the geography fields in the view's
+    spatial_fields, which use the first one unless the spatial_field
+    param names another:
+
+     - in_bbox=xmin,ymin,xmax,ymax: intersecting the lon/lat box
+     - intersects=<GeoJSON or WKT>: intersecting the geometry
+     - point=lon,lat: ordered by distance to the point, nearest first
+     - dwithin=<distance>: within the distance of the point, in meters
+       or with a unit, like 10km or 5 miles
+     - nearest=<n>: only the n nearest to the point
+
+    The box and geometry are compared with the geometry of the field,
+    so their edges are straight lines in lon/lat like on a map; the
+    distances are measured on the sphere. All use spatial indexes."""
+
+    def _field(self, request, view):
+        fields = getattr(view, 'spatial_fields', ())
+        name = request.query_params.get('spatial_field', None)
+        if name is None:
+            return fields[0]
+        if name not in fields:
+            raise ParseError(
+                "spatial_field must be one of: {}".format(", ".join(fields))
+            )
+        return name
+
+    def _numbers(self, param, value, count):
+        try:
+            numbers = [float(number) for number in value.split(",")]
+        except ValueError:
+            numbers = []
+        if len(numbers) != count:
+            raise ParseError(
+                "{} must be {} comma-separated numbers.".format(param, count)
+            )
+        return numbers
+
+    def filter_queryset(self, request, queryset, view):
+        if not getattr(view, 'spatial_fields', None) or \
+                getattr(view, 'action', None) != 'list':
+            return queryset
+
+        params = request.query_params
+        name = self._field(request, view)
+        # the filters on the geometry of the column match the
+        # expressions of its index; see the geometry_indexes migration
+        column = '"{}"."{}"'.format(
+            queryset.model._meta.db_table,
+            queryset.model._meta.get_field(name).column,
+        )
+        where, where_params = [], []
+
+        if 'in_bbox' in params:
+            xmin, ymin, xmax, ymax = self._numbers(
+                'in_bbox', params['in_bbox'], 4,
+            )
+            where.append(
+                "ST_Intersects({}::geometry, "
+                "ST_MakeEnvelope(%s, %s, %s, %s, {}))".format(
+                    column, settings.GEO_WKID,
+                )
+            )
+            where_params.extend([xmin, ymin, xmax, ymax])
+
+        if 'intersects' in params:
+            try:
+                geometry = GEOSGeometry(params['intersects'])
+                # an unknown srid only fails here
+                if geometry.srid and geometry.srid != settings.GEO_WKID:
+                    geometry.transform(settings.GEO_WKID)
+            except (ValueError, GEOSException, GDALException):
+                raise ParseError("intersects must be GeoJSON or WKT.")
+            # like the box, this matches the geometry index
+            where.append(
+                "ST_Intersects({}::geometry, ST_GeomFromText(%s, {}))"
+                .format(column, settings.GEO_WKID)
+            )
+            where_params.append(geometry.wkt)
+
+        if where:
+            queryset = queryset.extra(where=where, params=where_params)
+
+        if 'point' not in params:
+            if 'dwithin' in params or 'nearest' in params:
+                raise ParseError("dwithin and nearest require a point.")
+            return queryset
+
+        lon, lat = self._numbers('point', params['point'], 2)
+        point = Point(lon, lat, srid=settings.GEO_WKID)
+
+        if 'dwithin' in params:
+            try:
+                distance = Distance(params['dwithin'])
+            except (AttributeError, ValueError):
+                raise ParseError("dwithin must be a distance.")
+            queryset = queryset.filter(**{
+                name + '__dwithin': (point, distance),
+            })
+
+        queryset = queryset.annotate(distance=DistanceTo(name, point))
+
+        if 'nearest' not in params:
+            return queryset.order_by('distance')
+
+        try:
+            nearest = int(params['nearest'])
+        except ValueError:
+            nearest = 0
+        if nearest < 1:
+            raise ParseError("nearest must be a positive integer.")
+        # ordering with the distance operator can use the index
+        knn = "{} <-> ST_SetSRID(ST_MakePoint(%s, %s), {})::geography".format(
+            column, settings.GEO_WKID,
+        )
+        return queryset.extra(
+            select={'_nearest': knn},
+            select_params=[lon, lat],
+            order_by=['_nearest'],
+        )[:nearest]
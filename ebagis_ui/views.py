@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.views import generic
 from django.views.generic.base import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -17,6 +18,7 @@ from allauth.account.views import EmailView
 from djcelery.models import TaskMeta
 
 from ebagis.data.models.aoi import AOI
+from ebagis.data.snapshot import generation
 from ebagis.models.upload import Upload
 from ebagis.models.download import Download
 from ebagis.tasks import export_data
@@ -26,6 +28,13 @@ class AOIDetailsView(LoginRequiredMixin, generic.DetailView):
     template_name = 'aois/details.html'
     queryset = AOI.objects.current()
 
+    def get_context_data(self, **kwargs):
+        context = super(AOIDetailsView, self).get_context_data(**kwargs)
+        # the content tree fragment is cached for each generation
+        context['snapshot_generation'] = generation(self.object.pk)
+        context['snapshot_timeout'] = settings.EBAGIS_AOI_SNAPSHOT_TIMEOUT
+        return context
+
     def post(self, request, *args, **kwargs):
         if 'action_download' in request.POST:
             return self._action_download(request)
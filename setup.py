@@ -46,7 +46,7 @@ def main():
             'psycopg2>=2.7.1',
             'celery==3.1.25',
             'django-celery>=3.2.1',
-            'Django>=1.10.6',
+            'Django>=1.11',
             'djangorestframework>=3.6.2',
             'GDAL>=2.1.0',
             'drf-chunked-upload>=0.4.2',